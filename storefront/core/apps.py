@@ -5,4 +5,8 @@ class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
 
+    def ready(self):
+        # execute_wrapper профилирования ставится на каждое новое соединение с БД
+        from . import profiling  # noqa: F401
+
 
@@ -0,0 +1,39 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from core import profiling
+
+
+class Command(BaseCommand):
+    help = 'Выводит накопленные метрики запросов по маршрутам и медленные SQL-запросы'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help='Сырые данные в JSON')
+        parser.add_argument('--slow', action='store_true', help='Показать медленные запросы')
+        parser.add_argument('--reset', action='store_true', help='Очистить после вывода')
+
+    def handle(self, *args, **options):
+        stats = profiling.get_stats()
+        if options['json']:
+            self.stdout.write(json.dumps(stats, ensure_ascii=False, indent=2))
+        else:
+            self.stdout.write(f'С {stats["since"]}')
+            self.stdout.write(f'{"маршрут":<40} {"запросов":>9} {"avg мс":>8} {"p95 мс":>7} '
+                              f'{"max мс":>8} {"SQL мс":>7} {"SQL шт":>7} {"сериал. мс":>10}')
+            for row in profiling.summary(stats):
+                self.stdout.write(
+                    f'{row["route"]:<40} {row["count"]:>9} {row["total_ms_avg"]:>8} '
+                    f'{row["total_ms_p95"] or ">2500":>7} {row["total_ms_max"]:>8} '
+                    f'{row["sql_ms_avg"]:>7} {row["sql_count_avg"]:>7} {row["serializer_ms_avg"]:>10}'
+                )
+
+        if options['slow'] and not options['json']:
+            for query in stats['slow_queries']:
+                self.stdout.write(f'\n{query["at"]} {query["route"]} {query["duration_ms"]} мс\n'
+                                  f'{query["sql"]}')
+                for frame in query['origin']:
+                    self.stdout.write(f'    {frame}')
+
+        if options['reset']:
+            profiling.reset_stats()
@@ -0,0 +1,399 @@
+"""
+Профилирование запросов: число и время SQL, время сериализаторов DRF и общее
+время ответа.
+
+Выключено по умолчанию: включается переменной окружения PROFILING_ENABLED=1
+(settings.PROFILING_ENABLED). Когда выключено, middleware сразу передает
+запрос дальше, а DRF не патчится.
+
+ProfilingMiddleware собирает метрики запроса и копит гистограммы по маршрутам
+(метод + имя url) в памяти процесса. Заголовок Server-Timing получают только
+staff-пользователи, всем - если PROFILING_SERVER_TIMING = True.
+Раз в PROFILING_FLUSH_INTERVAL секунд накопленное процессом записывается
+в его собственный файл в PROFILING_DIR (временный файл + os.replace - читатель
+никогда не видит файл наполовину). Общих файлов на запись нет, поэтому нет
+и межпроцессных замков; /profiling/ и manage.py dump_profiling сливают файлы
+всех процессов при чтении.
+Запросы к БД дольше PROFILING_SLOW_QUERY_MS сохраняются вместе с местом
+вызова в коде проекта.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+import traceback
+from contextvars import ContextVar
+from pathlib import Path
+from uuid import uuid4
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.serializers import BaseSerializer
+
+GENERATION_FILE = 'generation.json'
+PROCESS_FILE_PREFIX = 'process-'
+
+# Верхние границы корзин гистограмм; последняя - "все остальное"
+TIME_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, None)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, None)
+METRICS = {
+    'total_ms': TIME_BUCKETS,
+    'sql_ms': TIME_BUCKETS,
+    'serializer_ms': TIME_BUCKETS,
+    'sql_count': COUNT_BUCKETS,
+}
+
+PROJECT_ROOT = str(Path(settings.BASE_DIR))
+SKIP_FRAMES = (str(Path(__file__)), '/site-packages/', '/lib/python')
+
+current_profile = ContextVar('current_profile', default=None)
+
+
+def is_enabled():
+    return getattr(settings, 'PROFILING_ENABLED', False)
+
+
+def server_timing_allowed(request):
+    if getattr(settings, 'PROFILING_SERVER_TIMING', False):
+        return True
+    user = getattr(request, 'user', None)
+    return bool(user is not None and user.is_staff)
+
+
+def get_dir():
+    return Path(getattr(settings, 'PROFILING_DIR', Path(settings.BASE_DIR) / '.profiling'))
+
+
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.slow_queries = []
+
+    def metrics(self):
+        return {
+            'total_ms': (time.perf_counter() - self.started) * 1000,
+            'sql_ms': self.sql_time * 1000,
+            'serializer_ms': self.serializer_time * 1000,
+            'sql_count': self.sql_count,
+        }
+
+
+def profile_query(execute, sql, params, many, context):
+    """
+    execute_wrapper каждого соединения. Профиль запроса берется из ContextVar:
+    он виден и в потоках sync_to_async, где async ORM выполняет запросы.
+    """
+    profile = current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        profile.sql_count += 1
+        profile.sql_time += duration
+        if duration * 1000 >= getattr(settings, 'PROFILING_SLOW_QUERY_MS', 100):
+            profile.slow_queries.append({
+                'sql': sql,
+                'duration_ms': round(duration * 1000, 2),
+                'origin': stack_origin(),
+            })
+
+
+@receiver(connection_created)
+def install_query_wrapper(sender, connection, **kwargs):
+    if profile_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(profile_query)
+
+
+def stack_origin(limit=5):
+    """Ближайшие к запросу кадры стека из кода проекта."""
+    frames = [frame for frame in traceback.extract_stack()
+              if frame.filename.startswith(PROJECT_ROOT)
+              and not any(skip in frame.filename for skip in SKIP_FRAMES)]
+    return [f'{Path(frame.filename).relative_to(PROJECT_ROOT)}:{frame.lineno} in {frame.name}'
+            for frame in frames[-limit:]]
+
+
+def server_timing(metrics):
+    return ', '.join([
+        f'sql;dur={metrics["sql_ms"]:.1f};desc="{metrics["sql_count"]} queries"',
+        f'serializer;dur={metrics["serializer_ms"]:.1f}',
+        f'total;dur={metrics["total_ms"]:.1f}',
+    ])
+
+
+original_serializer_data = BaseSerializer.data
+
+
+def install_serializer_hook():
+    """
+    Хук DRF: время BaseSerializer.data - верхнеуровневой сериализации ответа
+    (вложенные сериализаторы вызывают to_representation, а не data).
+    Ставится только с включенным профилированием - при первом профилируемом запросе.
+    """
+    if getattr(BaseSerializer.data.fget, 'profiled', False):
+        return
+
+    def profiled_data(serializer):
+        profile = current_profile.get()
+        if profile is None:
+            return original_serializer_data.fget(serializer)
+        started = time.perf_counter()
+        try:
+            return original_serializer_data.fget(serializer)
+        finally:
+            profile.serializer_time += time.perf_counter() - started
+
+    profiled_data.profiled = True
+    BaseSerializer.data = property(profiled_data)
+
+
+def uninstall_serializer_hook():
+    BaseSerializer.data = original_serializer_data
+
+
+def bucket_index(buckets, value):
+    for index, bound in enumerate(buckets):
+        if bound is None or value <= bound:
+            return index
+
+
+def empty_route():
+    return {
+        'count': 0,
+        'metrics': {name: {'sum': 0, 'max': 0, 'buckets': [0] * len(buckets)}
+                    for name, buckets in METRICS.items()},
+    }
+
+
+def merge(stats, pending):
+    for route, data in pending['routes'].items():
+        target = stats['routes'].setdefault(route, empty_route())
+        target['count'] += data['count']
+        for name, metric in data['metrics'].items():
+            merged = target['metrics'][name]
+            merged['sum'] += metric['sum']
+            merged['max'] = max(merged['max'], metric['max'])
+            merged['buckets'] = [a + b for a, b in zip(merged['buckets'], metric['buckets'])]
+
+    limit = getattr(settings, 'PROFILING_SLOW_QUERY_SAMPLES', 50)
+    stats['slow_queries'] = (stats['slow_queries'] + pending['slow_queries'])[-limit:]
+    return stats
+
+
+def empty_stats():
+    return {'routes': {}, 'slow_queries': [], 'since': timezone.now().isoformat()}
+
+
+def write_json(path, data):
+    """Атомарная запись: файл либо старый, либо новый целиком."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    descriptor, temp_name = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+    try:
+        with os.fdopen(descriptor, 'w') as file:
+            json.dump(data, file)
+        os.replace(temp_name, path)
+    except BaseException:
+        os.unlink(temp_name)
+        raise
+
+
+def read_json(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def current_generation():
+    """
+    Метка текущего набора метрик (время последнего сброса). Создается один раз:
+    os.link не перезаписывает существующий файл, так что все процессы получают одну метку.
+    """
+    path = get_dir() / GENERATION_FILE
+    generation = read_json(path)
+    if generation is None:
+        candidate = get_dir() / f'.generation-{uuid4().hex}'
+        write_json(candidate, {'since': timezone.now().isoformat()})
+        try:
+            os.link(candidate, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(candidate)
+        generation = read_json(path)
+    return generation['since']
+
+
+class Collector:
+    """
+    Гистограммы процесса. Копятся в памяти и пачкой пишутся в файл процесса;
+    файлы процессов сливаются только при чтении (get_stats).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = empty_stats()
+        self.totals = None
+        self.pid = None
+        self.flushed_at = time.monotonic()
+
+    def flush_due(self):
+        return time.monotonic() - self.flushed_at >= getattr(settings, 'PROFILING_FLUSH_INTERVAL', 10)
+
+    def record(self, route, metrics, slow_queries):
+        with self.lock:
+            data = self.pending['routes'].setdefault(route, empty_route())
+            data['count'] += 1
+            for name, value in metrics.items():
+                metric = data['metrics'][name]
+                metric['sum'] += value
+                metric['max'] = max(metric['max'], value)
+                metric['buckets'][bucket_index(METRICS[name], value)] += 1
+            for query in slow_queries:
+                self.pending['slow_queries'].append({**query, 'route': route,
+                                                     'at': timezone.now().isoformat()})
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, empty_stats()
+            self.flushed_at = time.monotonic()
+            if not pending['routes'] and not pending['slow_queries']:
+                return
+
+            if self.pid != os.getpid():
+                # Новый процесс (в том числе после fork) - свой файл и свои итоги
+                self.pid, self.name, self.totals = os.getpid(), f'{PROCESS_FILE_PREFIX}{uuid4().hex}.json', None
+            since = current_generation()
+            if self.totals is None or self.totals['since'] != since:
+                # Метрики сбросили (reset_stats) - накопленное до сброса больше не нужно
+                self.totals = {**empty_stats(), 'since': since}
+            self.totals = merge(self.totals, pending)
+            write_json(get_dir() / self.name, self.totals)
+
+
+collector = Collector()
+
+
+def get_stats():
+    collector.flush()
+    since = current_generation()
+    stats = {**empty_stats(), 'since': since}
+    for path in sorted(get_dir().glob(f'{PROCESS_FILE_PREFIX}*.json')):
+        data = read_json(path)
+        if data is not None and data['since'] == since:
+            merge(stats, data)
+    return stats
+
+
+def reset_stats():
+    with collector.lock:
+        collector.pending = empty_stats()
+        collector.totals = None
+    write_json(get_dir() / GENERATION_FILE, {'since': timezone.now().isoformat()})
+    for path in get_dir().glob(f'{PROCESS_FILE_PREFIX}*.json'):
+        path.unlink(missing_ok=True)
+
+
+def percentile(buckets, bounds, fraction):
+    """Оценка перцентиля сверху: граница корзины, в которую он попал."""
+    total = sum(buckets)
+    if not total:
+        return None
+    seen = 0
+    for count, bound in zip(buckets, bounds):
+        seen += count
+        if seen >= total * fraction:
+            return bound
+    return None
+
+
+def summary(stats):
+    """Сводка по маршрутам, самые дорогие по суммарному времени - первыми."""
+    rows = []
+    for route, data in stats['routes'].items():
+        metrics = data['metrics']
+        count = data['count']
+        rows.append({
+            'route': route,
+            'count': count,
+            'total_ms_avg': round(metrics['total_ms']['sum'] / count, 2),
+            'total_ms_p50': percentile(metrics['total_ms']['buckets'], TIME_BUCKETS, 0.5),
+            'total_ms_p95': percentile(metrics['total_ms']['buckets'], TIME_BUCKETS, 0.95),
+            'total_ms_max': round(metrics['total_ms']['max'], 2),
+            'sql_ms_avg': round(metrics['sql_ms']['sum'] / count, 2),
+            'sql_count_avg': round(metrics['sql_count']['sum'] / count, 2),
+            'sql_count_max': metrics['sql_count']['max'],
+            'serializer_ms_avg': round(metrics['serializer_ms']['sum'] / count, 2),
+            'time_spent_ms': round(metrics['total_ms']['sum'], 2),
+        })
+    return sorted(rows, key=lambda row: row['time_spent_ms'], reverse=True)
+
+
+class ProfilingMiddleware:
+    """Работает и в WSGI, и в ASGI - не заставляет async-представления уходить в поток."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.acall(request)
+        if not is_enabled():
+            return self.get_response(request)
+
+        install_serializer_hook()
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+
+        self.finish(request, response, profile, server_timing_allowed(request))
+        if collector.flush_due():
+            collector.flush()
+        return response
+
+    async def acall(self, request):
+        if not is_enabled():
+            return await self.get_response(request)
+
+        install_serializer_hook()
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_profile.reset(token)
+
+        # request.user ленивый и ходит в БД - проверяем его в потоке
+        self.finish(request, response, profile, await sync_to_async(server_timing_allowed)(request))
+        if collector.flush_due():
+            await sync_to_async(collector.flush)()
+        return response
+
+    def finish(self, request, response, profile, expose):
+        metrics = profile.metrics()
+        if expose:
+            response['Server-Timing'] = server_timing(metrics)
+
+        match = request.resolver_match
+        route = f'{request.method} {match.view_name if match else "unresolved"}'
+        collector.record(route, metrics, profile.slow_queries)
@@ -1,3 +1,107 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from pathlib import Path
 
-# Create your tests here.
+from django.core.management import call_command
+from django.test import override_settings
+from rest_framework.serializers import BaseSerializer
+from rest_framework.test import APITestCase
+
+from core import profiling
+from core.models import User
+
+
+@override_settings(PROFILING_ENABLED=True)
+class ProfilingTests(APITestCase):
+    def setUp(self):
+        profiling_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profiling_dir, ignore_errors=True)
+        settings = override_settings(PROFILING_DIR=Path(profiling_dir))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(profiling.uninstall_serializer_hook)
+
+        profiling.reset_stats()
+        self.staff = User.objects.create(username='admin', email='admin@example.com', is_staff=True)
+
+    def test_server_timing_header_for_staff_only(self):
+        response = self.client.get('/collections/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response)
+
+        self.client.force_authenticate(self.staff)
+        response = self.client.get('/collections/')
+        self.assertRegex(response['Server-Timing'],
+                         r'^sql;dur=[\d.]+;desc="\d+ queries", serializer;dur=[\d.]+, total;dur=[\d.]+$')
+
+    @override_settings(PROFILING_SERVER_TIMING=True)
+    def test_server_timing_header_for_everyone(self):
+        self.assertIn('Server-Timing', self.client.get('/collections/'))
+
+    def test_routes_are_aggregated(self):
+        for _ in range(3):
+            self.client.get('/collections/')
+        self.client.force_authenticate(self.staff)
+        response = self.client.get('/profiling/')
+
+        routes = {row['route']: row for row in response.data['routes']}
+        self.assertEqual(routes['GET collection-list']['count'], 3)
+        self.assertEqual(sum(response.data['histograms']['GET collection-list']
+                             ['metrics']['total_ms']['buckets']), 3)
+
+    @override_settings(PROFILING_SLOW_QUERY_MS=0)
+    def test_slow_queries_keep_origin(self):
+        self.client.get('/collections/')
+        query = profiling.get_stats()['slow_queries'][0]
+        self.assertEqual(query['route'], 'GET collection-list')
+        self.assertTrue(any('store/' in frame for frame in query['origin']), query['origin'])
+
+    def test_staff_only_and_dump(self):
+        self.assertEqual(self.client.get('/profiling/').status_code, 401)
+        self.client.get('/collections/')
+        stdout = StringIO()
+        call_command('dump_profiling', stdout=stdout)
+        self.assertIn('GET collection-list', stdout.getvalue())
+
+    def test_process_files_are_merged_on_read(self):
+        other = profiling.Collector()
+        for collector in (profiling.collector, other):
+            collector.record('GET test', {'total_ms': 1, 'sql_ms': 0, 'serializer_ms': 0, 'sql_count': 1}, [])
+            collector.flush()
+        self.assertEqual(len(list(profiling.get_dir().glob('process-*.json'))), 2)
+        self.assertEqual(profiling.get_stats()['routes']['GET test']['count'], 2)
+
+        profiling.reset_stats()
+        self.assertEqual(profiling.get_stats()['routes'], {})
+        # Процесс, накопивший метрики до сброса, начинает с нуля
+        other.record('GET test', {'total_ms': 1, 'sql_ms': 0, 'serializer_ms': 0, 'sql_count': 1}, [])
+        other.flush()
+        self.assertEqual(profiling.get_stats()['routes']['GET test']['count'], 1)
+
+    def test_parallel_flushes_do_not_lose_requests(self):
+        def record(_):
+            profiling.collector.record('GET test', {'total_ms': 1, 'sql_ms': 0, 'serializer_ms': 0,
+                                                    'sql_count': 1}, [])
+            profiling.collector.flush()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(record, range(40)))
+        self.assertEqual(profiling.get_stats()['routes']['GET test']['count'], 40)
+
+    async def test_async_views_are_profiled(self):
+        with override_settings(PROFILING_SERVER_TIMING=True):
+            response = await self.async_client.get('/async/collections/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+
+
+@override_settings(PROFILING_ENABLED=False, PROFILING_SERVER_TIMING=True)
+class ProfilingDisabledTests(APITestCase):
+    def test_nothing_is_collected_or_patched(self):
+        profiling.uninstall_serializer_hook()
+        response = self.client.get('/collections/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response)
+        self.assertFalse(getattr(BaseSerializer.data.fget, 'profiled', False))
@@ -0,0 +1,7 @@
+from django.urls import path
+
+from . import views
+
+urlpatterns = [
+    path('profiling/', views.ProfilingView.as_view(), name='profiling'),
+]
@@ -1,3 +1,24 @@
-from django.shortcuts import render
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
-# Create your views here.
+from . import profiling
+
+
+class ProfilingView(APIView):
+    """Гистограммы по маршрутам и медленные запросы (см. core.profiling)."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        stats = profiling.get_stats()
+        return Response({
+            'since': stats['since'],
+            'routes': profiling.summary(stats),
+            'histograms': stats['routes'],
+            'buckets': {name: buckets for name, buckets in profiling.METRICS.items()},
+            'slow_queries': stats['slow_queries'],
+        })
+
+    def delete(self, request):
+        profiling.reset_stats()
+        return Response(status=204)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from likes.models import LikeCounter
+
+
+class Command(BaseCommand):
+    help = 'Сверяет LikeCounter с реальным числом лайков и исправляет расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать расхождения')
+
+    def handle(self, *args, **options):
+        drift = LikeCounter.objects.reconcile(dry_run=options['dry_run'])
+        for (content_type_id, object_id), (stored, actual) in sorted(drift.items()):
+            self.stdout.write(f'Объект {content_type_id}:{object_id}: {stored} -> {actual}')
+        self.stdout.write(self.style.SUCCESS(f'Расхождений: {len(drift)}'))
@@ -0,0 +1,64 @@
+# Generated by Django 4.2.6 on 2026-10-18 03:01
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+import django.db.models.deletion
+
+
+def remove_duplicate_likes(apps, schema_editor):
+    # Без этого уникальное ограничение не создать на старых данных
+    LikedItem = apps.get_model('likes', 'LikedItem')
+    duplicates = LikedItem.objects.order_by().values('user', 'content_type', 'object_id') \
+        .annotate(first_id=Min('id'), count=Count('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        LikedItem.objects.filter(user=duplicate['user'], content_type=duplicate['content_type'],
+                                 object_id=duplicate['object_id']) \
+            .exclude(pk=duplicate['first_id']).delete()
+
+
+def fill_like_counters(apps, schema_editor):
+    LikedItem = apps.get_model('likes', 'LikedItem')
+    LikeCounter = apps.get_model('likes', 'LikeCounter')
+    LikeCounter.objects.bulk_create([
+        LikeCounter(content_type_id=row['content_type'], object_id=row['object_id'], count=row['count'])
+        for row in LikedItem.objects.order_by().values('content_type', 'object_id')
+        .annotate(count=Count('id'))
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('likes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LikeCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='likeditem',
+            index=models.Index(fields=['content_type', 'object_id'], name='likes_item_object_idx'),
+        ),
+        migrations.RunPython(remove_duplicate_likes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='likeditem',
+            constraint=models.UniqueConstraint(fields=('user', 'content_type', 'object_id'), name='likes_unique_user_object'),
+        ),
+        migrations.AddField(
+            model_name='likecounter',
+            name='content_type',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype'),
+        ),
+        migrations.AddConstraint(
+            model_name='likecounter',
+            constraint=models.UniqueConstraint(fields=('content_type', 'object_id'), name='likes_counter_unique_object'),
+        ),
+        migrations.RunPython(fill_like_counters, migrations.RunPython.noop),
+    ]
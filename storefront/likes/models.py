@@ -2,12 +2,104 @@ from django.db import models
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
+from django.db.models import Count, F
 # Create your models here.
 
+
+class LikedItemManager(models.Manager):
+    def like(self, user, obj):
+        """Возвращает True, если лайк поставлен сейчас, и False, если он уже был."""
+        _, created = self.get_or_create(
+            user=user,
+            content_type=ContentType.objects.get_for_model(obj),
+            object_id=obj.pk,
+        )
+        return created
+
+    def unlike(self, user, obj):
+        deleted, _ = self.filter(
+            user=user,
+            content_type=ContentType.objects.get_for_model(obj),
+            object_id=obj.pk,
+        ).delete()
+        return bool(deleted)
+
+    def liked_ids(self, user, obj_type, obj_ids):
+        """id объектов из obj_ids, которые лайкнул user - один запрос по индексу (user, тип, id)."""
+        if not user.is_authenticated:
+            return set()
+        return set(self.filter(
+            user=user,
+            content_type=ContentType.objects.get_for_model(obj_type),
+            object_id__in=set(obj_ids),
+        ).values_list('object_id', flat=True))
+
+
 class LikedItem(models.Model):
+    objects = LikedItemManager()
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
 
+    class Meta:
+        constraints = [
+            # Индекс ограничения отвечает и на "что лайкнул пользователь"
+            models.UniqueConstraint(fields=['user', 'content_type', 'object_id'],
+                                    name='likes_unique_user_object'),
+        ]
+        indexes = [
+            models.Index(fields=['content_type', 'object_id'], name='likes_item_object_idx'),
+        ]
+
+
+class LikeCounterManager(models.Manager):
+    def change(self, content_type_id, object_id, delta):
+        counter, _ = self.get_or_create(content_type_id=content_type_id, object_id=object_id)
+        self.filter(pk=counter.pk, count__gte=-delta).update(count=F('count') + delta)
+
+    def counts(self, obj_type, obj_ids):
+        """{object_id: число лайков} одним запросом; объекты без лайков - 0."""
+        obj_ids = list(obj_ids)
+        counts = dict.fromkeys(obj_ids, 0)
+        counts.update(self.filter(
+            content_type=ContentType.objects.get_for_model(obj_type),
+            object_id__in=set(obj_ids),
+        ).values_list('object_id', 'count'))
+        return counts
+
+    def reconcile(self, dry_run=False):
+        """
+        Пересчитывает счетчики по таблице лайков там, где они разошлись.
+        Возвращает {(content_type_id, object_id): (было, стало)}.
+        """
+        actual = {
+            (content_type_id, object_id): count for content_type_id, object_id, count in
+            LikedItem.objects.order_by().values('content_type_id', 'object_id')
+            .annotate(count=Count('id')).values_list('content_type_id', 'object_id', 'count')
+        }
+        stored = {
+            (content_type_id, object_id): count for content_type_id, object_id, count in
+            self.values_list('content_type_id', 'object_id', 'count')
+        }
+        drift = {key: (stored.get(key, 0), actual.get(key, 0))
+                 for key in stored.keys() | actual.keys() if stored.get(key, 0) != actual.get(key, 0)}
+        if not dry_run:
+            for (content_type_id, object_id), (_, count) in drift.items():
+                self.update_or_create(content_type_id=content_type_id, object_id=object_id,
+                                      defaults={'count': count})
+        return drift
+
+
+class LikeCounter(models.Model):
+    """Денормализованное число лайков объекта, поддерживается сигналами (likes.signals)."""
+    objects = LikeCounterManager()
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    count = models.PositiveIntegerField(default=0)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_type', 'object_id'],
+                                    name='likes_counter_unique_object'),
+        ]
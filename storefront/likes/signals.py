@@ -0,0 +1,15 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import LikeCounter, LikedItem
+
+
+@receiver(post_save, sender=LikedItem)
+def increment_like_counter(sender, instance, created, **kwargs):
+    if created:
+        LikeCounter.objects.change(instance.content_type_id, instance.object_id, 1)
+
+
+@receiver(post_delete, sender=LikedItem)
+def decrement_like_counter(sender, instance, **kwargs):
+    LikeCounter.objects.change(instance.content_type_id, instance.object_id, -1)
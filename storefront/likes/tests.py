@@ -1,3 +1,48 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
 from django.test import TestCase
 
-# Create your tests here.
+from core.models import User
+from .models import LikeCounter, LikedItem
+
+
+class LikeCounterTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username=f'user{index}', email=f'user{index}@example.com')
+                      for index in range(3)]
+        self.target = self.users[0]
+
+    def test_counter_follows_likes(self):
+        for user in self.users:
+            self.assertTrue(LikedItem.objects.like(user, self.target))
+        self.assertFalse(LikedItem.objects.like(self.users[1], self.target))
+        self.assertEqual(LikeCounter.objects.counts(User, [self.target.pk, self.users[1].pk]),
+                         {self.target.pk: 3, self.users[1].pk: 0})
+
+        self.assertTrue(LikedItem.objects.unlike(self.users[1], self.target))
+        self.assertFalse(LikedItem.objects.unlike(self.users[1], self.target))
+        # Каскадное удаление лайков вместе с пользователем
+        self.users[2].delete()
+        self.assertEqual(LikeCounter.objects.counts(User, [self.target.pk]), {self.target.pk: 1})
+
+    def test_duplicate_like_is_rejected_by_database(self):
+        LikedItem.objects.like(self.users[1], self.target)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            LikedItem.objects.create(user=self.users[1], content_object=self.target)
+
+    def test_liked_ids(self):
+        LikedItem.objects.like(self.users[1], self.users[0])
+        LikedItem.objects.like(self.users[1], self.users[2])
+        with self.assertNumQueries(1):
+            liked = LikedItem.objects.liked_ids(self.users[1], User, [user.pk for user in self.users])
+        self.assertEqual(liked, {self.users[0].pk, self.users[2].pk})
+
+    def test_reconcile(self):
+        LikedItem.objects.like(self.users[1], self.target)
+        LikeCounter.objects.update(count=7)
+        stdout = StringIO()
+        call_command('reconcile_like_counts', stdout=stdout)
+        self.assertIn('7 -> 1', stdout.getvalue())
+        self.assertEqual(LikeCounter.objects.counts(User, [self.target.pk]), {self.target.pk: 1})
@@ -1,3 +1,52 @@
-from django.shortcuts import render
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.response import Response
 
-# Create your views here.
+from .models import LikeCounter, LikedItem
+
+MAX_LIKE_IDS = 100
+
+
+class LikesMixin:
+    """
+    Лайки для ModelViewSet:
+    POST/DELETE <объект>/like/ - поставить/снять лайк,
+    GET likes/?ids=1,2,3 - счетчики и "лайкнул ли я" для страницы объектов.
+
+    Счетчики в сериализованный каталог не попадают - иначе каждый лайк
+    сбрасывал бы кеш каталога; клиент запрашивает их отдельно.
+    """
+
+    def get_liked_object(self, pk):
+        obj = self.get_queryset().model.objects.filter(pk=pk).only('pk').first()
+        if obj is None:
+            raise NotFound()
+        return obj
+
+    @action(detail=True, methods=['POST', 'DELETE'], permission_classes=[IsAuthenticated])
+    def like(self, request, pk=None):
+        obj = self.get_liked_object(pk)
+        if request.method == 'POST':
+            LikedItem.objects.like(request.user, obj)
+        else:
+            LikedItem.objects.unlike(request.user, obj)
+        return Response({
+            'id': obj.pk,
+            'likes': LikeCounter.objects.counts(obj, [obj.pk])[obj.pk],
+            'liked': request.method == 'POST',
+        })
+
+    @action(detail=False, methods=['GET'], url_path='likes', permission_classes=[AllowAny])
+    def likes(self, request):
+        try:
+            ids = [int(pk) for pk in request.query_params.get('ids', '').split(',') if pk]
+        except ValueError:
+            raise ValidationError({'ids': 'Ожидается список id через запятую'})
+        if len(ids) > MAX_LIKE_IDS:
+            raise ValidationError({'ids': f'Не больше {MAX_LIKE_IDS} id за запрос'})
+
+        model = self.get_queryset().model
+        counts = LikeCounter.objects.counts(model, ids)
+        liked = LikedItem.objects.liked_ids(request.user, model, ids)
+        return Response([{'id': pk, 'likes': counts[pk], 'liked': pk in liked} for pk in counts])
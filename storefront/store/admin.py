@@ -1,9 +1,9 @@
 from django.contrib import admin
-from django.db.models.aggregates import Count
 from django.db.models.query import QuerySet
 from django.utils.html import format_html, urlencode
 from django.urls import reverse
 from . import models
+from .images import variant_urls
 
 
 # Register your models here.
@@ -28,7 +28,10 @@ class ProductImageInline(admin.TabularInline):
 
     def thumbnail(self, instance):
         if instance.image.name != '':
-            return format_html(f'<img src="{instance.image.url}"  class="thumbnail">')
+            # Самый маленький вариант, если воркер его уже сгенерировал
+            urls = variant_urls(instance)
+            url = urls[min(urls, key=int)] if urls else instance.image.url
+            return format_html(f'<img src="{url}"  class="thumbnail">')
         return ''
 
 @admin.register(models.Product)
@@ -75,11 +78,6 @@ class CollectionAdmin(admin.ModelAdmin):
         })
         )
         return format_html(f'<a href="{url}">{collection.products_count} Products</a>')
-    
-    def get_queryset(self, request):
-        return super().get_queryset(request).annotate(
-            products_count=Count('product')
-        )
 
 # @admin.register(models.Customer)
 # class CustomerAdmin(admin.ModelAdmin):
@@ -116,4 +114,10 @@ class OrderItemInline(admin.TabularInline):
 @admin.register(models.Order)
 class OrderAdmin(admin.ModelAdmin):
     inlines = [OrderItemInline]
-    list_display = ['id', 'placed_at', 'customer']
\ No newline at end of file
+    list_display = ['id', 'placed_at', 'customer']
+
+@admin.register(models.OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ['id', 'topic', 'status', 'attempts', 'available_at', 'created_at']
+    list_filter = ['status', 'topic']
+    readonly_fields = ['created_at', 'processed_at']
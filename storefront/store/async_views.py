@@ -0,0 +1,239 @@
+"""
+Async-представления каталога только для чтения (запуск под ASGI:
+uvicorn/daphne storefront.asgi:application).
+
+Отдают то же, что ProductViewSet/CollectionViewSet/ReviewViewSet для GET,
+но через async ORM и async-кеш и не занимают поток на запрос. Фильтры,
+поиск и сортировка товаров - те же бэкенды, что у ProductViewSet; курсорная
+пагинация не поддерживается (400) - для нее есть основной API.
+
+Одновременные запросы одного и того же ресурса в процессе объединяются
+(coalesce): в БД идет только первый, остальные ждут его результат.
+"""
+import asyncio
+from functools import wraps
+from hashlib import md5
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.http import HttpResponseNotAllowed, JsonResponse
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.request import Request
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .cache import (CATALOG_SCOPE, REVIEW_STATS_SCOPE, aget_version, catalog_timeout, collection_scope,
+                    product_scope, reviews_scope)
+from .filters import collection_pk
+from .images import variant_urls
+from .models import RATINGS, Collection, Product, ProductImage, Review, ReviewStats
+from .pagination import DefaultPagination, ReviewPagination
+from .pricing import aget_prices
+from .serializers import review_stats_representation
+from .views import ProductViewSet
+from tags.models import TaggedItem
+
+PAGE_SIZE = DefaultPagination.page_size
+STATS_FIELDS = ['reviews_count', 'ratings_count', 'ratings_sum'] + [f'rating_{rating}' for rating in RATINGS]
+PRODUCT_FIELDS = ['id', 'title', 'unit_price', 'description', 'slug', 'inventory', 'collection_id'] + \
+    [f'review_stats__{field}' for field in STATS_FIELDS]
+
+_inflight = {}
+
+
+async def coalesce(key, fetch):
+    """
+    Выполняет fetch() один раз для всех одновременных вызовов с тем же ключом.
+    Отмена одного из ожидающих не отменяет общую загрузку.
+    """
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fetch())
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    return await asyncio.shield(task)
+
+
+async def cached(request, kind, scopes, fetch):
+    """Ответ из кеша каталога, иначе - одна загрузка на все одновременные запросы."""
+    version = '.'.join([str(await aget_version(scope)) for scope in scopes])
+    raw = repr((request.get_host(), request.get_full_path()))
+    key = f'async:{kind}:{version}:{md5(raw.encode()).hexdigest()}'
+
+    async def load():
+        data = await cache.aget(key)
+        if data is None:
+            data = await fetch()
+            if data is not None:
+                await cache.aset(key, data, catalog_timeout())
+        return data
+
+    return await coalesce(key, load)
+
+
+def read_only(view):
+    # django.views.decorators.http.require_safe поддерживает async-представления только с Django 5.0
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def not_found():
+    return JsonResponse({'detail': 'Not found.'}, status=404)
+
+
+def json_response(data):
+    return JsonResponse(data, encoder=JSONEncoder, safe=False)
+
+
+def page_number(request):
+    try:
+        number = int(request.GET.get('page', 1))
+    except ValueError:
+        return None
+    return number if number > 0 else None
+
+
+def page_links(request, number, count):
+    url = request.build_absolute_uri()
+    next_link = replace_query_param(url, 'page', number + 1) if number * PAGE_SIZE < count else None
+    if number == 1:
+        previous_link = None
+    elif number == 2:
+        previous_link = remove_query_param(url, 'page')
+    else:
+        previous_link = replace_query_param(url, 'page', number - 1)
+    return next_link, previous_link
+
+
+def filter_products(request):
+    """
+    Товары с фильтрами, поиском и сортировкой ProductViewSet - те же проверки
+    и сообщения об ошибках (ValidationError). Запрос к товарам еще не выполнен.
+    """
+    view = ProductViewSet(request=Request(request), format_kwarg=None, action='list', kwargs={})
+    return view.filter_queryset(Product.objects.all())
+
+
+async def serialize_products(request, products):
+    """То же, что ProductSerializer(many=True): цены и метки - одним вызовом на список."""
+    ids = [product['id'] for product in products]
+    prices = await aget_prices(ids)
+    tags = await TaggedItem.objects.aget_tags_for_many(Product, ids)
+
+    images = {pk: [] for pk in ids}
+    async for image in ProductImage.objects.filter(product_id__in=ids).order_by('id'):
+        images[image.product_id].append({
+            'id': image.pk,
+            'image': request.build_absolute_uri(image.image.url) if image.image else None,
+            'variants': variant_urls(image, request),
+        })
+
+    return [{
+        'id': product['id'],
+        'title': product['title'],
+        'price': product['unit_price'],
+        'description': product['description'],
+        'slug': product['slug'],
+        'inventory': product['inventory'],
+        'discount': prices[product['id']].discount,
+        'discounted_price': prices[product['id']].price,
+        'price_with_tax': prices[product['id']].price_with_tax,
+        'images': images[product['id']],
+        'tags': tags[product['id']],
+        'review_stats': review_stats_representation(ReviewStats(**{
+            field: product[f'review_stats__{field}'] or 0 for field in STATS_FIELDS
+        })),
+        'collection': product['collection_id'],
+    } for product in products]
+
+
+@read_only
+async def product_list(request):
+    cursor_param = DefaultPagination.keyset_class.cursor_query_param
+    if cursor_param in request.GET:
+        return JsonResponse({cursor_param: ['Курсорная пагинация доступна только в /products/']},
+                            status=400)
+    number = page_number(request)
+    if number is None:
+        return not_found()
+
+    async def fetch():
+        # Ошибка фильтров не кешируется и достается всем, кто ждал этот же запрос
+        queryset = await sync_to_async(filter_products)(request)
+        count = await queryset.acount()
+        start = (number - 1) * PAGE_SIZE
+        if start and start >= count:
+            return None
+        products = [product async for product in
+                    queryset.values(*PRODUCT_FIELDS)[start:start + PAGE_SIZE]]
+        next_link, previous_link = page_links(request, number, count)
+        return {
+            'count': count,
+            'next': next_link,
+            'previous': previous_link,
+            'results': await serialize_products(request, products),
+        }
+
+    collection_id = collection_pk(request.GET.get('collection_id'))
+    if collection_id is not None:
+        scopes = [collection_scope(collection_id)]
+    else:
+        scopes = [CATALOG_SCOPE, REVIEW_STATS_SCOPE]
+    try:
+        data = await cached(request, 'products', scopes, fetch)
+    except ValidationError as error:
+        return JsonResponse(error.detail, status=400)
+    return json_response(data) if data is not None else not_found()
+
+
+@read_only
+async def product_detail(request, pk):
+    async def fetch():
+        product = await Product.objects.filter(pk=pk).values(*PRODUCT_FIELDS).afirst()
+        if product is None:
+            return None
+        return (await serialize_products(request, [product]))[0]
+
+    data = await cached(request, 'product', [CATALOG_SCOPE, product_scope(pk)], fetch)
+    return json_response(data) if data is not None else not_found()
+
+
+@read_only
+async def collection_list(request):
+    async def fetch():
+        return [collection async for collection in
+                Collection.objects.values('id', 'title', 'products_count')]
+
+    return json_response(await cached(request, 'collections', [CATALOG_SCOPE], fetch))
+
+
+@read_only
+async def review_list(request, product_pk):
+    sort = request.GET.get('sort', Review.SORT_NEWEST)
+    if sort not in Review.SORTS:
+        return JsonResponse({'sort': [f'Допустимые значения: {", ".join(Review.SORTS)}']}, status=400)
+
+    async def fetch():
+        # Та же курсорная пагинация, что у ReviewViewSet, но запросы - через async ORM
+        queryset = Review.objects.sorted_for(product_pk, sort)
+        paginator, drf_request = ReviewPagination(), Request(request)
+        page_queryset = paginator.get_page_queryset(queryset, drf_request)
+        paginator.count = await queryset.acount() if paginator.wants_count(drf_request) else None
+        reviews = paginator.set_page([review async for review in page_queryset])
+        return paginator.get_paginated_response([{
+            'id': review.pk,
+            'date': review.date,
+            'name': review.name,
+            'description': review.description,
+            'rating': review.rating,
+        } for review in reviews]).data
+
+    try:
+        data = await cached(request, 'reviews', [reviews_scope(product_pk)], fetch)
+    except NotFound as error:
+        return JsonResponse({'detail': str(error.detail)}, status=404)
+    return json_response(data)
@@ -0,0 +1,92 @@
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+
+CATALOG_SCOPE = 'catalog'
+# Сводки отзывов в списках товаров без фильтра по категории
+REVIEW_STATS_SCOPE = f'{CATALOG_SCOPE}:review_stats'
+
+
+def get_version(scope):
+    version = cache.get(f'version:{scope}')
+    if version is None:
+        cache.add(f'version:{scope}', 1, timeout=None)
+        version = cache.get(f'version:{scope}', 1)
+    return version
+
+
+async def aget_version(scope):
+    version = await cache.aget(f'version:{scope}')
+    if version is None:
+        await cache.aadd(f'version:{scope}', 1, timeout=None)
+        version = await cache.aget(f'version:{scope}', 1)
+    return version
+
+
+def bump_version(scope):
+    try:
+        return cache.incr(f'version:{scope}')
+    except ValueError:
+        # Ключа еще нет (или он был вытеснен) - начинаем новый отсчет
+        cache.add(f'version:{scope}', 1, timeout=None)
+        return cache.incr(f'version:{scope}')
+
+
+def collection_scope(collection_id):
+    return f'{CATALOG_SCOPE}:collection:{collection_id}'
+
+
+def product_scope(product_id):
+    return f'{CATALOG_SCOPE}:product:{product_id}'
+
+
+def reviews_scope(product_id):
+    return f'reviews:product:{product_id}'
+
+
+def cart_scope(cart_id):
+    return f'cart:{cart_id}'
+
+
+def bump_catalog(*collection_ids):
+    """Инвалидирует каталог целиком и страницы указанных категорий."""
+    for collection_id in set(collection_ids):
+        if collection_id is not None:
+            bump_version(collection_scope(collection_id))
+    bump_version(CATALOG_SCOPE)
+
+
+def bump_review_stats(product_id, collection_id):
+    """
+    Инвалидирует страницы, где показана сводка отзывов товара:
+    сам товар, его категорию и списки без фильтра по категории.
+    """
+    bump_version(product_scope(product_id))
+    if collection_id is not None:
+        bump_version(collection_scope(collection_id))
+    bump_version(REVIEW_STATS_SCOPE)
+
+
+def catalog_key(request, kind, collection_id=None, scopes=(), **extra):
+    """
+    Ключ кеша для страницы каталога.
+
+    В ключ входят все параметры запроса (фильтры, поиск, сортировка, страница)
+    и версия: категории - если список отфильтрован по ней, иначе всего каталога.
+    Версии дополнительных областей из scopes тоже входят в ключ.
+    """
+    if collection_id is not None:
+        versions = [get_version(collection_scope(collection_id))]
+    else:
+        versions = [get_version(CATALOG_SCOPE)]
+    versions += [get_version(scope) for scope in scopes]
+
+    version = '.'.join(map(str, versions))
+    params = sorted(request.query_params.lists())
+    raw = repr((request.get_host(), params, sorted(extra.items())))
+    return f'{CATALOG_SCOPE}:{kind}:{collection_id}:{version}:{md5(raw.encode()).hexdigest()}'
+
+
+def catalog_timeout():
+    return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 15)
@@ -0,0 +1,204 @@
+"""
+Корзины в кеше (settings.CART_STORAGE = 'cache').
+
+Корзина анонимного посетителя живет в кеше CART_CACHE_ALIAS (LocMem для
+разработки, Redis - django.core.cache.backends.redis.RedisCache - в проде)
+и не пишет в БД ни при одном изменении. В строки Cart/CartItem она
+превращается только при оформлении заказа (materialize() внутри транзакции
+CreateOrderSerializer, под замком корзины до ее удаления из кеша). API carts/ не меняется, id позиции в этом режиме
+совпадает с id товара.
+
+Кеш не умеет атомарно менять часть значения, поэтому каждое изменение
+выполняется под коротким замком на cache.add. Замок держится, только если
+add() атомарен: Redis (SET NX), Memcached (add), база (уникальный ключ),
+LocMem (блокировка внутри процесса - годится только для одного процесса).
+FileBasedCache читает и пишет файл раздельно, DummyCache ничего не хранит -
+с ними get_cache() отказывается работать. Срок жизни корзины - CART_TTL
+с момента последнего изменения.
+"""
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+from uuid import UUID, uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound
+
+from .cache import bump_version, cart_scope
+from .models import Cart, CartItem, Product
+from .pricing import get_prices
+
+STORAGE_DATABASE = 'database'
+STORAGE_CACHE = 'cache'
+
+LOCK_TIMEOUT = 5
+LOCK_WAIT = 2.0
+# Бэкенды, у которых add() не атомарен - замок корзины на них не работает
+NON_ATOMIC_BACKENDS = (FileBasedCache, DummyCache)
+
+
+class CartBusy(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Корзина изменяется другим запросом, повторите попытку'
+    default_code = 'cart_busy'
+
+
+def is_enabled():
+    return getattr(settings, 'CART_STORAGE', STORAGE_DATABASE) == STORAGE_CACHE
+
+
+def get_cache():
+    alias = getattr(settings, 'CART_CACHE_ALIAS', 'carts')
+    cache = caches[alias]
+    if isinstance(cache, NON_ATOMIC_BACKENDS):
+        raise ImproperlyConfigured(
+            f'Кеш "{alias}" ({type(cache).__name__}) не подходит для корзин: '
+            f'нужен бэкенд с атомарным add() - Redis, Memcached, база или LocMem'
+        )
+    return cache
+
+
+def cart_key(cart_id):
+    return f'cart:data:{cart_id}'
+
+
+def lock_key(cart_id):
+    return f'{cart_key(cart_id)}:lock'
+
+
+def normalize_id(cart_id):
+    try:
+        return str(UUID(str(cart_id)))
+    except ValueError:
+        raise NotFound('Корзина не найдена')
+
+
+def ttl():
+    return int(settings.CART_TTL.total_seconds())
+
+
+@contextmanager
+def locked(cart_id):
+    cache = get_cache()
+    key = lock_key(cart_id)
+    token = uuid4().hex
+    deadline = time.monotonic() + LOCK_WAIT
+    while not cache.add(key, token, LOCK_TIMEOUT):
+        if time.monotonic() > deadline:
+            raise CartBusy()
+        time.sleep(0.005)
+    try:
+        yield
+    finally:
+        # Замок мог истечь (LOCK_TIMEOUT) и достаться другому запросу - снимаем только свой
+        if cache.get(key) == token:
+            cache.delete(key)
+
+
+def create():
+    cart_id = str(uuid4())
+    get_cache().set(cart_key(cart_id), {'created_at': timezone.now(), 'items': {}}, ttl())
+    return cart_id
+
+
+def load(cart_id):
+    """Возвращает {'created_at': ..., 'items': {product_id: quantity}} или NotFound."""
+    cart = get_cache().get(cart_key(normalize_id(cart_id)))
+    if cart is None:
+        raise NotFound('Корзина не найдена')
+    return cart
+
+
+def get_quantities(cart_id):
+    return dict(load(cart_id)['items'])
+
+
+def delete(cart_id):
+    cart_id = normalize_id(cart_id)
+    if not get_cache().delete(cart_key(cart_id)):
+        raise NotFound('Корзина не найдена')
+    bump_version(cart_scope(cart_id))
+
+
+def change(cart_id, add=None, update=None, remove=()):
+    """
+    Применяет изменения целиком или никак. Возвращает словарь ошибок
+    в формате BulkCartItemsSerializer ({} - все применено).
+    """
+    cart_id = normalize_id(cart_id)
+    with locked(cart_id):
+        cart = load(cart_id)
+        items = dict(cart['items'])
+        errors = {}
+
+        if add:
+            existing = set(Product.objects.filter(pk__in=add).values_list('pk', flat=True))
+            for product_id, quantity in add.items():
+                if product_id in existing:
+                    items[product_id] = items.get(product_id, 0) + quantity
+            if set(add) - existing:
+                errors['add'] = [f'Нет товара с id {pk}' for pk in sorted(set(add) - existing)]
+
+        if update:
+            missing = set(update) - items.keys()
+            if missing:
+                errors['update'] = [f'Товара с id {pk} нет в корзине' for pk in sorted(missing)]
+            items.update((pk, quantity) for pk, quantity in update.items() if pk in items)
+
+        if remove:
+            missing = set(remove) - items.keys()
+            if missing:
+                errors['remove'] = [f'Товара с id {pk} нет в корзине' for pk in sorted(missing)]
+            for product_id in remove:
+                items.pop(product_id, None)
+
+        if not errors:
+            get_cache().set(cart_key(cart_id), {**cart, 'items': items}, ttl())
+            bump_version(cart_scope(cart_id))
+        return errors
+
+
+def materialize(cart_id):
+    """
+    Записывает корзину в Cart/CartItem с тем же id. Вызывать внутри
+    транзакции оформления: при откате строки исчезнут, корзина в кеше останется.
+    """
+    cart = load(cart_id)
+    Cart.objects.create(id=normalize_id(cart_id))
+    existing = Product.objects.filter(pk__in=cart['items']).values_list('pk', flat=True)
+    CartItem.objects.bulk_create([
+        CartItem(cart_id=normalize_id(cart_id), product_id=product_id,
+                 quantity=cart['items'][product_id])
+        for product_id in existing
+    ])
+
+
+def item_representation(product, quantity, price):
+    return {
+        'id': product.pk,
+        'product': {'id': product.pk, 'title': product.title, 'unit_price': product.unit_price},
+        'quantity': quantity,
+        'price': price.price,
+        'total_price': quantity * price.price,
+    }
+
+
+def representation(cart_id):
+    """То же, что CartSerializer для корзины из БД."""
+    quantities = get_quantities(cart_id)
+    products = Product.objects.filter(pk__in=quantities).only('id', 'title', 'unit_price') \
+        .order_by('id')
+    prices = get_prices(products)
+    items = [item_representation(product, quantities[product.pk], prices[product.pk])
+             for product in products]
+    return {
+        'id': normalize_id(cart_id),
+        'items': items,
+        'total_price': sum((item['total_price'] for item in items), Decimal('0.00')),
+    }
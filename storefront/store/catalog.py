@@ -0,0 +1,262 @@
+"""
+Импорт и экспорт каталога (manage.py import_catalog / export_catalog).
+
+Файл читается и пишется построчно (CSV или NDJSON), в БД записи уходят
+пачками через bulk_create/bulk_update - память не зависит от размера фида.
+Естественные ключи: товар - slug, категория - title, акция - description.
+bulk-операции не вызывают сигналы, поэтому поисковый индекс, products_count,
+превью картинок и версия кеша каталога обновляются здесь же.
+"""
+import csv
+import json
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from . import outbox
+from .cache import bump_catalog
+from .models import Collection, Product, ProductImage, Promotion
+from .pricing import invalidate_prices
+from .search import index_products
+
+KINDS = ('products', 'collections', 'promotions')
+FORMATS = ('csv', 'ndjson')
+
+FIELDS = {
+    'products': ['slug', 'title', 'description', 'unit_price', 'inventory',
+                 'collection', 'promotions', 'images'],
+    'collections': ['title'],
+    'promotions': ['description', 'discount'],
+}
+# В CSV списки пишутся в одну ячейку через разделитель
+LIST_FIELDS = {'promotions', 'images'}
+LIST_SEPARATOR = '|'
+
+
+def read_records(file, fmt):
+    if fmt == 'csv':
+        for record in csv.DictReader(file):
+            for field in LIST_FIELDS & record.keys():
+                record[field] = [item for item in (record[field] or '').split(LIST_SEPARATOR) if item]
+            yield record
+    else:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def write_records(file, fmt, kind, records):
+    fields = FIELDS[kind]
+    if fmt == 'csv':
+        writer = csv.DictWriter(file, fields)
+        writer.writeheader()
+
+    total = 0
+    for record in records:
+        if fmt == 'csv':
+            writer.writerow({field: LIST_SEPARATOR.join(value) if field in LIST_FIELDS else value
+                             for field, value in record.items()})
+        else:
+            file.write(json.dumps(record, ensure_ascii=False, cls=DjangoJSONEncoder) + '\n')
+        total += 1
+    return total
+
+
+def export_records(kind, chunk_size=2000):
+    if kind == 'collections':
+        titles = Collection.objects.order_by('id').values_list('title', flat=True)
+        for title in titles.iterator(chunk_size=chunk_size):
+            yield {'title': title}
+    elif kind == 'promotions':
+        promotions = Promotion.objects.order_by('id').values_list('description', 'discount')
+        for description, discount in promotions.iterator(chunk_size=chunk_size):
+            yield {'description': description, 'discount': discount}
+    else:
+        # С chunk_size prefetch_related выполняется отдельно для каждой пачки
+        products = Product.objects.select_related('collection') \
+            .prefetch_related('promotion', 'images').order_by('id')
+        for product in products.iterator(chunk_size=chunk_size):
+            yield {
+                'slug': product.slug,
+                'title': product.title,
+                'description': product.description or '',
+                'unit_price': product.unit_price,
+                'inventory': product.inventory,
+                'collection': product.collection.title,
+                'promotions': [promotion.description for promotion in product.promotion.all()],
+                'images': [image.image.name for image in product.images.all()],
+            }
+
+
+def clean_value(model, name, value, label=None):
+    try:
+        return model._meta.get_field(name).clean(value, None)
+    except ValidationError as error:
+        raise ValidationError(f'{label or name}: {"; ".join(error.messages)}')
+
+
+class CatalogImport:
+    """
+    Импортирует записи одного вида. Невалидные записи пропускаются и
+    попадают в errors как (номер записи, сообщение); каждая пачка
+    пишется в своей транзакции.
+    """
+
+    def __init__(self, kind, chunk_size=1000):
+        self.kind = kind
+        self.chunk_size = chunk_size
+        self.created = self.updated = 0
+        self.errors = []
+        self.collections = {}
+        self.promotions = {}
+        self.touched_collections = set()
+
+    def run(self, records):
+        clean = getattr(self, f'clean_{self.kind}')
+        save = getattr(self, f'save_{self.kind}')
+
+        numbered = enumerate(records, start=1)
+        while chunk := list(islice(numbered, self.chunk_size)):
+            rows = []
+            for number, record in chunk:
+                try:
+                    rows.append((number, clean(record)))
+                except ValidationError as error:
+                    self.errors.append((number, '; '.join(error.messages)))
+            if rows:
+                with transaction.atomic():
+                    save(rows)
+
+        if self.kind == 'products' and self.touched_collections:
+            Collection.objects.reconcile_products_count(self.touched_collections)
+        bump_catalog(*self.touched_collections)
+        return self
+
+    def clean_collections(self, record):
+        return {'title': clean_value(Collection, 'title', record.get('title'))}
+
+    def clean_promotions(self, record):
+        return {
+            'description': clean_value(Promotion, 'description', record.get('description')),
+            'discount': clean_value(Promotion, 'discount', record.get('discount')),
+        }
+
+    def clean_products(self, record):
+        row = {name: clean_value(Product, name, record.get(name))
+               for name in ('slug', 'title', 'unit_price', 'inventory')}
+        row['description'] = record.get('description') or None
+        row['collection'] = clean_value(Collection, 'title', record.get('collection'), 'collection')
+        # Отсутствующая колонка - не трогать связи, пустой список - очистить
+        row['promotions'] = record.get('promotions')
+        row['images'] = record.get('images')
+        return row
+
+    def resolve_collections(self, titles):
+        missing = set(titles) - self.collections.keys()
+        if missing:
+            existing = Collection.objects.filter(title__in=missing).order_by('-id')
+            self.collections.update((title, pk) for pk, title in existing.values_list('id', 'title'))
+            new = [Collection(title=title) for title in missing - self.collections.keys()]
+            Collection.objects.bulk_create(new)
+            self.collections.update((collection.title, collection.pk) for collection in new)
+            self.created += len(new) if self.kind == 'collections' else 0
+        return self.collections
+
+    def resolve_promotions(self, descriptions):
+        missing = set(descriptions) - self.promotions.keys()
+        if missing:
+            existing = Promotion.objects.filter(description__in=missing).order_by('-id')
+            self.promotions.update((description, pk) for pk, description
+                                   in existing.values_list('id', 'description'))
+        return self.promotions
+
+    def save_collections(self, rows):
+        self.resolve_collections(row['title'] for _, row in rows)
+
+    def save_promotions(self, rows):
+        by_description = {row['description']: row for _, row in rows}
+        existing = self.resolve_promotions(by_description)
+
+        promotions = [Promotion(id=existing.get(description), **row)
+                      for description, row in by_description.items()]
+        to_create = [promotion for promotion in promotions if promotion.id is None]
+        to_update = [promotion for promotion in promotions if promotion.id is not None]
+        Promotion.objects.bulk_create(to_create)
+        Promotion.objects.bulk_update(to_update, ['discount'])
+        if to_update:
+            affected = list(Product.objects.filter(promotion__in=to_update).order_by()
+                            .values_list('id', 'collection_id').distinct())
+            transaction.on_commit(lambda: invalidate_prices([product_id for product_id, _ in affected]))
+            self.touched_collections.update(collection_id for _, collection_id in affected)
+        self.promotions.update((promotion.description, promotion.pk) for promotion in to_create)
+        self.created += len(to_create)
+        self.updated += len(to_update)
+
+    def save_products(self, rows):
+        collections = self.resolve_collections(row['collection'] for _, row in rows)
+        promotions = self.resolve_promotions(
+            description for _, row in rows for description in row['promotions'] or ()
+        )
+
+        by_slug = {}
+        for number, row in rows:
+            unknown = [description for description in row['promotions'] or ()
+                       if description not in promotions]
+            if unknown:
+                self.errors.append((number, f'promotions: нет акций {", ".join(unknown)}'))
+            else:
+                by_slug[row['slug']] = row
+
+        # При дублях slug в базе обновляется самый старый товар
+        existing = {}
+        for pk, slug, collection_id in Product.objects.filter(slug__in=by_slug) \
+                .order_by('-id').values_list('id', 'slug', 'collection_id'):
+            existing[slug] = pk
+            self.touched_collections.add(collection_id)
+
+        now = timezone.now()
+        products = [
+            Product(id=existing.get(slug), slug=slug, title=row['title'],
+                    description=row['description'], unit_price=row['unit_price'],
+                    inventory=row['inventory'], collection_id=collections[row['collection']],
+                    last_update=now)
+            for slug, row in by_slug.items()
+        ]
+        to_create = [product for product in products if product.id is None]
+        to_update = [product for product in products if product.id is not None]
+        Product.objects.bulk_create(to_create)
+        Product.objects.bulk_update(to_update, ['title', 'description', 'unit_price', 'inventory',
+                                                'collection', 'last_update'])
+        self.created += len(to_create)
+        self.updated += len(to_update)
+        self.touched_collections.update(product.collection_id for product in products)
+
+        self.save_promotion_links(products, by_slug, promotions)
+        self.save_images(products, by_slug)
+        index_products((product.id, product.title, product.description) for product in products)
+        # Иначе до фиксации пачки в кеш снова попали бы старые цены
+        product_ids = [product.id for product in products]
+        transaction.on_commit(lambda: invalidate_prices(product_ids))
+
+    def save_promotion_links(self, products, by_slug, promotions):
+        Link = Product.promotion.through
+        products = [product for product in products if by_slug[product.slug]['promotions'] is not None]
+        Link.objects.filter(product_id__in=[product.id for product in products]).delete()
+        Link.objects.bulk_create([
+            Link(product_id=product.id, promotion_id=promotions[description])
+            for product in products for description in set(by_slug[product.slug]['promotions'])
+        ])
+
+    def save_images(self, products, by_slug):
+        products = [product for product in products if by_slug[product.slug]['images'] is not None]
+        existing = set(ProductImage.objects.filter(product_id__in=[product.id for product in products])
+                       .values_list('product_id', 'image'))
+        images = ProductImage.objects.bulk_create([
+            ProductImage(product_id=product.id, image=name)
+            for product in products for name in dict.fromkeys(by_slug[product.slug]['images'])
+            if (product.id, name) not in existing
+        ])
+        outbox.enqueue_many('product_image.uploaded', [{'image_id': image.pk} for image in images])
@@ -1,5 +1,6 @@
+from django.core.exceptions import ValidationError
 from django_filters.rest_framework import FilterSet
-from .models import Product
+from .models import Collection, Product
 
 
 class ProductFilter(FilterSet):
@@ -10,3 +11,13 @@ class ProductFilter(FilterSet):
             'unit_price': ['gt', 'lt']
         }
 
+
+def collection_pk(value):
+    """
+    Id категории из ?collection_id= в том виде, в каком его сравнивает фильтр
+    ('05' и '5' - одна категория), без запроса к БД. None - если id нет или он некорректен.
+    """
+    try:
+        return Collection._meta.pk.to_python(value)
+    except ValidationError:
+        return None
@@ -0,0 +1,95 @@
+"""
+Уменьшенные WebP-варианты картинок товаров.
+
+Оригинал (до 500KB) отдавать в списках дорого, поэтому после загрузки воркер
+outbox (manage.py process_outbox) генерирует варианты шириной VARIANT_WIDTHS
+и сохраняет их имена в ProductImage.variants.
+"""
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from . import outbox
+from .cache import bump_catalog
+from .models import Product, ProductImage
+
+VARIANT_WIDTHS = (160, 480, 960)
+VARIANT_FORMAT = 'WEBP'
+VARIANT_QUALITY = 80
+
+
+def needs_variants(image):
+    return bool(image.image.name) and image.variants.get('source') != image.image.name
+
+
+def variant_name(name, width):
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, 'variants', f'{stem}_{width}w.webp')
+
+
+def render_variants(source):
+    """Возвращает {ширина: bytes}. Картинки не увеличиваются."""
+    source = ImageOps.exif_transpose(source)
+    source = source.convert('RGBA' if 'A' in source.getbands() or source.mode == 'P' else 'RGB')
+
+    rendered = {}
+    for width in VARIANT_WIDTHS:
+        target = min(width, source.width)
+        if target in rendered:
+            break
+        variant = source.copy()
+        variant.thumbnail((target, source.height), Image.LANCZOS)
+        buffer = BytesIO()
+        variant.save(buffer, VARIANT_FORMAT, quality=VARIANT_QUALITY, method=4)
+        rendered[target] = buffer.getvalue()
+    return rendered
+
+
+def delete_variant_files(storage, variants, keep=()):
+    for key, name in variants.items():
+        if key != 'source' and name not in keep:
+            storage.delete(name)
+
+
+def generate_variants(image):
+    storage = image.image.storage
+    with image.image.open('rb') as file:
+        with Image.open(file) as source:
+            rendered = render_variants(source)
+
+    variants = {'source': image.image.name}
+    for width, content in rendered.items():
+        name = variant_name(image.image.name, width)
+        if storage.exists(name):
+            storage.delete(name)
+        variants[str(width)] = storage.save(name, ContentFile(content))
+
+    ProductImage.objects.filter(pk=image.pk).update(variants=variants)
+    # Картинку заменили - варианты прежнего файла больше не нужны
+    delete_variant_files(storage, image.variants, keep=variants.values())
+    image.variants = variants
+
+    # Ссылки на варианты попадают в сериализованный каталог
+    bump_catalog(Product.objects.filter(pk=image.product_id)
+                 .values_list('collection_id', flat=True).first())
+    return variants
+
+
+def variant_urls(image, request=None):
+    urls = {}
+    for key, name in image.variants.items():
+        if key == 'source' or image.variants.get('source') != image.image.name:
+            continue
+        url = image.image.storage.url(name)
+        urls[key] = request.build_absolute_uri(url) if request is not None else url
+    return urls
+
+
+@outbox.handler('product_image.uploaded')
+def process_uploaded_image(image_id):
+    image = ProductImage.objects.filter(pk=image_id).first()
+    if image is not None and needs_variants(image):
+        generate_variants(image)
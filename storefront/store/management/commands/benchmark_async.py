@@ -0,0 +1,127 @@
+import asyncio
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+
+from store.models import Collection, Product, Review
+from .run_benchmarks import percentile
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает чтение каталога при высокой конкурентности: DRF в потоках (как WSGI-сервер '
+            'с пулом потоков) и async-представления (store.async_views) в одном цикле событий')
+
+    SCENARIOS = ['product_list', 'product_detail', 'collection_list', 'review_list']
+    MODES = ['wsgi', 'asgi_async']
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--scenarios', nargs='+', choices=self.SCENARIOS, default=self.SCENARIOS)
+        parser.add_argument('--modes', nargs='+', choices=self.MODES, default=self.MODES)
+        parser.add_argument('--hot', type=int, default=20,
+                            help='Сколько разных ресурсов запрашивается (меньше - больше совпадений)')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='Записать JSON в файл, а не в stdout')
+
+    def handle(self, *args, **options):
+        products = list(Product.objects.values_list('pk', flat=True)[:options['hot']])
+        if not products:
+            raise CommandError('Нет данных для бенчмарка, сначала выполните manage.py generate_data')
+
+        self.options = options
+        rng = random.Random(options['seed'])
+        reviewed = list(Review.objects.values_list('product_id', flat=True).distinct()[:options['hot']])
+        pages = range(1, max(1, min(5, Product.objects.count() // 10)) + 1)
+        paths = {
+            'product_list': lambda prefix: f'{prefix}products/?page={rng.choice(pages)}',
+            'product_detail': lambda prefix: f'{prefix}products/{rng.choice(products)}/',
+            'collection_list': lambda prefix: f'{prefix}collections/',
+            'review_list': lambda prefix: f'{prefix}products/{rng.choice(reviewed or products)}/reviews/',
+        }
+
+        results = {}
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for name in options['scenarios']:
+                results[name] = {}
+                for mode in options['modes']:
+                    prefix = '/async/' if mode == 'asgi_async' else '/'
+                    urls = [paths[name](prefix) for _ in range(options['requests'])]
+                    # Каждый режим начинает с пустого кеша
+                    cache.clear()
+                    results[name][mode] = self.run(mode, urls)
+
+        report = {
+            'meta': {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'hot': options['hot'],
+                'collections': Collection.objects.count(),
+                'products': Product.objects.count(),
+            },
+            'scenarios': results,
+        }
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output)
+            self.stdout.write(self.style.SUCCESS(f'Результаты записаны в {options["output"]}'))
+        else:
+            self.stdout.write(output)
+
+    def run(self, mode, urls):
+        started = time.perf_counter()
+        if mode == 'wsgi':
+            samples = self.run_threads(urls)
+        else:
+            samples = asyncio.run(self.run_async(urls))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency for latency, _ in samples)
+        return {
+            'requests': len(samples),
+            'errors': sum(status >= 400 for _, status in samples),
+            'throughput_rps': round(len(samples) / elapsed, 2),
+            'latency_ms': {
+                'p50': round(percentile(latencies, 0.50), 3),
+                'p95': round(percentile(latencies, 0.95), 3),
+                'max': round(latencies[-1], 3),
+            },
+        }
+
+    def run_threads(self, urls):
+        def fetch(url):
+            started = time.perf_counter()
+            try:
+                status = Client().get(url).status_code
+            finally:
+                connection.close()
+            return (time.perf_counter() - started) * 1000, status
+
+        with ThreadPoolExecutor(max_workers=self.options['concurrency']) as pool:
+            return list(pool.map(fetch, urls))
+
+    async def run_async(self, urls):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(self.options['concurrency'])
+
+        async def fetch(url):
+            async with semaphore:
+                started = time.perf_counter()
+                status = (await client.get(url)).status_code
+                return (time.perf_counter() - started) * 1000, status
+
+        try:
+            return await asyncio.gather(*[fetch(url) for url in urls])
+        finally:
+            # Запросы async ORM выполняются в общем потоке sync_to_async
+            await sync_to_async(connections.close_all)()
@@ -0,0 +1,100 @@
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import DecimalField, F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, Greatest, Least, Round
+from django.test.utils import CaptureQueriesContext
+
+from store.models import Cart, CartItem, Collection, Product
+from store.pricing import get_prices
+from store.serializers import CartSerializer
+from store.views import CartViewSet
+
+
+def sql_cart_total(cart_id):
+    """
+    Сумма корзины одним агрегатом в БД - вариант для сравнения, в приложении
+    не используется: повторяет правила calculate_price() на SQL.
+    """
+    best = Product.promotion.through.objects.filter(product_id=OuterRef('product_id')) \
+        .order_by().values('product_id').annotate(best=Max('promotion__discount')).values('best')
+    discount = Least(Greatest(Coalesce(Subquery(best), Value(0.0)), Value(0.0)), Value(100.0))
+    discount = Cast(discount, DecimalField(max_digits=5, decimal_places=2))
+    # Умножение на 0.01, а не деление на 100: в SQLite это было бы целочисленное деление
+    price = Round(F('product__unit_price') * (100 - discount) * Value(Decimal('0.01')), 2,
+                  output_field=DecimalField(max_digits=8, decimal_places=2))
+    total = CartItem.objects.filter(cart_id=cart_id).annotate(price=price) \
+        .aggregate(total=Sum(F('quantity') * F('price'),
+                             output_field=DecimalField(max_digits=12, decimal_places=2)))['total']
+    return Decimal(total or 0).quantize(Decimal('0.01'))
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает расчет сумм корзины на корзинах разного размера: полные строки товаров, '
+            'нужные поля + store.pricing (как в CartViewSet), агрегат в БД и весь ответ CartViewSet')
+
+    VARIANTS = ['full_rows', 'only_fields', 'sql', 'response']
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 50, 500])
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        functions = {'full_rows': self.full_rows_total, 'only_fields': self.only_fields_total,
+                     'sql': sql_cart_total, 'response': self.response_total}
+        self.stdout.write(f'{"строк":>6} ' + ' '.join(f'{name + ", мс":>16} {"запросов":>9}'
+                                                       for name in self.VARIANTS) + f' {"суммы равны":>12}')
+        # Все тестовые данные откатываются
+        with transaction.atomic():
+            for size in options['sizes']:
+                cart = self.create_cart(size)
+                results = [self.measure(functions[name], cart.pk, options['repeat']) for name in self.VARIANTS]
+                same = len({total for _, _, total in results}) == 1
+                self.stdout.write(f'{size:>6} ' + ' '.join(f'{ms:>16.2f} {queries:>9}'
+                                                           for ms, queries, _ in results)
+                                  + f' {"да" if same else "нет":>12}')
+            transaction.set_rollback(True)
+
+    def create_cart(self, size):
+        collection = Collection.objects.create(title='benchmark')
+        products = Product.objects.bulk_create([
+            Product(title=f'benchmark {index}', slug=f'benchmark-{index}',
+                    unit_price=Decimal('10.55') + index % 90, inventory=100, collection=collection)
+            for index in range(size)
+        ])
+        cart = Cart.objects.create()
+        CartItem.objects.bulk_create([CartItem(cart=cart, product=product, quantity=2)
+                                      for product in products])
+        return cart
+
+    def measure(self, func, cart_id, repeat):
+        timings = []
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                result = func(cart_id)
+                timings.append((time.perf_counter() - started) * 1000)
+        # Запросы последнего прогона: цены к этому моменту уже в кеше
+        return statistics.median(timings), len(queries), result
+
+    @staticmethod
+    def full_rows_total(cart_id):
+        # Прежний способ: полные строки товаров и арифметика в Python
+        cart = Cart.objects.prefetch_related('items__product').get(pk=cart_id)
+        items = list(cart.items.all())
+        prices = get_prices(item.product for item in items)
+        return sum(item.quantity * prices[item.product_id].price for item in items)
+
+    @staticmethod
+    def only_fields_total(cart_id):
+        # Строки, которые CartViewSet загружает для ответа все равно, и сумма по ним
+        items = list(CartViewSet.queryset.get(pk=cart_id).items.all())
+        prices = get_prices(item.product for item in items)
+        return sum((item.quantity * prices[item.product_id].price for item in items), Decimal('0.00'))
+
+    @staticmethod
+    def response_total(cart_id):
+        return CartSerializer(CartViewSet.queryset.get(pk=cart_id)).data['total_price']
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from store.catalog import FORMATS, KINDS, export_records, write_records
+
+
+class Command(BaseCommand):
+    help = 'Выгружает каталог в CSV/NDJSON потоково (iterator), не загружая его в память'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help='Файл или "-" для stdout')
+        parser.add_argument('--kind', choices=KINDS, default='products')
+        parser.add_argument('--format', choices=FORMATS,
+                            help='По умолчанию определяется по расширению файла')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        records = export_records(options['kind'], options['chunk_size'])
+
+        if path == '-':
+            write_records(self.stdout, fmt, options['kind'], records)
+            return
+
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            total = write_records(file, fmt, options['kind'], records)
+        self.stdout.write(self.style.SUCCESS(f'Выгружено записей: {total}'))
@@ -0,0 +1,148 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from store.cache import bump_catalog
+from store.models import Collection, Customer, Order, OrderItem, Product, Promotion, Review, ReviewStats
+from store.search import rebuild_index
+
+ADJECTIVES = ['organic', 'fresh', 'classic', 'premium', 'spicy', 'sweet', 'green', 'dark',
+              'light', 'crispy', 'smoked', 'roasted', 'frozen', 'wild', 'golden', 'mild']
+NOUNS = ['tea', 'coffee', 'juice', 'cookie', 'cheese', 'bread', 'honey', 'chocolate',
+         'pasta', 'rice', 'salmon', 'yogurt', 'butter', 'olive oil', 'granola', 'lemonade']
+WORDS = ADJECTIVES + NOUNS + ['pack', 'bottle', 'jar', 'imported', 'local', 'recipe',
+                              'family', 'size', 'natural', 'blend', 'taste', 'morning']
+
+
+class Command(BaseCommand):
+    help = 'Заполняет БД синтетическими данными для бенчмарков (manage.py run_benchmarks)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--collections', type=int, default=20)
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--customers', type=int, default=500)
+        parser.add_argument('--orders', type=int, default=3000)
+        parser.add_argument('--reviews', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--prefix', default='bench',
+                            help='Префикс имен пользователей, чтобы генерировать данные повторно')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        prefix = options['prefix']
+        User = get_user_model()
+        if User.objects.filter(username__startswith=f'{prefix}_').exists():
+            raise CommandError(f'Пользователи с префиксом "{prefix}" уже есть, задайте --prefix')
+
+        with transaction.atomic():
+            collections = self.create_collections(options['collections'])
+            products = self.create_products(options['products'], collections)
+            customers = self.create_customers(options['customers'], prefix)
+            orders = self.create_orders(options['orders'], customers, products)
+            reviews = self.create_reviews(options['reviews'], products)
+
+        # bulk_create не вызывает сигналы - досчитываем производные данные сами
+        rebuild_index()
+        Collection.objects.reconcile_products_count([collection.pk for collection in collections])
+        bump_catalog(*[collection.pk for collection in collections])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Категорий: {len(collections)}, товаров: {len(products)}, покупателей: {len(customers)}, '
+            f'заказов: {orders}, отзывов: {reviews}'
+        ))
+
+    def popular(self, items, count, exponent=1.1):
+        """Выбор с распределением Ципфа: первые элементы намного популярнее."""
+        weights = [1 / (rank ** exponent) for rank in range(1, len(items) + 1)]
+        return self.rng.choices(items, weights=weights, k=count)
+
+    def create_collections(self, count):
+        return Collection.objects.bulk_create(
+            [Collection(title=f'{self.rng.choice(ADJECTIVES).title()} {noun}s #{index}')
+             for index, noun in enumerate(self.rng.choices(NOUNS, k=count))],
+            batch_size=self.batch_size
+        )
+
+    def create_products(self, count, collections):
+        products = []
+        for index, collection in enumerate(self.popular(collections, count)):
+            title = f'{self.rng.choice(ADJECTIVES).title()} {self.rng.choice(NOUNS)} {index}'
+            # Цены - логнормальные: много дешевых товаров и длинный хвост дорогих
+            price = min(max(self.rng.lognormvariate(3.5, 0.8), 1), 9999)
+            products.append(Product(
+                title=title,
+                slug=title.lower().replace(' ', '-'),
+                description=' '.join(self.rng.choices(WORDS, k=self.rng.randint(5, 30))),
+                unit_price=Decimal(f'{price:.2f}'),
+                inventory=0 if self.rng.random() < 0.05 else self.rng.randint(1, 500),
+                collection=collection,
+            ))
+        products = Product.objects.bulk_create(products, batch_size=self.batch_size)
+
+        promotions = Promotion.objects.bulk_create([
+            Promotion(description=f'Скидка {discount}%', discount=discount)
+            for discount in (5, 10, 15, 25, 50)
+        ])
+        Link = Product.promotion.through
+        Link.objects.bulk_create([
+            Link(product_id=product.pk, promotion_id=self.rng.choice(promotions).pk)
+            for product in products if self.rng.random() < 0.1
+        ], batch_size=self.batch_size)
+        return products
+
+    def create_customers(self, count, prefix):
+        User = get_user_model()
+        users = User.objects.bulk_create([
+            # "!" в начале - неиспользуемый пароль, без дорогого хеширования
+            User(username=f'{prefix}_{index}', email=f'{prefix}_{index}@example.com',
+                 first_name=f'Name{index}', last_name=f'Surname{index}', password='!')
+            for index in range(count)
+        ], batch_size=self.batch_size)
+        return Customer.objects.bulk_create([
+            Customer(user=user, phone=f'+7900{index:07d}',
+                     membership=self.rng.choices('BSG', weights=[80, 15, 5])[0])
+            for index, user in enumerate(users)
+        ], batch_size=self.batch_size)
+
+    def create_orders(self, count, customers, products):
+        if not customers or not products:
+            return 0
+        # Немногие покупатели делают большую часть заказов
+        orders = Order.objects.bulk_create([
+            Order(customer=customer, payment_status=self.rng.choices('CPF', weights=[80, 15, 5])[0])
+            for customer in self.popular(customers, count, exponent=0.8)
+        ], batch_size=self.batch_size)
+
+        # placed_at - auto_now_add, поэтому даты за последний год проставляются отдельно
+        now = timezone.now()
+        for order in orders:
+            order.placed_at = now - timedelta(seconds=self.rng.randint(0, 365 * 24 * 3600))
+        Order.objects.bulk_update(orders, ['placed_at'], batch_size=self.batch_size)
+
+        items = []
+        for order in orders:
+            size = self.rng.choices([1, 2, 3, 4, 5], weights=[40, 25, 15, 12, 8])[0]
+            for product in set(self.popular(products, size)):
+                items.append(OrderItem(order=order, product=product, unit_price=product.unit_price,
+                                       quantity=self.rng.choices([1, 2, 3], weights=[70, 20, 10])[0]))
+        OrderItem.objects.bulk_create(items, batch_size=self.batch_size)
+        return len(orders)
+
+    def create_reviews(self, count, products):
+        if not products:
+            return 0
+        reviews = Review.objects.bulk_create([
+            Review(product=product, name=f'Покупатель {self.rng.randint(1, 10000)}',
+                   description=' '.join(self.rng.choices(WORDS, k=self.rng.randint(3, 40))),
+                   rating=self.rng.choices([None, 1, 2, 3, 4, 5], weights=[10, 5, 5, 15, 30, 35])[0])
+            for product in self.popular(products, count)
+        ], batch_size=self.batch_size)
+        ReviewStats.objects.rebuild([product.pk for product in products])
+        return len(reviews)
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from store import outbox
+from store.images import generate_variants, needs_variants
+from store.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = 'Генерирует WebP-варианты для уже загруженных картинок товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Перегенерировать и те, у которых варианты уже есть')
+        parser.add_argument('--enqueue', action='store_true',
+                            help='Не обрабатывать сразу, а поставить в очередь воркеру outbox')
+
+    def handle(self, *args, **options):
+        done = failed = 0
+        for image in ProductImage.objects.order_by('id').iterator(chunk_size=500):
+            if not options['force'] and not needs_variants(image):
+                continue
+            if options['enqueue']:
+                outbox.enqueue('product_image.uploaded', image_id=image.pk)
+                done += 1
+                continue
+            try:
+                generate_variants(image)
+                done += 1
+            except (OSError, ValueError) as error:
+                failed += 1
+                self.stderr.write(f'Картинка {image.pk} ({image.image.name}): {error}')
+
+        self.stdout.write(self.style.SUCCESS(f'Обработано: {done}, с ошибкой: {failed}'))
@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.catalog import FORMATS, KINDS, CatalogImport, read_records
+
+
+class Command(BaseCommand):
+    help = 'Загружает каталог из CSV/NDJSON (upsert товаров по slug) потоково, пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл или "-" для stdin')
+        parser.add_argument('--kind', choices=KINDS, default='products')
+        parser.add_argument('--format', choices=FORMATS,
+                            help='По умолчанию определяется по расширению файла')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+
+        file = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            result = CatalogImport(options['kind'], options['chunk_size']) \
+                .run(read_records(file, fmt))
+        except ValueError as error:
+            raise CommandError(f'Не удалось прочитать {path}: {error}')
+        finally:
+            if file is not sys.stdin:
+                file.close()
+
+        for number, message in result.errors:
+            self.stderr.write(f'Запись {number}: {message}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано: {result.created}, обновлено: {result.updated}, '
+            f'пропущено с ошибкой: {len(result.errors)}'
+        ))
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store import outbox
+
+
+class Command(BaseCommand):
+    help = 'Доставляет события из outbox обработчикам (повторы с экспоненциальной задержкой)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--max-attempts', type=int, default=outbox.MAX_ATTEMPTS)
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Пауза в секундах, когда очередь пуста')
+        parser.add_argument('--once', action='store_true',
+                            help='Разобрать очередь и выйти')
+
+    def handle(self, *args, **options):
+        total_delivered = total_failed = 0
+        try:
+            while True:
+                delivered, failed = outbox.process_batch(options['batch_size'],
+                                                         options['max_attempts'])
+                total_delivered += delivered
+                total_failed += failed
+                if delivered or failed:
+                    self.stdout.write(f'Доставлено: {delivered}, с ошибкой: {failed}')
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Итого доставлено: {total_delivered}, с ошибкой: {total_failed}'
+        ))
@@ -0,0 +1,60 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store.models import Cart
+
+
+class Command(BaseCommand):
+    help = 'Удаляет брошенные корзины старше CART_TTL пачками и выводит метрики прогона'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            help='Срок жизни корзины в днях (по умолчанию settings.CART_TTL)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--max-batches', type=int,
+                            help='Остановиться после стольких пачек')
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Пауза между пачками в секундах')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только посчитать просроченные корзины')
+
+    def handle(self, *args, **options):
+        ttl = timezone.timedelta(days=options['days']) if options['days'] is not None \
+            else settings.CART_TTL
+        cutoff = timezone.now() - ttl
+
+        if options['dry_run']:
+            expired = Cart.objects.filter(created_at__lt=cutoff).count()
+            self.stdout.write(f'Просроченных корзин (созданы до {cutoff:%Y-%m-%d %H:%M}): {expired}')
+            return
+
+        started = time.monotonic()
+        batches = carts = items = 0
+        slowest = 0.0
+        batch_started = time.monotonic()
+        for deleted_carts, deleted_items in Cart.objects.purge_expired(cutoff, options['batch_size']):
+            elapsed = time.monotonic() - batch_started
+            batches += 1
+            carts += deleted_carts
+            items += deleted_items
+            slowest = max(slowest, elapsed)
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Пачка {batches}: корзин {deleted_carts}, позиций {deleted_items}, '
+                                  f'{elapsed * 1000:.0f} мс')
+            if options['max_batches'] and batches >= options['max_batches']:
+                break
+            if options['sleep']:
+                time.sleep(options['sleep'])
+            batch_started = time.monotonic()
+
+        duration = time.monotonic() - started
+        remaining = Cart.objects.filter(created_at__lt=cutoff).count()
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено корзин: {carts}, позиций: {items}, пачек: {batches}, '
+            f'время: {duration:.2f} с, самая долгая пачка: {slowest * 1000:.0f} мс, '
+            f'скорость: {carts / duration if duration else 0:.0f} корзин/с, '
+            f'осталось просроченных: {remaining}'
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from store.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс товаров (FTS5 / tsvector)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        total = rebuild_index(options['database'], options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано товаров: {total}'))
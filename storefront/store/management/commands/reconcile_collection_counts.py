@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from store.cache import bump_catalog
+from store.models import Collection
+
+
+class Command(BaseCommand):
+    help = 'Сверяет Collection.products_count с реальным числом товаров и исправляет расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать расхождения')
+
+    def handle(self, *args, **options):
+        drift = Collection.objects.reconcile_products_count(dry_run=options['dry_run'])
+        for collection_id, (stored, actual) in sorted(drift.items()):
+            self.stdout.write(f'Категория {collection_id}: {stored} -> {actual}')
+
+        if drift and not options['dry_run']:
+            bump_catalog(*drift)
+        self.stdout.write(self.style.SUCCESS(f'Расхождений: {len(drift)}'))
@@ -0,0 +1,166 @@
+import json
+import platform
+import random
+import time
+
+import django
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+
+from store.models import Collection, Customer, Order, Product
+
+
+def percentile(values, fraction):
+    """Перцентиль по ближайшему рангу; values отсортированы."""
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, round(fraction * len(values) + 0.5) - 1))
+    return values[index]
+
+
+class Command(BaseCommand):
+    help = 'Прогоняет ключевые маршруты API через тестовый клиент и выводит метрики в JSON'
+
+    SCENARIOS = ['product_list', 'product_search', 'product_filter', 'product_detail',
+                 'cart_add', 'checkout', 'order_list']
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--scenarios', nargs='+', choices=self.SCENARIOS, default=self.SCENARIOS)
+        parser.add_argument('--cold', action='store_true',
+                            help='Очищать кеш перед каждым запросом')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='Записать JSON в файл, а не в stdout')
+
+    def handle(self, *args, **options):
+        if not Product.objects.filter(inventory__gt=100).exists() or not Customer.objects.exists():
+            raise CommandError('Нет данных для бенчмарка, сначала выполните manage.py generate_data')
+
+        self.rng = random.Random(options['seed'])
+        self.options = options
+        self.client = APIClient()
+        self.products = list(Product.objects.filter(inventory__gt=100).values_list('pk', flat=True)[:500])
+        self.collections = list(Collection.objects.values_list('pk', flat=True))
+        customer = Customer.objects.filter(order__isnull=False).select_related('user') \
+            .order_by('pk').first() or Customer.objects.select_related('user').first()
+        self.user = customer.user
+
+        results = {}
+        # Все изменения (корзины, заказы, остатки) откатываются после прогона
+        with override_settings(ALLOWED_HOSTS=['testserver']), transaction.atomic():
+            for name in options['scenarios']:
+                results[name] = self.run_scenario(name)
+            transaction.set_rollback(True)
+
+        report = {
+            'meta': {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'iterations': options['iterations'],
+                'warmup': options['warmup'],
+                'cold_cache': options['cold'],
+                'seed': options['seed'],
+                'data': {
+                    'products': Product.objects.count(),
+                    'collections': len(self.collections),
+                    'customers': Customer.objects.count(),
+                    'orders': Order.objects.count(),
+                },
+            },
+            'scenarios': results,
+        }
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output)
+            self.stdout.write(self.style.SUCCESS(f'Результаты записаны в {options["output"]}'))
+        else:
+            self.stdout.write(output)
+
+    def run_scenario(self, name):
+        prepare = getattr(self, f'prepare_{name}')
+        for _ in range(self.options['warmup']):
+            self.request(*prepare())
+
+        latencies, queries, errors = [], [], 0
+        started = time.perf_counter()
+        for _ in range(self.options['iterations']):
+            method, url, data = prepare()
+            if self.options['cold']:
+                cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                request_started = time.perf_counter()
+                response = self.request(method, url, data)
+                latencies.append((time.perf_counter() - request_started) * 1000)
+            queries.append(len(context))
+            errors += response.status_code >= 400
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            'requests': len(latencies),
+            'errors': errors,
+            # С учетом подготовки данных между запросами - оценка снизу
+            'throughput_rps': round(len(latencies) / elapsed, 2),
+            'latency_ms': {
+                'mean': round(sum(latencies) / len(latencies), 3),
+                'p50': round(percentile(latencies, 0.50), 3),
+                'p90': round(percentile(latencies, 0.90), 3),
+                'p95': round(percentile(latencies, 0.95), 3),
+                'p99': round(percentile(latencies, 0.99), 3),
+                'max': round(latencies[-1], 3),
+            },
+            'queries': {'mean': round(sum(queries) / len(queries), 2), 'max': max(queries)},
+        }
+
+    def request(self, method, url, data=None):
+        if method == 'GET':
+            return self.client.get(url, data)
+        return self.client.post(url, data, format='json')
+
+    def new_cart(self, items=0):
+        self.client.force_authenticate(None)
+        cart_id = self.client.post('/carts/').data['id']
+        if items:
+            self.client.post(f'/carts/{cart_id}/items/bulk/', {'add': [
+                {'product_id': product_id, 'quantity': 1}
+                for product_id in self.rng.sample(self.products, min(items, len(self.products)))
+            ]}, format='json')
+        return cart_id
+
+    def prepare_product_list(self):
+        self.client.force_authenticate(None)
+        return 'GET', '/products/', {'page': self.rng.randint(1, 5)}
+
+    def prepare_product_search(self):
+        self.client.force_authenticate(None)
+        return 'GET', '/products/', {'search': self.rng.choice(['tea', 'coffee', 'organic', 'choc'])}
+
+    def prepare_product_filter(self):
+        self.client.force_authenticate(None)
+        return 'GET', '/products/', {'collection_id': self.rng.choice(self.collections),
+                                     'unit_price__gt': 10, 'ordering': 'unit_price'}
+
+    def prepare_product_detail(self):
+        self.client.force_authenticate(None)
+        return 'GET', f'/products/{self.rng.choice(self.products)}/', None
+
+    def prepare_cart_add(self):
+        cart_id = self.new_cart()
+        return 'POST', f'/carts/{cart_id}/items/', {'product_id': self.rng.choice(self.products),
+                                                    'quantity': 1}
+
+    def prepare_checkout(self):
+        cart_id = self.new_cart(items=3)
+        self.client.force_authenticate(self.user)
+        return 'POST', '/orders/', {'cart_id': cart_id}
+
+    def prepare_order_list(self):
+        self.client.force_authenticate(self.user)
+        return 'GET', '/orders/', None
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.6 on 2026-10-18 02:36
+
+from django.db import migrations
+
+SQLITE_TABLE = 'store_product_fts'
+POSTGRES_TABLE = 'store_product_search'
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    Product = apps.get_model('store', 'Product')
+    rows = [(pk, title, description or '') for pk, title, description
+            in Product.objects.values_list('id', 'title', 'description').iterator()]
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f"CREATE VIRTUAL TABLE {SQLITE_TABLE} USING fts5("
+                           f"title, description, tokenize='unicode61 remove_diacritics 2')")
+            cursor.executemany(f'INSERT INTO {SQLITE_TABLE} (rowid, title, description) '
+                               f'VALUES (%s, %s, %s)', rows)
+        elif connection.vendor == 'postgresql':
+            cursor.execute(f'CREATE TABLE {POSTGRES_TABLE} ('
+                           f'product_id bigint PRIMARY KEY '
+                           f'REFERENCES store_product (id) ON DELETE CASCADE, '
+                           f'document tsvector NOT NULL)')
+            cursor.execute(f'CREATE INDEX {POSTGRES_TABLE}_gin '
+                           f'ON {POSTGRES_TABLE} USING GIN (document)')
+            cursor.executemany(f"INSERT INTO {POSTGRES_TABLE} (product_id, document) "
+                               f"VALUES (%s, setweight(to_tsvector('simple', %s), 'A') || "
+                               f"setweight(to_tsvector('simple', %s), 'B'))", rows)
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'DROP TABLE IF EXISTS {SQLITE_TABLE}')
+        elif connection.vendor == 'postgresql':
+            cursor.execute(f'DROP TABLE IF EXISTS {POSTGRES_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0003_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
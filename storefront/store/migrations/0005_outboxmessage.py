@@ -0,0 +1,34 @@
+# Generated by Django 4.2.6 on 2026-10-18 02:39
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0004_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic', models.CharField(max_length=255, verbose_name='Событие')),
+                ('payload', models.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('P', 'Pending'), ('D', 'Done'), ('F', 'Failed')], default='P', max_length=1, verbose_name='Статус')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Попыток')),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Доступно для обработки с')),
+                ('lease', models.CharField(blank=True, default='', max_length=32)),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='Последняя ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Событие outbox',
+                'verbose_name_plural': 'Outbox',
+                'indexes': [models.Index(condition=models.Q(('status', 'P')), fields=['available_at', 'id'], name='store_outbox_pending_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.6 on 2026-10-18 02:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_productimage_variants'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['created_at'], name='store_cart_created_idx'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.6 on 2026-10-18 03:02
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def populate_review_stats(apps, schema_editor):
+    # У существующих отзывов оценок нет - заполняется только их число
+    Review = apps.get_model('store', 'Review')
+    ReviewStats = apps.get_model('store', 'ReviewStats')
+    ReviewStats.objects.bulk_create([
+        ReviewStats(product_id=row['product_id'], reviews_count=row['count'])
+        for row in Review.objects.order_by().values('product_id').annotate(count=Count('id'))
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_cart_created_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReviewStats',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='review_stats', serialize=False, to='store.product', verbose_name='Товар')),
+                ('reviews_count', models.PositiveIntegerField(default=0, verbose_name='Кол-во отзывов')),
+                ('ratings_count', models.PositiveIntegerField(default=0, verbose_name='Кол-во оценок')),
+                ('ratings_sum', models.PositiveIntegerField(default=0, verbose_name='Сумма оценок')),
+                ('rating_1', models.PositiveIntegerField(default=0)),
+                ('rating_2', models.PositiveIntegerField(default=0)),
+                ('rating_3', models.PositiveIntegerField(default=0)),
+                ('rating_4', models.PositiveIntegerField(default=0)),
+                ('rating_5', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Сводка отзывов',
+                'verbose_name_plural': 'Сводки отзывов',
+            },
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='rating',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(5)], verbose_name='Оценка'),
+        ),
+        migrations.RunPython(populate_review_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.6 on 2026-10-18 03:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_review_rating_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', 'date', 'id'], name='store_review_product_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', 'rating', 'id'], name='store_review_rating_idx'),
+        ),
+    ]
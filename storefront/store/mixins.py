@@ -0,0 +1,179 @@
+from hashlib import md5
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ValidationError as DjangoValidationError
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.response import Response
+
+from . import cart_store
+from .cache import catalog_timeout
+
+
+class CachedCatalogMixin:
+    """
+    Хранит сериализованные ответы list/retrieve в кеше.
+    Ключ (вместе с версией) строит наследник в get_cache_key().
+    """
+
+    def get_cache_key(self, request):
+        raise ImproperlyConfigured(
+            f'{type(self).__name__} должен определить get_cache_key(request) - '
+            f'ключ страницы вместе с версией данных (см. store.cache.catalog_key)'
+        )
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        key = self.get_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, catalog_timeout())
+        return response
+
+
+class ConditionalGetMixin:
+    """
+    ETag / Last-Modified для list и retrieve.
+
+    Наследник возвращает из get_validators() дешевые маркеры версии данных и
+    (если есть) время последнего изменения. Если клиент прислал совпадающий
+    If-None-Match / If-Modified-Since, 304 отдается без обращения к сериализатору;
+    для retrieve перед этим проверяется, что объект еще существует (object_exists).
+    """
+
+    def get_validators(self, request):
+        raise ImproperlyConfigured(
+            f'{type(self).__name__} должен определить get_validators(request) - '
+            f'([маркеры версии], время изменения или None)'
+        )
+
+    def object_exists(self, request):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            return self.get_queryset().filter(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+            ).exists()
+        except (TypeError, ValueError, DjangoValidationError):
+            return False
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        parts, last_modified = self.get_validators(request)
+        raw = repr((request.get_full_path(), request.META.get('HTTP_ACCEPT'), parts))
+        etag = quote_etag(md5(raw.encode()).hexdigest())
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is not None and response.status_code == status.HTTP_304_NOT_MODIFIED \
+                and self.action == 'retrieve' and not self.object_exists(request):
+            # Маркеры версии могут пережить удаленный объект
+            raise NotFound()
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code not in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            return response
+
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        return response
+
+
+class CacheCartMixin:
+    """
+    CartViewSet в режиме settings.CART_STORAGE = 'cache' (см. store.cart_store).
+    В режиме 'database' все методы передаются дальше по MRO.
+    """
+
+    def create(self, request, *args, **kwargs):
+        if not cart_store.is_enabled():
+            return super().create(request, *args, **kwargs)
+        cart_id = cart_store.create()
+        return Response(cart_store.representation(cart_id), status=status.HTTP_201_CREATED)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not cart_store.is_enabled():
+            return super().retrieve(request, *args, **kwargs)
+        return Response(cart_store.representation(kwargs['pk']))
+
+    def destroy(self, request, *args, **kwargs):
+        if not cart_store.is_enabled():
+            return super().destroy(request, *args, **kwargs)
+        cart_store.delete(kwargs['pk'])
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class CacheCartItemMixin:
+    """CartItemViewSet в режиме корзин в кеше; id позиции - id товара."""
+
+    def get_cached_item(self, cart_pk, pk):
+        for item in cart_store.representation(cart_pk)['items']:
+            if str(item['id']) == str(pk):
+                return item
+        raise NotFound('Товара нет в корзине')
+
+    def list(self, request, *args, **kwargs):
+        if not cart_store.is_enabled():
+            return super().list(request, *args, **kwargs)
+        return Response(cart_store.representation(kwargs['cart_pk'])['items'])
+
+    def retrieve(self, request, *args, **kwargs):
+        if not cart_store.is_enabled():
+            return super().retrieve(request, *args, **kwargs)
+        return Response(self.get_cached_item(kwargs['cart_pk'], kwargs['pk']))
+
+    def create(self, request, *args, **kwargs):
+        if not cart_store.is_enabled():
+            return super().create(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        product_id = serializer.validated_data['product_id']
+        errors = cart_store.change(kwargs['cart_pk'],
+                                   add={product_id: serializer.validated_data['quantity']})
+        if errors:
+            raise ValidationError({'product_id': ['Нет товара с данным id']})
+        quantity = cart_store.get_quantities(kwargs['cart_pk'])[product_id]
+        return Response({'id': product_id, 'product_id': product_id, 'quantity': quantity},
+                        status=status.HTTP_201_CREATED)
+
+    def partial_update(self, request, *args, **kwargs):
+        if not cart_store.is_enabled():
+            return super().partial_update(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        quantity = serializer.validated_data['quantity']
+        if cart_store.change(kwargs['cart_pk'], update={self.get_product_id(kwargs['pk']): quantity}):
+            raise NotFound('Товара нет в корзине')
+        return Response({'quantity': quantity})
+
+    def destroy(self, request, *args, **kwargs):
+        if not cart_store.is_enabled():
+            return super().destroy(request, *args, **kwargs)
+        product_id = self.get_product_id(kwargs['pk'])
+        if product_id not in cart_store.get_quantities(kwargs['cart_pk']):
+            raise NotFound('Товара нет в корзине')
+        cart_store.change(kwargs['cart_pk'], remove=[product_id])
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @staticmethod
+    def get_product_id(pk):
+        try:
+            return int(pk)
+        except ValueError:
+            raise NotFound('Товара нет в корзине')
@@ -1,9 +1,14 @@
 from uuid import uuid4
 
-from django.db import models
-from django.core.validators import MinValueValidator
+from django.db import connections, models, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.conf import settings
 from django.contrib import admin
+
+from .cache import bump_version, cart_scope
 # Create your models here.
 
 
@@ -17,23 +22,86 @@ class Promotion(models.Model):
 
 
 
+class CollectionManager(models.Manager):
+    def change_products_count(self, collection_id, delta):
+        self.filter(pk=collection_id).update(products_count=F('products_count') + delta)
+
+    def reconcile_products_count(self, collection_ids=None, dry_run=False):
+        """
+        Пересчитывает products_count по таблице товаров там, где он разошелся.
+        Возвращает {collection_id: (было, стало)}.
+        """
+        counts = Product.objects.filter(collection=OuterRef('pk')).order_by() \
+            .values('collection').annotate(count=Count('id')).values('count')
+        actual = Coalesce(Subquery(counts), 0)
+
+        collections = self.all() if collection_ids is None else self.filter(pk__in=collection_ids)
+        drift = {
+            pk: (stored, real) for pk, stored, real in
+            collections.annotate(actual=actual).exclude(products_count=F('actual'))
+            .values_list('pk', 'products_count', 'actual')
+        }
+        if drift and not dry_run:
+            self.filter(pk__in=drift).update(products_count=actual)
+        return drift
+
+
 class Collection(models.Model):
+    objects = CollectionManager()
     title = models.CharField(max_length=255, verbose_name='Название')
     featured_product = models.ForeignKey('Product',
                                         on_delete=models.SET_NULL,
                                         null=True, blank=True,
                                         related_name='+',
                                         verbose_name='Рекомендуемый товар')
+    # Поддерживается сигналами товаров (store.signals.handlers),
+    # расхождения исправляет manage.py reconcile_collection_counts
+    products_count = models.PositiveIntegerField(default=0, editable=False,
+                                                 verbose_name='Кол-во товаров')
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        # products_count меняется только атомарно через F() - не перезаписываем
+        # его устаревшим значением при обычном сохранении категории
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name != 'products_count']
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'Категория'
         verbose_name_plural = 'Категории'
         ordering = ['title']
 
+class ProductManager(models.Manager):
+    def reserve_inventory(self, cart_id):
+        """
+        Списывает со склада количество товаров из корзины одним условным UPDATE:
+        inventory = inventory - q WHERE inventory >= q.
+        Вызывать первым запросом внутри transaction.atomic(). Возвращает число
+        списанных позиций; если оно меньше числа позиций корзины - товара не
+        хватило и транзакцию нужно откатить.
+        """
+        lines = CartItem.objects.filter(cart_id=cart_id)
+        products = self.filter(pk__in=lines.values('product_id'))
+
+        # Строки блокируются строго по возрастанию id, поэтому параллельные
+        # оформления с пересекающимися корзинами не могут взаимно заблокироваться.
+        # SQLite блокирует базу целиком и FOR UPDATE не поддерживает.
+        if connections[self.db].features.has_select_for_update:
+            list(products.select_for_update().order_by('pk').values_list('pk', flat=True))
+
+        quantity = Subquery(lines.filter(product_id=OuterRef('pk')).values('quantity')[:1])
+        return products.filter(inventory__gte=quantity).update(
+            inventory=F('inventory') - quantity,
+            last_update=timezone.now()
+        )
+
+
 class Product(models.Model):
+    objects = ProductManager()
     title = models.CharField(max_length=255, verbose_name='Наименование товара')
     slug = models.SlugField()  # product/1 -> product/iphone-14
     description = models.TextField(null=True, blank=True, verbose_name='Описание')
@@ -55,12 +123,20 @@ class Product(models.Model):
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
         ordering = ['title']
+        # Для курсорной пагинации по разрешенным сортировкам (см. KeysetPagination)
+        indexes = [
+            models.Index(fields=['title', 'id'], name='store_product_title_id_idx'),
+            models.Index(fields=['unit_price', 'id'], name='store_product_price_id_idx'),
+            models.Index(fields=['last_update', 'id'], name='store_product_update_id_idx'),
+        ]
 
 from .validators import validate_file_size
 
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='store/images', validators=[validate_file_size])
+    # {"source": имя оригинала, "160": имя файла варианта, ...}, см. store.images
+    variants = models.JSONField(default=dict, blank=True, editable=False)
 
 
 class Customer(models.Model):
@@ -98,13 +174,104 @@ class Customer(models.Model):
         verbose_name_plural = 'Покупатели'
 
 
+class CartManager(models.Manager):
+    def purge_expired(self, cutoff, batch_size=1000):
+        """
+        Удаляет корзины, созданные раньше cutoff, пачками по batch_size - каждая
+        в своей короткой транзакции, чтобы не держать долгих блокировок.
+        Генератор: после каждой пачки отдает (удалено корзин, удалено позиций).
+
+        Удаление идет прямым DELETE: через QuerySet.delete() Django загрузил бы
+        каждую позицию ради сигналов. Версии удаленных корзин сдвигаются после
+        фиксации пачки - иначе старый ETag получал бы 304 вместо 404.
+        """
+        connection = connections[self.db]
+        cart_table = self.model._meta.db_table
+        item_table = CartItem._meta.db_table
+        while True:
+            with transaction.atomic(using=self.db):
+                ids = list(self.filter(created_at__lt=cutoff).order_by('created_at')
+                           .values_list('pk', flat=True)[:batch_size])
+                if not ids:
+                    return
+
+                params = [self.model._meta.pk.get_db_prep_value(pk, connection) for pk in ids]
+                placeholders = ', '.join(['%s'] * len(params))
+                with connection.cursor() as cursor:
+                    cursor.execute(f'DELETE FROM {item_table} WHERE cart_id IN ({placeholders})',
+                                   params)
+                    items = cursor.rowcount
+                    cursor.execute(f'DELETE FROM {cart_table} WHERE id IN ({placeholders})', params)
+                    carts = cursor.rowcount
+            for pk in ids:
+                bump_version(cart_scope(pk))
+            yield carts, items
+
+
 class Cart(models.Model):
+    objects = CartManager()
     id = models.UUIDField(primary_key=True, default=uuid4)
     # ac4490b6-4a55-4716-870b-2dd367f53fea
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Для поиска просроченных корзин (manage.py purge_expired_carts)
+        indexes = [
+            models.Index(fields=['created_at'], name='store_cart_created_idx'),
+        ]
+
+
+class CartItemManager(models.Manager):
+    def add_quantities(self, cart_id, quantities):
+        """
+        Добавляет товары в корзину одним запросом:
+        INSERT ... SELECT ... ON CONFLICT (cart, product) DO UPDATE quantity = quantity + n.
+        Одновременные добавления не теряют друг друга и не падают на unique_together,
+        а проверка существования товаров и корзины выполняется в том же запросе.
+
+        quantities - {product_id: quantity}. Возвращает список сохраненных CartItem;
+        несуществующие товары (или корзина) в него не попадают.
+        """
+        if not quantities:
+            return []
+
+        connection = connections[self.db]
+        table = self.model._meta.db_table
+        cases = ' '.join(['WHEN %s THEN %s'] * len(quantities))
+        placeholders = ', '.join(['%s'] * len(quantities))
+        sql = (
+            f'INSERT INTO {table} (cart_id, product_id, quantity) '
+            f'SELECT cart.id, product.id, CASE product.id {cases} END '
+            f'FROM {Cart._meta.db_table} cart, {Product._meta.db_table} product '
+            f'WHERE cart.id = %s AND product.id IN ({placeholders}) '
+            f'ON CONFLICT (cart_id, product_id) '
+            f'DO UPDATE SET quantity = {table}.quantity + excluded.quantity '
+            f'RETURNING id, product_id, quantity'
+        )
+        cart_field = self.model._meta.get_field('cart')
+        params = [value for pair in quantities.items() for value in pair]
+        params.append(cart_field.get_db_prep_value(cart_id, connection))
+        params.extend(quantities)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+
+        items = []
+        for pk, product_id, quantity in rows:
+            item = self.model(id=pk, cart_id=cart_id, product_id=product_id, quantity=quantity)
+            item._state.adding = False
+            item._state.db = self.db
+            items.append(item)
+        return items
+
+    def add_quantity(self, cart_id, product_id, quantity):
+        """Один товар, см. add_quantities(). Возвращает CartItem или None."""
+        items = self.add_quantities(cart_id, {product_id: quantity})
+        return items[0] if items else None
+
 
 class CartItem(models.Model):
+    objects = CartItemManager()
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, verbose_name='Корзина',
                              related_name='items')
     # cart
@@ -134,6 +301,13 @@ class Order(models.Model):
                                       verbose_name='Статус оплаты')
     customer = models.ForeignKey(Customer, on_delete=models.PROTECT)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['placed_at', 'id'], name='store_order_placed_id_idx'),
+            models.Index(fields=['customer', 'placed_at', 'id'],
+                         name='store_order_cust_placed_idx'),
+        ]
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.PROTECT, verbose_name='Заказ', related_name='items')
@@ -149,16 +323,152 @@ class Address(models.Model):
 
 
 
+class ReviewManager(models.Manager):
+    def sorted_for(self, product_id, sort):
+        """Отзывы товара в порядке Review.SORTS[sort]; под каждый порядок есть индекс."""
+        reviews = self.filter(product_id=product_id)
+        if sort == Review.SORT_HIGHEST_RATED:
+            # NULL нельзя сравнивать в курсоре, а оценки у отзыва может не быть
+            reviews = reviews.filter(rating__isnull=False)
+        return reviews.order_by(*Review.SORTS[sort])
+
+
 class Review(models.Model):
+    SORT_NEWEST = 'newest'
+    SORT_HIGHEST_RATED = 'highest_rated'
+    SORTS = {
+        SORT_NEWEST: ['-date', '-id'],
+        SORT_HIGHEST_RATED: ['-rating', '-id'],
+    }
+
+    objects = ReviewManager()
     product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name='Товар',
                                 related_name='reviews')
     name = models.CharField(max_length=255)
     description = models.TextField(verbose_name='Описание')
     date = models.DateField(auto_now_add=True)
+    # Отзывы без оценки (в том числе старые) в рейтинге не участвуют
+    rating = models.PositiveSmallIntegerField(null=True, blank=True,
+                                              validators=[MinValueValidator(1), MaxValueValidator(5)],
+                                              verbose_name='Оценка')
 
     class Meta:
         verbose_name = 'Отзыв'
         verbose_name_plural = 'Отзывы'
+        # Для курсорной пагинации отзывов товара (см. Review.SORTS)
+        indexes = [
+            models.Index(fields=['product', 'date', 'id'], name='store_review_product_date_idx'),
+            models.Index(fields=['product', 'rating', 'id'], name='store_review_rating_idx'),
+        ]
+
+
+RATINGS = range(1, 6)
+
+
+class ReviewStatsManager(models.Manager):
+    def change(self, product_id, rating, delta):
+        """Атомарно добавляет (delta=1) или убирает (delta=-1) отзыв из сводки товара."""
+        if delta > 0:
+            # При удалении сводку не создаем: товар может удаляться вместе с ней
+            self.get_or_create(product_id=product_id)
+        changes = {'reviews_count': delta}
+        if rating is not None:
+            changes.update({'ratings_count': delta, 'ratings_sum': rating * delta, f'rating_{rating}': delta})
+        # Счетчики беззнаковые: если сводка уже разошлась с отзывами, не уходим ниже нуля
+        self.filter(product_id=product_id).update(**{
+            field: Greatest(F(field) + value, 0) for field, value in changes.items()
+        })
+
+    def change_rating(self, product_id, old_rating, new_rating):
+        if old_rating != new_rating:
+            self.change(product_id, old_rating, -1)
+            self.change(product_id, new_rating, 1)
+
+    def rebuild(self, product_ids=None):
+        """Пересчитывает сводки по таблице отзывов (после bulk_create и для исправления расхождений)."""
+        reviews = Review.objects.order_by()
+        if product_ids is not None:
+            product_ids = list(product_ids)
+            reviews = reviews.filter(product_id__in=product_ids)
+        rows = reviews.values('product_id').annotate(
+            reviews_count=Count('id'),
+            ratings_count=Count('rating'),
+            ratings_sum=Coalesce(Sum('rating'), 0),
+            **{f'rating_{rating}': Count('id', filter=Q(rating=rating)) for rating in RATINGS},
+        )
+        with transaction.atomic():
+            stale = self.all() if product_ids is None else self.filter(product_id__in=product_ids)
+            stale.delete()
+            self.bulk_create([ReviewStats(**row) for row in rows], batch_size=1000)
+
+
+class ReviewStats(models.Model):
+    """
+    Сводка отзывов товара: число, средняя оценка и гистограмма оценок.
+    Поддерживается сигналами отзывов (store.signals.handlers) через F(),
+    каталог читает ее через select_related без отдельных запросов.
+    """
+    objects = ReviewStatsManager()
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True,
+                                   related_name='review_stats', verbose_name='Товар')
+    reviews_count = models.PositiveIntegerField(default=0, verbose_name='Кол-во отзывов')
+    ratings_count = models.PositiveIntegerField(default=0, verbose_name='Кол-во оценок')
+    ratings_sum = models.PositiveIntegerField(default=0, verbose_name='Сумма оценок')
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Сводка отзывов'
+        verbose_name_plural = 'Сводки отзывов'
+
+    @property
+    def average_rating(self):
+        if not self.ratings_count:
+            return None
+        return round(self.ratings_sum / self.ratings_count, 2)
+
+    @property
+    def histogram(self):
+        return {str(rating): getattr(self, f'rating_{rating}') for rating in RATINGS}
+
+
+class OutboxMessage(models.Model):
+    """
+    Событие, записанное в той же транзакции, что и изменение данных.
+    Доставляется обработчикам воркером (manage.py process_outbox), см. store.outbox.
+    """
+    STATUS_PENDING = 'P'
+    STATUS_DONE = 'D'
+    STATUS_FAILED = 'F'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed')
+    ]
+
+    topic = models.CharField(max_length=255, verbose_name='Событие')
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default=STATUS_PENDING,
+                              verbose_name='Статус')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='Попыток')
+    available_at = models.DateTimeField(default=timezone.now,
+                                        verbose_name='Доступно для обработки с')
+    lease = models.CharField(max_length=32, blank=True, default='')
+    last_error = models.TextField(blank=True, default='', verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Событие outbox'
+        verbose_name_plural = 'Outbox'
+        indexes = [
+            models.Index(fields=['available_at', 'id'], name='store_outbox_pending_idx',
+                         condition=models.Q(status='P')),
+        ]
 
 
 
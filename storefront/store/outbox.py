@@ -0,0 +1,108 @@
+"""
+Transactional outbox.
+
+enqueue() пишет событие в таблицу OutboxMessage в текущей транзакции - событие
+появится только если транзакция зафиксирована. Воркер (manage.py process_outbox)
+забирает события пачками под временную "аренду" (lease), вызывает обработчик
+темы и при ошибке планирует повтор с экспоненциальной задержкой.
+Доставка - at-least-once: обработчики должны быть идемпотентны.
+"""
+from datetime import timedelta
+from uuid import uuid4
+
+from django.utils import timezone
+
+from .models import Order, OutboxMessage
+from .signals import order_created
+
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = timedelta(seconds=5)
+BACKOFF_MAX = timedelta(hours=1)
+LEASE = timedelta(minutes=5)
+
+_handlers = {}
+
+
+def handler(topic):
+    """Регистрирует обработчик события: @outbox.handler('order_created')."""
+    def register(func):
+        _handlers[topic] = func
+        return func
+    return register
+
+
+def enqueue(topic, **payload):
+    return OutboxMessage.objects.create(topic=topic, payload=payload)
+
+
+def enqueue_many(topic, payloads):
+    return OutboxMessage.objects.bulk_create(
+        [OutboxMessage(topic=topic, payload=payload) for payload in payloads]
+    )
+
+
+def backoff(attempts):
+    return min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+
+
+def claim_batch(batch_size, now):
+    """
+    Забирает до batch_size готовых событий: сдвигает им available_at на время
+    аренды и помечает своим lease. Два воркера не получат одно и то же событие,
+    а события упавшего воркера вернутся в очередь по истечении аренды.
+    """
+    ids = list(
+        OutboxMessage.objects
+        .filter(status=OutboxMessage.STATUS_PENDING, available_at__lte=now)
+        .order_by('available_at', 'id')
+        .values_list('id', flat=True)[:batch_size]
+    )
+    if not ids:
+        return []
+
+    lease = uuid4().hex
+    OutboxMessage.objects.filter(
+        id__in=ids, status=OutboxMessage.STATUS_PENDING, available_at__lte=now
+    ).update(lease=lease, available_at=now + LEASE)
+    return list(OutboxMessage.objects.filter(lease=lease).order_by('available_at', 'id'))
+
+
+def process_batch(batch_size=100, max_attempts=MAX_ATTEMPTS):
+    """Обрабатывает одну пачку. Возвращает (доставлено, с ошибкой)."""
+    now = timezone.now()
+    messages = claim_batch(batch_size, now)
+    delivered = failed = 0
+
+    for message in messages:
+        message.lease = ''
+        try:
+            func = _handlers.get(message.topic)
+            if func is None:
+                raise LookupError(f'Нет обработчика для события {message.topic!r}')
+            func(**message.payload)
+        except Exception as error:
+            failed += 1
+            message.attempts += 1
+            message.last_error = f'{type(error).__name__}: {error}'
+            if message.attempts >= max_attempts:
+                message.status = OutboxMessage.STATUS_FAILED
+            else:
+                message.available_at = timezone.now() + backoff(message.attempts)
+        else:
+            delivered += 1
+            message.status = OutboxMessage.STATUS_DONE
+            message.processed_at = timezone.now()
+
+    OutboxMessage.objects.bulk_update(
+        messages, ['lease', 'status', 'attempts', 'last_error', 'available_at', 'processed_at']
+    )
+    return delivered, failed
+
+
+@handler('order_created')
+def deliver_order_created(order_id):
+    from .serializers import CreateOrderSerializer
+
+    order = Order.objects.get(pk=order_id)
+    # send(), а не send_robust(): ошибка получателя должна привести к повтору
+    order_created.send(CreateOrderSerializer, order=order)
@@ -1,5 +1,195 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Курсорная (keyset) пагинация: вместо OFFSET страница начинается с
+    WHERE (поле, id) > (значение, id), поэтому глубина листания не влияет
+    на скорость, а вставки/удаления не сдвигают страницы.
+
+    Включается параметром ?cursor= (для первой страницы - пустым).
+    Порядок берется из уже отсортированного queryset (?ordering=), иначе из
+    view.keyset_ordering или Meta.ordering модели; pk добавляется всегда.
+    Общее количество (COUNT) отдается по умолчанию, ?count=false его отключает.
+    """
+    page_size = 10
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Неверный курсор'
+
+    def is_requested(self, request):
+        return self.cursor_query_param in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+
+        page_queryset = self.get_page_queryset(queryset, request, view)
+        self.count = queryset.count() if self.wants_count(request) else None
+        return self.set_page(list(page_queryset))
+
+    def wants_count(self, request):
+        return request.query_params.get(self.count_query_param, '').lower() not in ('0', 'false', 'no')
+
+    def get_page_queryset(self, queryset, request, view=None):
+        """
+        Ленивый queryset страницы (на одну запись больше - чтобы узнать, есть ли
+        следующая). Вместе с set_page() позволяет выполнить запрос async ORM.
+        """
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(queryset, view)
+        self.position, self.reverse = self.decode_cursor(request, queryset)
+
+        ordering = [self.flip(term) for term in self.ordering] if self.reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if self.position is not None:
+            queryset = queryset.filter(self.build_filter(ordering, self.position))
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results):
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.reverse:
+            results.reverse()
+            self.has_next, self.has_previous = self.position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.position is not None
+
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        fields = [
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]
+        if self.count is not None:
+            fields.insert(0, ('count', self.count))
+        return Response(OrderedDict(fields))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param,
+                                   self.encode_cursor(self.page[-1], reverse=False))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param,
+                                   self.encode_cursor(self.page[0], reverse=True))
+
+    def get_ordering(self, queryset, view):
+        ordering = [term for term in queryset.query.order_by if isinstance(term, str)]
+        if not ordering:
+            ordering = list(getattr(view, 'keyset_ordering', None)
+                            or queryset.model._meta.ordering)
+
+        # pk в конце делает позицию уникальной; направление - как у первого поля,
+        # чтобы составной индекс (поле, id) можно было читать в обе стороны
+        if not any(term.lstrip('-') in ('pk', 'id') for term in ordering):
+            descending = bool(ordering) and ordering[0].startswith('-')
+            ordering.append('-pk' if descending else 'pk')
+        return ordering
+
+    @staticmethod
+    def flip(term):
+        return term[1:] if term.startswith('-') else '-' + term
+
+    @staticmethod
+    def build_filter(ordering, position):
+        # (a, b, pk) > (x, y, z)  =>  a > x OR (a = x AND b > y) OR (a = x AND b = y AND pk > z)
+        condition = Q()
+        for index, term in enumerate(ordering):
+            lookup = 'lt' if term.startswith('-') else 'gt'
+            clause = Q(**{f'{term.lstrip("-")}__{lookup}': position[index]})
+            for previous, value in zip(ordering[:index], position):
+                clause &= Q(**{previous.lstrip('-'): value})
+            condition |= clause
+        return condition
+
+    def encode_cursor(self, instance, reverse):
+        position = []
+        for term in self.ordering:
+            value = instance
+            for attr in term.lstrip('-').split('__'):
+                value = getattr(value, attr)
+            position.append(value)
+
+        payload = {'o': self.ordering, 'p': position, 'r': int(reverse)}
+        raw = json.dumps(payload, default=str, separators=(',', ':'))
+        return urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, request, queryset):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+
+        try:
+            payload = json.loads(urlsafe_b64decode(encoded.encode()).decode())
+            position, reverse = payload['p'], bool(payload['r'])
+            if payload['o'] != self.ordering or len(position) != len(self.ordering):
+                raise ValueError
+            # Курсор приходит от клиента: значения приводятся к типам полей сортировки,
+            # None не допускается - сравнивать с ним в WHERE нельзя
+            position = [self.get_ordering_field(queryset, term).to_python(value)
+                        for term, value in zip(self.ordering, position)]
+            if None in position:
+                raise ValueError
+        except (TypeError, ValueError, KeyError, FieldDoesNotExist, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    @staticmethod
+    def get_ordering_field(queryset, term):
+        name = term.lstrip('-')
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+
+        model, field = queryset.model, None
+        for attr in name.split('__'):
+            if model is None:
+                raise FieldDoesNotExist(attr)
+            field = model._meta.pk if attr == 'pk' else model._meta.get_field(attr)
+            model = field.related_model
+        return field
 
 
 class DefaultPagination(PageNumberPagination):
-    page_size = 10
\ No newline at end of file
+    page_size = 10
+    keyset_class = KeysetPagination
+    keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        keyset = self.keyset_class()
+        if keyset.is_requested(request):
+            self.keyset = keyset
+            return keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class ReviewPagination(KeysetPagination):
+    """
+    Отзывы отдаются только постранично: курсор не обязателен в запросе,
+    первая страница - без него. Порядок задает ReviewViewSet (?sort=).
+    """
+
+    def is_requested(self, request):
+        # KeysetPagination включается только параметром cursor, а без него
+        # отдает весь список. У отзывов его нет: без курсора - первая страница
+        return True
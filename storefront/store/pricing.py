@@ -0,0 +1,84 @@
+"""
+Цены товаров: лучшая из акций товара (Promotion.discount, в процентах) и налог.
+
+get_prices() считает цены для целого списка товаров: берет из кеша то, что
+есть, а недостающее - одним запросом. Кеш по товару сбрасывается сигналами
+при изменении товара, его акций или связей товар-акция
+(store.signals.handlers). Каталог и корзина читают цены только отсюда.
+"""
+from collections import namedtuple
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.core.cache import cache
+from django.db.models import Max
+
+from .cache import catalog_timeout
+from .models import Product
+
+TAX_RATE = Decimal('1.1')
+CENT = Decimal('0.01')
+
+# unit_price - цена из каталога, price - со скидкой, price_with_tax - с налогом
+Price = namedtuple('Price', ['unit_price', 'discount', 'price', 'price_with_tax'])
+
+
+def price_key(product_id):
+    return f'price:product:{product_id}'
+
+
+def calculate_price(unit_price, discount=None):
+    discount = min(max(discount or 0, 0), 100)
+    price = (unit_price * (100 - Decimal(str(discount))) / 100).quantize(CENT, ROUND_HALF_UP)
+    return Price(unit_price, discount, price, (price * TAX_RATE).quantize(CENT, ROUND_HALF_UP))
+
+
+def get_prices(products):
+    """products - товары или их id. Возвращает {product_id: Price}."""
+    product_ids = {getattr(product, 'pk', product) for product in products}
+    if not product_ids:
+        return {}
+
+    cached = cache.get_many([price_key(pk) for pk in product_ids])
+    prices = {pk: cached[price_key(pk)] for pk in product_ids if price_key(pk) in cached}
+
+    missing = product_ids - prices.keys()
+    if missing:
+        computed = {pk: calculate_price(unit_price, discount)
+                    for pk, unit_price, discount in price_rows(missing)}
+        cache.set_many({price_key(pk): price for pk, price in computed.items()},
+                       timeout=catalog_timeout())
+        prices.update(computed)
+    return prices
+
+
+async def aget_prices(product_ids):
+    """Асинхронный get_prices() для async-представлений; принимает только id."""
+    product_ids = set(product_ids)
+    if not product_ids:
+        return {}
+
+    cached = await cache.aget_many([price_key(pk) for pk in product_ids])
+    prices = {pk: cached[price_key(pk)] for pk in product_ids if price_key(pk) in cached}
+
+    missing = product_ids - prices.keys()
+    if missing:
+        computed = {pk: calculate_price(unit_price, discount)
+                    async for pk, unit_price, discount in price_rows(missing)}
+        await cache.aset_many({price_key(pk): price for pk, price in computed.items()},
+                              timeout=catalog_timeout())
+        prices.update(computed)
+    return prices
+
+
+def price_rows(product_ids):
+    return Product.objects.filter(pk__in=product_ids).order_by().values('pk', 'unit_price') \
+        .annotate(best_discount=Max('promotion__discount')) \
+        .values_list('pk', 'unit_price', 'best_discount')
+
+
+def get_price(product):
+    return get_prices([product])[getattr(product, 'pk', product)]
+
+
+def invalidate_prices(product_ids):
+    cache.delete_many([price_key(pk) for pk in product_ids])
@@ -0,0 +1,118 @@
+import re
+
+from django.db import connections
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import SearchFilter
+
+from .models import Product
+
+SQLITE_TABLE = 'store_product_fts'
+POSTGRES_TABLE = 'store_product_search'
+SUPPORTED_VENDORS = ('sqlite', 'postgresql')
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def build_query(vendor, terms):
+    # Каждое слово ищется по префиксу, все слова обязательны
+    if vendor == 'sqlite':
+        return ' '.join(f'"{term}"*' for term in terms)
+    return ' & '.join(f'{term}:*' for term in terms)
+
+
+def index_products(rows, using='default'):
+    """
+    Обновляет поисковый индекс.
+    rows - итерируемое из (id, title, description).
+    """
+    connection = connections[using]
+    rows = [(pk, title, description or '') for pk, title, description in rows]
+    if not rows or connection.vendor not in SUPPORTED_VENDORS:
+        return
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.executemany(f'DELETE FROM {SQLITE_TABLE} WHERE rowid = %s',
+                               [(row[0],) for row in rows])
+            cursor.executemany(f'INSERT INTO {SQLITE_TABLE} (rowid, title, description) '
+                               f'VALUES (%s, %s, %s)', rows)
+        else:
+            cursor.executemany(
+                f"INSERT INTO {POSTGRES_TABLE} (product_id, document) "
+                f"VALUES (%s, setweight(to_tsvector('simple', %s), 'A') || "
+                f"setweight(to_tsvector('simple', %s), 'B')) "
+                f"ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+                rows
+            )
+
+
+def unindex_products(product_ids, using='default'):
+    connection = connections[using]
+    if not product_ids or connection.vendor not in SUPPORTED_VENDORS:
+        return
+
+    table, column = (SQLITE_TABLE, 'rowid') if connection.vendor == 'sqlite' \
+        else (POSTGRES_TABLE, 'product_id')
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {table} WHERE {column} = %s',
+                           [(pk,) for pk in product_ids])
+
+
+def rebuild_index(using='default', chunk_size=2000):
+    connection = connections[using]
+    if connection.vendor not in SUPPORTED_VENDORS:
+        return 0
+
+    table = SQLITE_TABLE if connection.vendor == 'sqlite' else POSTGRES_TABLE
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table}')
+
+    total, chunk = 0, []
+    products = Product.objects.using(using).order_by() \
+        .values_list('id', 'title', 'description').iterator(chunk_size=chunk_size)
+    for row in products:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            index_products(chunk, using)
+            total, chunk = total + len(chunk), []
+    index_products(chunk, using)
+    return total + len(chunk)
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    Полнотекстовый поиск по товарам (?search=) через заранее построенный индекс:
+    FTS5 на SQLite, tsvector + GIN на PostgreSQL. Результаты сортируются по
+    релевантности (если не задан ?ordering=), слова ищутся по префиксу.
+    На остальных СУБД работает как обычный SearchFilter по search_fields.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = tokenize(' '.join(self.get_search_terms(request)))
+        vendor = connections[queryset.db].vendor
+        if not terms or vendor not in SUPPORTED_VENDORS:
+            return super().filter_queryset(request, queryset, view)
+
+        query = build_query(vendor, terms)
+        product_table = Product._meta.db_table
+        if vendor == 'sqlite':
+            matches = RawSQL(f'SELECT rowid FROM {SQLITE_TABLE} '
+                             f'WHERE {SQLITE_TABLE} MATCH %s', [query])
+            # bm25: чем меньше, тем релевантнее; название весит больше описания
+            rank = RawSQL(f'SELECT bm25({SQLITE_TABLE}, 10.0, 1.0) FROM {SQLITE_TABLE} '
+                          f'WHERE {SQLITE_TABLE} MATCH %s AND rowid = {product_table}.id',
+                          [query])
+            ordering = 'search_rank'
+        else:
+            matches = RawSQL(f"SELECT product_id FROM {POSTGRES_TABLE} "
+                             f"WHERE document @@ to_tsquery('simple', %s)", [query])
+            rank = RawSQL(f"SELECT ts_rank(document, to_tsquery('simple', %s)) "
+                          f"FROM {POSTGRES_TABLE} WHERE product_id = {product_table}.id",
+                          [query])
+            ordering = '-search_rank'
+
+        return queryset.filter(id__in=matches).annotate(search_rank=rank).order_by(ordering)
@@ -1,8 +1,15 @@
 from rest_framework import serializers
-from .models import Product, Collection, Review, Cart, CartItem, Customer, ProductImage, Order, OrderItem
+from rest_framework.exceptions import NotFound
+from .models import Product, Collection, Review, ReviewStats, Cart, CartItem, Customer, ProductImage, Order, \
+    OrderItem
 from decimal import Decimal
-from django.db import transaction
-from .signals import order_created
+from django.db import models, transaction
+from django.db.models import Case, Value, When
+from . import cart_store, outbox
+from .images import variant_urls
+from .pricing import get_price, get_prices
+from .cache import bump_catalog, bump_version, cart_scope
+from tags.models import TaggedItem
 # class CollectionSerializer(serializers.Serializer):
 #     id = serializers.IntegerField()
 #     title = serializers.CharField(max_length=255)
@@ -17,43 +24,112 @@ class CollectionSerializer(serializers.ModelSerializer):
 class ReviewSerializer(serializers.ModelSerializer):
     class Meta:
         model = Review
-        fields = ['id', 'date', 'name', 'description']
+        fields = ['id', 'date', 'name', 'description', 'rating']
 
     def create(self, validated_data):
         product_id = self.context['product_id']
         return Review.objects.create(product_id=product_id, **validated_data)
 
 
+def review_stats_representation(stats):
+    return {
+        'reviews_count': stats.reviews_count,
+        'ratings_count': stats.ratings_count,
+        'average_rating': stats.average_rating,
+        'histogram': stats.histogram,
+    }
+
+
 class ProductImageSerializer(serializers.ModelSerializer):
+    variants = serializers.SerializerMethodField(method_name='get_variants')
+
+    def get_variants(self, image: ProductImage):
+        return variant_urls(image, self.context.get('request'))
+
     def create(self, validated_data):
         product_id = self.context['product_id']
         return ProductImage.objects.create(product_id=product_id, **validated_data)
 
     class Meta:
         model = ProductImage
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'variants']
+
+class PricedListSerializer(serializers.ListSerializer):
+    """
+    Считает цены всех товаров списка одним вызовом get_prices() и кладет их
+    в context['prices'], откуда их читает PricedMixin.
+    """
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.Manager) else data)
+        products = [self.child.get_product(item) for item in items]
+        self.context.setdefault('prices', {}).update(get_prices(products))
+        return super().to_representation(items)
+
+
+class PricedMixin:
+    def get_product(self, instance):
+        return instance
+
+    def get_price(self, product):
+        prices = self.context.setdefault('prices', {})
+        if product.pk not in prices:
+            prices[product.pk] = get_price(product)
+        return prices[product.pk]
+
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductListSerializer(PricedListSerializer):
+    """Вдобавок к ценам - метки всех товаров списка одним запросом (context['tags'])."""
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.Manager) else data)
+        self.context.setdefault('tags', {}).update(
+            TaggedItem.objects.get_tags_for_many(Product, [item.pk for item in items])
+        )
+        return super().to_representation(items)
+
+
+class ProductSerializer(PricedMixin, serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
 
     class Meta:
         model = Product
-        fields = ['id', 'title', 'price', 'description',
-                  'slug', 'inventory', 'price_with_tax', 'images', 'collection']
+        fields = ['id', 'title', 'price', 'description', 'slug', 'inventory',
+                  'discount', 'discounted_price', 'price_with_tax', 'images', 'tags', 'review_stats',
+                  'collection']
+        list_serializer_class = ProductListSerializer
 
     price = serializers.DecimalField(max_digits=6, decimal_places=2,
                                      source='unit_price')
+    discount = serializers.SerializerMethodField(method_name='get_discount')
+    discounted_price = serializers.SerializerMethodField(method_name='get_discounted_price')
     price_with_tax = serializers.SerializerMethodField(method_name='calculate_tax')
+    tags = serializers.SerializerMethodField(method_name='get_tags')
+    review_stats = serializers.SerializerMethodField(method_name='get_review_stats')
     collection = serializers.PrimaryKeyRelatedField(queryset=Collection.objects.all())
 
-    # reviews = ReviewSerializer(many=True)
-    # reviews_count = serializers.SerializerMethodField(method_name='rev_count')
-    #
-    # def rev_count(self, product: Product):
-    #     return product.reviews.all().count()
+    def get_review_stats(self, product: Product):
+        # Сводка приходит через select_related('review_stats'), без запроса на товар
+        try:
+            stats = product.review_stats
+        except ReviewStats.DoesNotExist:
+            stats = ReviewStats()
+        return review_stats_representation(stats)
+
+    def get_tags(self, product: Product):
+        tags = self.context.setdefault('tags', {})
+        if product.pk not in tags:
+            tags.update(TaggedItem.objects.get_tags_for_many(Product, [product.pk]))
+        return tags[product.pk]
+
+    def get_discount(self, product: Product):
+        return self.get_price(product).discount
+
+    def get_discounted_price(self, product: Product):
+        return self.get_price(product).price
 
     def calculate_tax(self, product: Product):
-        return round(product.unit_price * Decimal(1.1), 2)
+        return self.get_price(product).price_with_tax
 
     def create(self, validated_data):
         product = Product(**validated_data)
@@ -101,25 +177,35 @@ class SimpleProductSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'unit_price']
 
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(PricedMixin, serializers.ModelSerializer):
     product = SimpleProductSerializer()
+    price = serializers.SerializerMethodField(method_name='get_unit_price')
     total_price = serializers.SerializerMethodField(method_name='get_total_price')
 
+    def get_product(self, cart_item: CartItem):
+        return cart_item.product
+
+    def get_unit_price(self, cart_item: CartItem):
+        return self.get_price(cart_item.product).price
+
     def get_total_price(self, cart_item: CartItem):
-        return cart_item.quantity * cart_item.product.unit_price
+        return cart_item.quantity * self.get_price(cart_item.product).price
 
     class Meta:
         model = CartItem
-        fields = ['id', 'product', 'quantity', 'total_price']
+        fields = ['id', 'product', 'quantity', 'price', 'total_price']
+        list_serializer_class = PricedListSerializer
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(PricedMixin, serializers.ModelSerializer):
     id = serializers.UUIDField(read_only=True)
     items = CartItemSerializer(many=True, read_only=True)
     total_price = serializers.SerializerMethodField(method_name='get_total_price')
 
     def get_total_price(self, cart: Cart):
-        return sum([item.quantity * item.product.unit_price for item in cart.items.all()])
+        # Пустая корзина - тоже Decimal, как и суммы строк
+        return sum((item.quantity * self.get_price(item.product).price for item in cart.items.all()),
+                   Decimal('0.00'))
 
     class Meta:
         model = Cart
@@ -129,24 +215,19 @@ class CartSerializer(serializers.ModelSerializer):
 class AddCartItemSerializer(serializers.ModelSerializer):
     product_id = serializers.IntegerField()
 
-    def validate_product_id(self, value):
-        if not Product.objects.filter(pk=value).exists():
-            raise serializers.ValidationError('Нет товара с данным id')
-        return value
-
     def save(self, **kwargs):
         cart_id = self.context['cart_id']
         product_id = self.validated_data['product_id']
         quantity = self.validated_data['quantity']
 
-        try:
-            cart_item = CartItem.objects.get(cart_id=cart_id, product_id=product_id)  # 💀
-            cart_item.quantity += quantity
-            cart_item.save()
-            self.instance = cart_item
-        except:
-            self.instance = CartItem.objects.create(cart_id=cart_id, **self.validated_data)
+        # Проверка товара и upsert - один запрос, без гонки между get и create
+        self.instance = CartItem.objects.add_quantity(cart_id, product_id, quantity)
+        if self.instance is None:
+            if not Cart.objects.filter(pk=cart_id).exists():
+                raise NotFound('Корзина не найдена')
+            raise serializers.ValidationError({'product_id': ['Нет товара с данным id']})
 
+        bump_version(cart_scope(cart_id))
         return self.instance
 
     class Meta:
@@ -154,6 +235,85 @@ class AddCartItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product_id', 'quantity']
 
 
+class CartItemQuantitySerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class BulkCartItemsSerializer(serializers.Serializer):
+    """
+    carts/{id}/items/bulk/
+    {
+        "add": [{"product_id": 1, "quantity": 2}],      # прибавить к количеству
+        "update": [{"product_id": 2, "quantity": 5}],   # задать количество
+        "remove": [3, 4]                                # удалить из корзины
+    }
+    Все проверки и записи - фиксированное число запросов, в одной транзакции.
+    Товары, которых нет в корзине, в update и remove - ошибка всей пачки.
+    """
+    add = CartItemQuantitySerializer(many=True, required=False, default=list)
+    update = CartItemQuantitySerializer(many=True, required=False, default=list)
+    remove = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+
+    def validate(self, data):
+        update_ids = [item['product_id'] for item in data['update']]
+        if len(set(update_ids)) != len(update_ids):
+            raise serializers.ValidationError({'update': ['Товар указан несколько раз']})
+        if set(update_ids) & set(data['remove']):
+            raise serializers.ValidationError('Товар нельзя одновременно изменить и удалить')
+        return data
+
+    def get_changes(self):
+        add, update, remove = (self.validated_data[key] for key in ('add', 'update', 'remove'))
+        quantities = {}
+        for item in add:
+            quantities[item['product_id']] = quantities.get(item['product_id'], 0) + item['quantity']
+        new_quantities = {item['product_id']: item['quantity'] for item in update}
+        return quantities, new_quantities, remove
+
+    def save_to_store(self):
+        """То же для корзины в кеше (settings.CART_STORAGE = 'cache')."""
+        quantities, new_quantities, remove = self.get_changes()
+        errors = cart_store.change(self.context['cart_id'], quantities, new_quantities, remove)
+        if errors:
+            raise serializers.ValidationError(errors)
+
+    def save(self, **kwargs):
+        cart_id = self.context['cart_id']
+        quantities, new_quantities, remove = self.get_changes()
+
+        with transaction.atomic():
+            errors = {}
+            added = CartItem.objects.add_quantities(cart_id, quantities)
+            missing = set(quantities) - {item.product_id for item in added}
+            if missing:
+                errors['add'] = [f'Нет товара с id {pk}' for pk in sorted(missing)]
+
+            if new_quantities:
+                items = CartItem.objects.filter(cart_id=cart_id, product_id__in=new_quantities)
+                updated = items.update(quantity=Case(
+                    *[When(product_id=pk, then=Value(quantity))
+                      for pk, quantity in new_quantities.items()]
+                ))
+                if updated != len(new_quantities):
+                    found = set(items.values_list('product_id', flat=True))
+                    errors['update'] = [f'Товара с id {pk} нет в корзине'
+                                        for pk in sorted(set(new_quantities) - found)]
+
+            if remove:
+                items = CartItem.objects.filter(cart_id=cart_id, product_id__in=remove)
+                missing = set(remove) - set(items.values_list('product_id', flat=True))
+                if missing:
+                    errors['remove'] = [f'Товара с id {pk} нет в корзине' for pk in sorted(missing)]
+                items.delete()
+
+            if errors:
+                # Откатываем всю пачку, чтобы корзина не осталась изменена наполовину
+                raise serializers.ValidationError(errors)
+
+        bump_version(cart_scope(cart_id))
+
+
 class UpdateCartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
@@ -190,10 +350,25 @@ class UpdateOrderSerializer(serializers.ModelSerializer):
         fields = ['payment_status']
 
 
+class OutOfStock(Exception):
+    def __init__(self, items):
+        super().__init__(items)
+        self.items = items
+
+
 class CreateOrderSerializer(serializers.Serializer):
     cart_id = serializers.UUIDField()
 
     def validate_cart_id(self, cart_id):
+        if cart_store.is_enabled():
+            try:
+                quantities = cart_store.get_quantities(cart_id)
+            except NotFound:
+                raise serializers.ValidationError('Не существующий ID корзины')
+            if not quantities:
+                raise serializers.ValidationError('Корзина пустая')
+            return cart_id
+
         if not Cart.objects.filter(pk=cart_id).exists():
             raise serializers.ValidationError('Не существующий ID корзины')
         if CartItem.objects.filter(cart_id=cart_id).count() == 0:
@@ -201,28 +376,71 @@ class CreateOrderSerializer(serializers.Serializer):
         return cart_id
 
     def save(self, **kwargs):
-        with transaction.atomic():
-            cart_id = self.validated_data['cart_id']
-            customer = Customer.objects.get(user_id=self.context['user_id'])
-            order = Order.objects.create(customer=customer)
-
-            cart_items = CartItem.objects.select_related('product').filter(cart_id=cart_id)
-
-            order_items = [OrderItem(
-                order=order,
-                product=item.product,
-                unit_price=item.product.unit_price,
-                quantity=item.quantity
-            ) for item in cart_items]
-
-            OrderItem.objects.bulk_create(order_items)
-            Cart.objects.filter(pk=cart_id).delete()
-
-            order_created.send_robust(self.__class__, order=order)
-            return order
-
-
-
-
+        cart_id = self.validated_data['cart_id']
+        if not cart_store.is_enabled():
+            return self.place_order(cart_id)
+        # Корзина из кеша - под ее замком до удаления из кеша: второе оформление
+        # не создаст второй заказ, а изменения корзины не пропадут вместе с ней
+        with cart_store.locked(cart_store.normalize_id(cart_id)):
+            return self.place_order(cart_id)
 
+    def place_order(self, cart_id):
+        order = None
 
+        with transaction.atomic():
+            if cart_store.is_enabled():
+                # Корзина из кеша попадает в БД только сейчас и только при успехе
+                try:
+                    cart_store.materialize(cart_id)
+                except NotFound:
+                    raise serializers.ValidationError({'cart_id': ['Не существующий ID корзины']})
+            # Списание остатков - первым запросом, чтобы сразу взять блокировку на запись
+            reserved = Product.objects.reserve_inventory(cart_id)
+            cart_items = list(CartItem.objects.select_related('product').filter(cart_id=cart_id))
+            if not cart_items:
+                # Повторная отправка: корзину уже оформил параллельный запрос
+                raise serializers.ValidationError({'cart_id': ['Корзина пустая']})
+            prices = get_prices(item.product for item in cart_items)
+
+            if reserved != len(cart_items):
+                transaction.set_rollback(True)
+            else:
+                customer = Customer.objects.get(user_id=self.context['user_id'])
+                order = Order.objects.create(customer=customer)
+
+                order_items = [OrderItem(
+                    order=order,
+                    product=item.product,
+                    unit_price=prices[item.product_id].price,
+                    quantity=item.quantity
+                ) for item in cart_items]
+
+                OrderItem.objects.bulk_create(order_items)
+                Cart.objects.filter(pk=cart_id).delete()
+
+                # Получатели order_created вызываются воркером, а не внутри оформления
+                outbox.enqueue('order_created', order_id=order.id)
+
+        if order is None:
+            raise OutOfStock(self.get_shortages(cart_id))
+        if cart_store.is_enabled():
+            cart_store.delete(cart_id)
+
+        # Остатки изменены через update() - сигналы не сработали
+        bump_catalog(*{item.product.collection_id for item in cart_items})
+        return order
+
+    @staticmethod
+    def get_shortages(cart_id):
+        if cart_store.is_enabled():
+            quantities = cart_store.get_quantities(cart_id)
+        else:
+            quantities = dict(CartItem.objects.filter(cart_id=cart_id)
+                              .values_list('product_id', 'quantity'))
+        products = Product.objects.filter(pk__in=quantities).order_by('pk')
+        return [{
+            'product_id': product.pk,
+            'title': product.title,
+            'requested': quantities[product.pk],
+            'available': product.inventory
+        } for product in products if quantities[product.pk] > product.inventory]
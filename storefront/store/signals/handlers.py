@@ -1,7 +1,24 @@
+from functools import partial
+
 from django.conf import settings
-from django.db.models.signals import post_save
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import m2m_changed, pre_delete, pre_save, post_save, post_delete
+from django.db import transaction
 from django.dispatch import receiver
-from store.models import Customer
+from store.cache import bump_catalog, bump_review_stats, bump_version, cart_scope, reviews_scope
+from store import outbox
+from store.images import delete_variant_files, needs_variants
+from store.pricing import invalidate_prices
+from store.search import index_products, unindex_products
+from tags.models import Tag, TaggedItem
+from store.models import Customer, Collection, Product, ProductImage, Promotion, Review, ReviewStats, \
+    Cart, CartItem
+
+
+def after_commit(func, *args):
+    # До фиксации параллельный запрос прочитал бы еще старые данные
+    # и положил их в кеш под уже новой версией
+    transaction.on_commit(partial(func, *args))
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
@@ -9,3 +26,184 @@ def create_customer_for_new_user(sender, **kwargs):
     if kwargs['created']:
         Customer.objects.create(user=kwargs['instance'])
 
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_collection(sender, instance, **kwargs):
+    # Если товар перенесли в другую категорию - сбросить нужно обе
+    instance._old_collection_id = None
+    if instance.pk is not None:
+        instance._old_collection_id = Product.objects.filter(pk=instance.pk) \
+            .values_list('collection_id', flat=True).first()
+
+
+@receiver(post_save, sender=Product)
+def update_products_count(sender, instance, created, **kwargs):
+    old_collection_id = getattr(instance, '_old_collection_id', None)
+    if created:
+        Collection.objects.change_products_count(instance.collection_id, 1)
+    elif old_collection_id is not None and old_collection_id != instance.collection_id:
+        Collection.objects.change_products_count(old_collection_id, -1)
+        Collection.objects.change_products_count(instance.collection_id, 1)
+
+
+@receiver(post_delete, sender=Product)
+def decrement_products_count(sender, instance, **kwargs):
+    Collection.objects.change_products_count(instance.collection_id, -1)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_catalog_for_product(sender, instance, **kwargs):
+    after_commit(bump_catalog, instance.collection_id, getattr(instance, '_old_collection_id', None))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_price(sender, instance, **kwargs):
+    after_commit(invalidate_prices, [instance.pk])
+
+
+def invalidate_promotion_products(product_ids):
+    product_ids = list(product_ids)
+    after_commit(invalidate_prices, product_ids)
+    after_commit(bump_catalog, *Product.objects.filter(pk__in=product_ids)
+                 .values_list('collection_id', flat=True).distinct())
+
+
+@receiver(post_save, sender=Promotion)
+def invalidate_prices_for_promotion(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_promotion_products(instance.product_set.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Promotion)
+def remember_promotion_products(sender, instance, **kwargs):
+    # После удаления связи с товарами уже не найти
+    instance._product_ids = list(instance.product_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Promotion)
+def invalidate_prices_for_deleted_promotion(sender, instance, **kwargs):
+    invalidate_promotion_products(getattr(instance, '_product_ids', []))
+
+
+@receiver(m2m_changed, sender=Product.promotion.through)
+def invalidate_prices_for_promotion_links(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        instance._product_ids = list(instance.product_set.values_list('pk', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        invalidate_promotion_products([instance.pk])
+    elif action == 'post_clear':
+        invalidate_promotion_products(getattr(instance, '_product_ids', []))
+    else:
+        invalidate_promotion_products(pk_set)
+
+
+@receiver(post_save, sender=TaggedItem)
+@receiver(post_delete, sender=TaggedItem)
+def invalidate_catalog_for_product_tags(sender, instance, **kwargs):
+    # Метки выводятся в сериализованном каталоге
+    if instance.content_type_id == ContentType.objects.get_for_model(Product).pk:
+        after_commit(bump_catalog, Product.objects.filter(pk=instance.object_id)
+                     .values_list('collection_id', flat=True).first())
+
+
+@receiver(post_save, sender=Tag)
+def invalidate_catalog_for_tag_label(sender, instance, created, **kwargs):
+    if created:
+        return
+    product_ids = TaggedItem.objects.filter(
+        tag=instance, content_type=ContentType.objects.get_for_model(Product)
+    ).values_list('object_id', flat=True)
+    collection_ids = list(Product.objects.filter(pk__in=product_ids)
+                          .values_list('collection_id', flat=True).distinct())
+    if collection_ids:
+        after_commit(bump_catalog, *collection_ids)
+
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, using, **kwargs):
+    index_products([(instance.pk, instance.title, instance.description)], using)
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_search_index(sender, instance, using, **kwargs):
+    unindex_products([instance.pk], using)
+
+
+@receiver(post_save, sender=ProductImage)
+def schedule_image_variants(sender, instance, **kwargs):
+    # Превью генерирует воркер outbox, загрузка не ждет Pillow
+    if needs_variants(instance):
+        outbox.enqueue('product_image.uploaded', image_id=instance.pk)
+
+
+@receiver(post_delete, sender=ProductImage)
+def delete_image_variants(sender, instance, **kwargs):
+    # Файлы удаляются только после фиксации транзакции - откат не оставит картинку без превью
+    storage, variants = instance.image.storage, dict(instance.variants)
+    transaction.on_commit(lambda: delete_variant_files(storage, variants))
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def invalidate_catalog_for_image(sender, instance, **kwargs):
+    # Картинки выводятся в товаре: ETag каталога строится из его версий
+    collection_id = Product.objects.filter(pk=instance.product_id) \
+        .values_list('collection_id', flat=True).first()
+    after_commit(bump_catalog, collection_id)
+
+
+@receiver(post_save, sender=Collection)
+@receiver(post_delete, sender=Collection)
+def invalidate_catalog_for_collection(sender, instance, **kwargs):
+    after_commit(bump_catalog, instance.pk)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_reviews(sender, instance, **kwargs):
+    after_commit(bump_version, reviews_scope(instance.product_id))
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_rating(sender, instance, **kwargs):
+    instance._old_rating = None
+    if instance.pk is not None:
+        instance._old_rating = Review.objects.filter(pk=instance.pk) \
+            .values_list('rating', flat=True).first()
+
+
+@receiver(post_save, sender=Review)
+def update_review_stats(sender, instance, created, **kwargs):
+    if created:
+        ReviewStats.objects.change(instance.product_id, instance.rating, 1)
+    elif instance.rating != instance._old_rating:
+        ReviewStats.objects.change_rating(instance.product_id, instance._old_rating, instance.rating)
+    else:
+        return
+    # Сводка отзывов выводится в каталоге
+    after_commit(bump_review_stats, instance.product_id, Product.objects.filter(pk=instance.product_id)
+                 .values_list('collection_id', flat=True).first())
+
+
+@receiver(post_delete, sender=Review)
+def remove_from_review_stats(sender, instance, **kwargs):
+    ReviewStats.objects.change(instance.product_id, instance.rating, -1)
+    after_commit(bump_review_stats, instance.product_id, Product.objects.filter(pk=instance.product_id)
+                 .values_list('collection_id', flat=True).first())
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def invalidate_cart_for_item(sender, instance, **kwargs):
+    after_commit(bump_version, cart_scope(instance.cart_id))
+
+
+@receiver(post_delete, sender=Cart)
+def invalidate_cart(sender, instance, **kwargs):
+    after_commit(bump_version, cart_scope(instance.pk))
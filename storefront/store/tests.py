@@ -1,3 +1,1668 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import shutil
+import tempfile
+from base64 import urlsafe_b64encode
+from datetime import timedelta
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier
+from unittest import mock
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+from rest_framework.mixins import RetrieveModelMixin
+from rest_framework.test import APIClient, APIRequestFactory, APITestCase
+from rest_framework.viewsets import GenericViewSet
+
+from core.models import User
+from . import async_views, cart_store, outbox
+from .models import Cart, CartItem, Collection, Customer, Order, OrderItem, OutboxMessage, Product, \
+    ProductImage, Promotion, Review, ReviewStats
+from .serializers import CollectionSerializer, CreateOrderSerializer
+from .cache import CATALOG_SCOPE, cart_scope, collection_scope, get_version
+from .mixins import ConditionalGetMixin
+from .pricing import get_prices
+from .search import SQLITE_TABLE
+from .signals import order_created
+from likes.models import LikedItem
+from tags.models import Tag, TaggedItem
+
+
+class QueryBudgetTestCase(APITestCase):
+    """
+    Проверяет, что эндпоинт укладывается в бюджет SQL-запросов и что число
+    запросов не растет вместе с объемом данных (нет N+1).
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.collection = Collection.objects.create(title='Напитки')
+
+    def create_products(self, count, images=1, tags=0):
+        tag_labels = [Tag.objects.create(label=f'метка {index}') for index in range(tags)]
+        products = []
+        for index in range(count):
+            product = Product.objects.create(title=f'Товар {index}', slug=f'product-{index}',
+                                             unit_price=10 + index, inventory=100,
+                                             collection=self.collection)
+            for _ in range(images):
+                ProductImage.objects.create(product=product, image='store/images/dog.jpg')
+            for tag in tag_labels:
+                TaggedItem.objects.create(tag=tag, content_object=product)
+            products.append(product)
+        return products
+
+    def create_orders(self, customer, count, items=3):
+        products = self.create_products(items)
+        for _ in range(count):
+            order = Order.objects.create(customer=customer)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, quantity=1, unit_price=product.unit_price)
+                for product in products
+            ])
+
+    def get_with_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response, context
+
+    def assertQueryBudget(self, url, budget):
+        response, context = self.get_with_queries(url)
+        queries = '\n'.join(query['sql'] for query in context.captured_queries)
+        self.assertLessEqual(len(context), budget,
+                             f'{url}: {len(context)} запросов при бюджете {budget}\n{queries}')
+        return len(context)
+
+    def assertQueriesConstant(self, url, grow):
+        """Число запросов не меняется после grow() - добавления данных."""
+        _, before = self.get_with_queries(url)
+        grow()
+        _, after = self.get_with_queries(url)
+        self.assertEqual(len(before), len(after),
+                         f'{url}: {len(before)} -> {len(after)} запросов после роста данных')
+
+
+class OrderQueryBudgetTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('customer', 'customer@example.com', 'secret')
+        self.customer = Customer.objects.get(user=self.user)
+        self.client.force_authenticate(self.user)
+
+    def test_customer_order_list(self):
+        self.create_orders(self.customer, 5)
+        self.assertQueryBudget('/orders/', 2)
+        self.assertQueriesConstant('/orders/', lambda: self.create_orders(self.customer, 20))
+
+    def test_staff_order_list(self):
+        self.user.is_staff = True
+        self.user.save()
+        other = User.objects.create_user('other', 'other@example.com', 'secret')
+        self.create_orders(self.customer, 5)
+        self.create_orders(Customer.objects.get(user=other), 5)
+        self.assertQueryBudget('/orders/', 2)
+        self.assertQueriesConstant('/orders/', lambda: self.create_orders(self.customer, 20))
+
+    def test_order_list_with_cursor(self):
+        self.create_orders(self.customer, 15)
+        self.assertQueryBudget('/orders/?cursor=', 3)
+        self.assertQueryBudget('/orders/?cursor=&count=false', 2)
+
+
+class CartQueryBudgetTests(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cart = Cart.objects.create()
+
+    def add_items(self, count):
+        CartItem.objects.bulk_create([
+            CartItem(cart=self.cart, product=product, quantity=2)
+            for product in self.create_products(count, images=0)
+        ])
+
+    def test_cart_detail(self):
+        self.add_items(3)
+        url = f'/carts/{self.cart.id}/'
+        # +1 запрос цен (store.pricing) - кеш очищается перед замером
+        self.assertQueryBudget(url, 4)
+        self.assertQueriesConstant(url, lambda: self.add_items(20))
+
+    def test_cart_items(self):
+        self.add_items(3)
+        url = f'/carts/{self.cart.id}/items/'
+        self.assertQueryBudget(url, 2)
+        self.assertQueriesConstant(url, lambda: self.add_items(20))
+
+
+class CatalogQueryBudgetTests(QueryBudgetTestCase):
+    def test_product_list(self):
+        self.create_products(5)
+        self.assertQueryBudget('/products/', 6)
+        self.assertQueriesConstant('/products/', lambda: self.create_products(5, images=3, tags=2))
+
+    def test_product_list_from_cache(self):
+        self.create_products(5)
+        self.client.get('/products/')
+        with CaptureQueriesContext(connection) as context:
+            self.client.get('/products/')
+        # ETag строится по ключу кеша, сами данные берутся из кеша
+        self.assertEqual(len(context), 0)
+
+    def test_product_detail(self):
+        product = self.create_products(1, images=3, tags=2)[0]
+        self.assertQueryBudget(f'/products/{product.id}/', 5)
+
+    def test_collection_list(self):
+        self.create_products(5)
+        self.assertQueryBudget('/collections/', 1)
+        self.assertQueriesConstant(
+            '/collections/',
+            lambda: Collection.objects.bulk_create([Collection(title=f'{i}') for i in range(10)])
+        )
+
+
+class CatalogCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.collection = Collection.objects.create(title='Напитки')
+        self.tea = Product.objects.create(title='Чай', slug='tea', unit_price=100,
+                                          inventory=10, collection=self.collection)
+        self.list_url = f'/products/?collection_id={self.collection.pk}'
+        self.detail_url = f'/products/{self.tea.pk}/'
+
+    def titles(self):
+        return (self.client.get('/products/').data['results'][0]['title'],
+                self.client.get(self.list_url).data['results'][0]['title'],
+                self.client.get(self.detail_url).data['title'])
+
+    def change_behind_cache(self):
+        # update() не вызывает сигналы - версии каталога не меняются
+        Product.objects.filter(pk=self.tea.pk).update(title='Изменено')
+
+    def test_repeated_requests_are_served_from_cache(self):
+        self.assertEqual(self.titles(), ('Чай', 'Чай', 'Чай'))
+        self.change_behind_cache()
+        self.assertEqual(self.titles(), ('Чай', 'Чай', 'Чай'))
+
+    def test_product_write_refreshes_pages(self):
+        self.titles()
+        self.tea.refresh_from_db()
+        self.tea.title = 'Зеленый чай'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tea.save()
+        self.assertEqual(self.titles(), ('Зеленый чай',) * 3)
+
+    def test_versions_are_bumped_after_commit(self):
+        self.titles()
+        version = get_version(collection_scope(self.collection.pk))
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.tea.title = 'Зеленый чай'
+            self.tea.save()
+        # До фиксации читатели получают и кешируют прежнюю версию
+        self.assertEqual(get_version(collection_scope(self.collection.pk)), version)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.titles(), ('Зеленый чай',) * 3)
+
+    def test_collection_write_bumps_its_version(self):
+        self.titles()
+        version = get_version(collection_scope(self.collection.pk))
+        self.change_behind_cache()
+        self.collection.title = 'Чай и кофе'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.collection.save()
+        self.assertGreater(get_version(collection_scope(self.collection.pk)), version)
+        self.assertEqual(self.titles(), ('Изменено',) * 3)
+
+    def test_promotion_write_refreshes_prices(self):
+        promotion = Promotion.objects.create(description='Осень', discount=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tea.promotion.add(promotion)
+        self.assertEqual(self.client.get(self.list_url).data['results'][0]['discounted_price'],
+                         Decimal('90.00'))
+        promotion.discount = 50
+        with self.captureOnCommitCallbacks(execute=True):
+            promotion.save()
+        self.assertEqual(self.client.get(self.list_url).data['results'][0]['discounted_price'],
+                         Decimal('50.00'))
+        self.assertEqual(self.client.get(self.detail_url).data['discounted_price'], Decimal('50.00'))
+
+    def test_zero_padded_collection_id_is_refreshed(self):
+        url = f'/products/?collection_id=0{self.collection.pk}'
+        response = self.client.get(url)
+        self.assertEqual(response.data['results'][0]['title'], 'Чай')
+        self.tea.title = 'Зеленый чай'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tea.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        self.assertEqual(self.client.get(url).data['results'][0]['title'], 'Зеленый чай')
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.collection = Collection.objects.create(title='Напитки')
+        self.tea = Product.objects.create(title='Чай', slug='tea', unit_price=100,
+                                          inventory=10, collection=self.collection)
+
+    def test_if_none_match(self):
+        for url in ('/products/', f'/products/{self.tea.pk}/', '/collections/'):
+            etag = self.client.get(url)['ETag']
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_list_not_modified_without_queries(self):
+        etag = self.client.get('/products/')['ETag']
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(context), 0)
+
+    def test_etag_depends_on_query(self):
+        self.assertNotEqual(self.client.get('/products/')['ETag'],
+                            self.client.get('/products/?ordering=unit_price')['ETag'])
+
+    def test_promotion_change_changes_etag(self):
+        urls = ('/products/', f'/products/{self.tea.pk}/')
+        etags = [self.client.get(url)['ETag'] for url in urls]
+        promotion = Promotion.objects.create(description='Осень', discount=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tea.promotion.add(promotion)
+        for url, etag in zip(urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_missing_object_is_never_not_modified(self):
+        response = self.client.get('/products/0/', HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(f'/products/{self.tea.pk}/', HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 304)
+
+    def test_if_modified_since(self):
+        last_modified = timezone.now() - timedelta(hours=1)
+
+        class LastModifiedViewSet(ConditionalGetMixin, RetrieveModelMixin, GenericViewSet):
+            queryset = Collection.objects.all()
+            serializer_class = CollectionSerializer
+
+            def get_validators(self, request):
+                return ['v1'], last_modified
+
+        view = LastModifiedViewSet.as_view({'get': 'retrieve'})
+        factory = APIRequestFactory()
+
+        def get(pk, since):
+            return view(factory.get('/', HTTP_IF_MODIFIED_SINCE=http_date(since.timestamp())), pk=pk)
+
+        response = get(self.collection.pk, last_modified - timedelta(minutes=1))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Last-Modified'], http_date(int(last_modified.timestamp())))
+        self.assertEqual(get(self.collection.pk, last_modified).status_code, 304)
+        self.assertEqual(get(0, last_modified).status_code, 404)
+
+
+class AddCartItemTests(APITestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Напитки')
+        self.product = Product.objects.create(title='Сок', slug='juice', unit_price=10,
+                                              inventory=100, collection=collection)
+        self.cart = Cart.objects.create()
+        self.url = f'/carts/{self.cart.id}/items/'
+
+    def test_repeated_add_increments_quantity(self):
+        self.client.post(self.url, {'product_id': self.product.id, 'quantity': 2})
+        response = self.client.post(self.url, {'product_id': self.product.id, 'quantity': 3})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['quantity'], 5)
+        self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, 5)
+
+    def test_add_is_single_query(self):
+        with CaptureQueriesContext(connection) as context:
+            self.client.post(self.url, {'product_id': self.product.id, 'quantity': 1})
+        self.assertEqual(len(context), 1)
+
+    def test_unknown_product(self):
+        response = self.client.post(self.url, {'product_id': 999, 'quantity': 1})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('product_id', response.data)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_unknown_cart(self):
+        url = '/carts/00000000-0000-0000-0000-000000000000/items/'
+        response = self.client.post(url, {'product_id': self.product.id, 'quantity': 1})
+        self.assertEqual(response.status_code, 404)
+
+
+class ConcurrentAddCartItemTests(TransactionTestCase):
+    def test_parallel_adds_do_not_lose_increments(self):
+        collection = Collection.objects.create(title='Напитки')
+        product = Product.objects.create(title='Сок', slug='juice', unit_price=10,
+                                         inventory=100, collection=collection)
+        cart = Cart.objects.create()
+        url = f'/carts/{cart.id}/items/'
+
+        def add(_):
+            try:
+                return APIClient().post(url, {'product_id': product.id, 'quantity': 1}).status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            codes = list(pool.map(add, range(40)))
+
+        self.assertEqual(codes, [201] * 40)
+        self.assertEqual(list(CartItem.objects.values_list('quantity', flat=True)), [40])
+
+
+class BulkCartItemsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        collection = Collection.objects.create(title='Напитки')
+        self.products = [
+            Product.objects.create(title=f'Товар {index}', slug=f'product-{index}', unit_price=10,
+                                   inventory=100, collection=collection)
+            for index in range(30)
+        ]
+        self.cart = Cart.objects.create()
+        self.url = f'/carts/{self.cart.id}/items/bulk/'
+
+    def post_bulk(self, data):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(self.url, data, format='json')
+        return response, len(context)
+
+    def payload(self, products):
+        return {
+            'add': [{'product_id': product.id, 'quantity': 2} for product in products],
+            'update': [],
+            'remove': []
+        }
+
+    def test_add_update_remove(self):
+        first, second, third = self.products[:3]
+        CartItem.objects.create(cart=self.cart, product=first, quantity=1)
+        CartItem.objects.create(cart=self.cart, product=second, quantity=1)
+
+        response, _ = self.post_bulk({
+            'add': [{'product_id': first.id, 'quantity': 2}, {'product_id': third.id, 'quantity': 1}],
+            'update': [{'product_id': second.id, 'quantity': 7}],
+            'remove': []
+        })
+
+        self.assertEqual(response.status_code, 200)
+        quantities = dict(CartItem.objects.values_list('product_id', 'quantity'))
+        self.assertEqual(quantities, {first.id: 3, second.id: 7, third.id: 1})
+
+        response, _ = self.post_bulk({'remove': [first.id, third.id]})
+        self.assertEqual([item['product']['id'] for item in response.data['items']], [second.id])
+
+    def test_query_count_does_not_depend_on_size(self):
+        _, small = self.post_bulk(self.payload(self.products[:2]))
+        _, large = self.post_bulk(self.payload(self.products[2:30]))
+        self.assertEqual(small, large)
+
+    def test_errors_roll_back_whole_batch(self):
+        response, _ = self.post_bulk({
+            'add': [{'product_id': self.products[0].id, 'quantity': 1},
+                    {'product_id': 999, 'quantity': 1}],
+            'update': [{'product_id': self.products[1].id, 'quantity': 3}]
+        })
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('add', response.data)
+        self.assertIn('update', response.data)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_remove_reports_unknown_ids(self):
+        first, second = self.products[:2]
+        CartItem.objects.create(cart=self.cart, product=first, quantity=1)
+
+        response, _ = self.post_bulk({'remove': [first.id, second.id, 999]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['remove'], [f'Товара с id {second.id} нет в корзине',
+                                                   'Товара с id 999 нет в корзине'])
+        self.assertTrue(CartItem.objects.filter(product=first).exists())
+
+
+class CheckoutInventoryTests(APITestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Напитки')
+        self.juice = Product.objects.create(title='Сок', slug='juice', unit_price=10,
+                                            inventory=5, collection=collection)
+        self.water = Product.objects.create(title='Вода', slug='water', unit_price=5,
+                                            inventory=1, collection=collection)
+        self.user = User.objects.create(username='customer', email='customer@example.com')
+        self.client.force_authenticate(self.user)
+
+    def checkout(self, **quantities):
+        cart = Cart.objects.create()
+        for name, quantity in quantities.items():
+            CartItem.objects.create(cart=cart, product=getattr(self, name), quantity=quantity)
+        return cart, self.client.post('/orders/', {'cart_id': str(cart.id)})
+
+    def test_checkout_decrements_inventory(self):
+        _, response = self.checkout(juice=2, water=1)
+
+        self.assertEqual(response.status_code, 200)
+        self.juice.refresh_from_db()
+        self.water.refresh_from_db()
+        self.assertEqual((self.juice.inventory, self.water.inventory), (3, 0))
+
+    def test_shortage_returns_per_item_error_and_changes_nothing(self):
+        cart, response = self.checkout(juice=2, water=3)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['items'], [{
+            'product_id': self.water.id, 'title': 'Вода', 'requested': 3, 'available': 1
+        }])
+        self.juice.refresh_from_db()
+        self.assertEqual(self.juice.inventory, 5)
+        self.assertFalse(Order.objects.exists())
+        self.assertTrue(Cart.objects.filter(pk=cart.pk).exists())
+
+    def test_cart_checked_out_after_validation_is_rejected(self):
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product=self.juice, quantity=1)
+        first, second = [CreateOrderSerializer(data={'cart_id': str(cart.id)},
+                                               context={'user_id': self.user.id}) for _ in range(2)]
+        self.assertTrue(first.is_valid() and second.is_valid())
+
+        first.save()
+        with self.assertRaises(ValidationError):
+            second.save()
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OutboxMessage.objects.filter(topic='order_created').count(), 1)
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    def test_no_oversell_under_concurrent_checkouts(self):
+        collection = Collection.objects.create(title='Напитки')
+        products = [
+            Product.objects.create(title=f'Товар {index}', slug=f'product-{index}',
+                                   unit_price=10, inventory=10, collection=collection)
+            for index in range(3)
+        ]
+
+        checkouts = []
+        for index in range(40):
+            user = User.objects.create(username=f'customer{index}',
+                                       email=f'customer{index}@example.com')
+            cart = Cart.objects.create()
+            # Корзины пересекаются и перечисляют товары в разном порядке
+            for offset in range(2):
+                product = products[(index + offset) % len(products)]
+                CartItem.objects.create(cart=cart, product=product, quantity=1 + index % 3)
+            checkouts.append((user, cart))
+
+        def checkout(args):
+            user, cart = args
+            try:
+                client = APIClient()
+                client.force_authenticate(user)
+                return client.post('/orders/', {'cart_id': str(cart.id)}).status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=12) as pool:
+            codes = list(pool.map(checkout, checkouts))
+
+        self.assertTrue(set(codes) <= {200, 409}, codes)
+        self.assertIn(200, codes)
+        for product in products:
+            product.refresh_from_db()
+            sold = sum(OrderItem.objects.filter(product=product).values_list('quantity', flat=True))
+            self.assertGreaterEqual(product.inventory, 0)
+            self.assertEqual(product.inventory + sold, 10)
+        self.assertEqual(Order.objects.count(), codes.count(200))
+
+    def test_double_submit_creates_one_order(self):
+        collection = Collection.objects.create(title='Напитки')
+        product = Product.objects.create(title='Сок', slug='juice', unit_price=10,
+                                         inventory=10, collection=collection)
+        user = User.objects.create(username='customer', email='customer@example.com')
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product=product, quantity=2)
+        barrier = Barrier(2)
+
+        def checkout(_):
+            try:
+                client = APIClient()
+                client.force_authenticate(user)
+                barrier.wait()
+                return client.post('/orders/', {'cart_id': str(cart.id)}).status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            codes = sorted(pool.map(checkout, range(2)))
+
+        self.assertEqual(codes, [200, 400])
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OutboxMessage.objects.filter(topic='order_created').count(), 1)
+        product.refresh_from_db()
+        self.assertEqual(product.inventory, 8)
+
+
+class OutboxTests(APITestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Напитки')
+        self.product = Product.objects.create(title='Сок', slug='juice', unit_price=10,
+                                              inventory=5, collection=collection)
+        self.user = User.objects.create(username='customer', email='customer@example.com')
+        self.client.force_authenticate(self.user)
+        self.received = []
+
+    def tearDown(self):
+        order_created.disconnect(self.on_order_created)
+
+    def on_order_created(self, sender, **kwargs):
+        self.received.append(kwargs['order'].id)
+
+    def place_order(self):
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+        return self.client.post('/orders/', {'cart_id': str(cart.id)}).data['id']
+
+    def test_checkout_only_writes_outbox(self):
+        order_created.connect(self.on_order_created)
+        order_id = self.place_order()
+
+        self.assertEqual(self.received, [])
+        message = OutboxMessage.objects.get()
+        self.assertEqual((message.topic, message.payload), ('order_created', {'order_id': order_id}))
+
+        self.assertEqual(outbox.process_batch(), (1, 0))
+        self.assertEqual(self.received, [order_id])
+        message.refresh_from_db()
+        self.assertEqual(message.status, OutboxMessage.STATUS_DONE)
+        self.assertEqual(outbox.process_batch(), (0, 0))
+
+    def test_failed_delivery_is_retried_with_backoff(self):
+        def failing(sender, **kwargs):
+            raise ConnectionError('ERP недоступна')
+
+        order_created.connect(failing)
+        try:
+            self.place_order()
+            self.assertEqual(outbox.process_batch(), (0, 1))
+        finally:
+            order_created.disconnect(failing)
+
+        message = OutboxMessage.objects.get()
+        self.assertEqual((message.status, message.attempts), (OutboxMessage.STATUS_PENDING, 1))
+        self.assertGreater(message.available_at, timezone.now())
+        # До истечения задержки событие не берется повторно
+        self.assertEqual(outbox.process_batch(), (0, 0))
+
+        OutboxMessage.objects.update(available_at=timezone.now())
+        order_created.connect(self.on_order_created)
+        self.assertEqual(outbox.process_batch(), (1, 0))
+
+    def test_gives_up_after_max_attempts(self):
+        self.place_order()
+        OutboxMessage.objects.update(topic='unknown')
+        outbox.process_batch(max_attempts=1)
+        self.assertEqual(OutboxMessage.objects.get().status, OutboxMessage.STATUS_FAILED)
+
+
+class CollectionProductsCountTests(APITestCase):
+    def setUp(self):
+        self.drinks = Collection.objects.create(title='Напитки')
+        self.snacks = Collection.objects.create(title='Закуски')
+
+    def create_product(self, collection):
+        return Product.objects.create(title='Товар', slug='product', unit_price=10,
+                                      inventory=1, collection=collection)
+
+    def counts(self):
+        return dict(Collection.objects.values_list('title', 'products_count'))
+
+    def test_counter_follows_product_changes(self):
+        first = self.create_product(self.drinks)
+        second = self.create_product(self.drinks)
+        self.assertEqual(self.counts(), {'Напитки': 2, 'Закуски': 0})
+
+        first.collection = self.snacks
+        first.save()
+        self.assertEqual(self.counts(), {'Напитки': 1, 'Закуски': 1})
+
+        second.delete()
+        self.assertEqual(self.counts(), {'Напитки': 0, 'Закуски': 1})
+
+    def test_saving_stale_collection_keeps_counter(self):
+        stale = Collection.objects.get(pk=self.drinks.pk)
+        self.create_product(self.drinks)
+        stale.title = 'Соки'
+        stale.save()
+        self.assertEqual(self.counts()['Соки'], 1)
+
+    def test_reconcile_fixes_drift(self):
+        Product.objects.bulk_create([
+            Product(title='Товар', slug='product', unit_price=10, inventory=1, collection=self.snacks)
+        ])
+        self.assertEqual(Collection.objects.reconcile_products_count(),
+                         {self.snacks.pk: (0, 1)})
+        self.assertEqual(self.counts()['Закуски'], 1)
+
+
+class ImageVariantsTests(APITestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        collection = Collection.objects.create(title='Напитки')
+        self.product = Product.objects.create(title='Чай', slug='tea', unit_price=10,
+                                              inventory=1, collection=collection)
+
+    def upload(self, width, height):
+        return ProductImage.objects.create(product=self.product, image=self.image_file(width, height))
+
+    @staticmethod
+    def image_file(width, height):
+        buffer = BytesIO()
+        Image.new('RGB', (width, height), 'red').save(buffer, 'JPEG')
+        return SimpleUploadedFile('tea.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def variant_files(self, image):
+        return [name for key, name in image.variants.items() if key != 'source']
+
+    def test_variants_are_generated_by_outbox_worker(self):
+        image = self.upload(600, 300)
+        self.assertEqual(image.variants, {})
+        self.assertTrue(OutboxMessage.objects.filter(topic='product_image.uploaded').exists())
+
+        self.assertEqual(outbox.process_batch(), (1, 0))
+
+        image.refresh_from_db()
+        self.assertEqual(set(image.variants), {'source', '160', '480', '600'})
+        with image.image.storage.open(image.variants['160']) as file:
+            with Image.open(file) as variant:
+                self.assertEqual((variant.format, variant.size), ('WEBP', (160, 80)))
+
+        response = self.client.get(f'/products/{self.product.pk}/images/')
+        self.assertEqual(set(response.data[0]['variants']), {'160', '480', '600'})
+
+    def test_image_save_changes_etag_without_touching_product(self):
+        url = f'/products/{self.product.pk}/'
+        etag = self.client.get(url)['ETag']
+        last_update = Product.objects.get(pk=self.product.pk).last_update
+        with self.captureOnCommitCallbacks(execute=True):
+            self.upload(100, 100)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).last_update, last_update)
+
+    def test_small_image_is_not_upscaled(self):
+        image = self.upload(100, 100)
+        outbox.process_batch()
+        image.refresh_from_db()
+        self.assertEqual(set(image.variants), {'source', '100'})
+
+    def test_variants_are_deleted_with_image(self):
+        image = self.upload(600, 300)
+        outbox.process_batch()
+        image.refresh_from_db()
+        storage, names = image.image.storage, self.variant_files(image)
+        self.assertTrue(all(storage.exists(name) for name in names))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertFalse(any(storage.exists(name) for name in names))
+
+    def test_replaced_image_variants_are_deleted(self):
+        image = self.upload(600, 300)
+        outbox.process_batch()
+        image.refresh_from_db()
+        storage, old_names = image.image.storage, self.variant_files(image)
+
+        image.image = self.image_file(200, 100)
+        image.save()
+        outbox.process_batch()
+        image.refresh_from_db()
+        self.assertFalse(any(storage.exists(name) for name in old_names))
+        self.assertEqual(set(image.variants), {'source', '160', '200'})
+        self.assertTrue(all(storage.exists(name) for name in self.variant_files(image)))
+
+
+class StreamingImageUploadTests(APITestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        collection = Collection.objects.create(title='Напитки')
+        self.product = Product.objects.create(title='Чай', slug='tea', unit_price=10,
+                                              inventory=1, collection=collection)
+        self.url = f'/products/{self.product.pk}/images/'
+
+    def post(self, content, name='tea.png'):
+        return self.client.post(self.url, {'image': SimpleUploadedFile(name, content)},
+                                format='multipart')
+
+    def png(self, size=(20, 20)):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def test_valid_image_is_saved(self):
+        response = self.post(self.png())
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(ProductImage.objects.filter(product=self.product).count(), 1)
+
+    def test_oversized_upload_is_rejected_while_streaming(self):
+        response = self.post(self.png() + b'\0' * (500 * 1024))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('500KB', response.data['image'][0])
+        self.assertFalse(ProductImage.objects.exists())
+
+    def test_non_image_is_rejected_by_header(self):
+        response = self.post(b'<?php echo 1; ?>' * 100, name='shell.png')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+        self.assertFalse(ProductImage.objects.exists())
+
+    def test_file_shorter_than_header_is_rejected(self):
+        response = self.post(b'GIF', name='tiny.gif')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('JPEG', response.data['image'][0])
+        self.assertFalse(ProductImage.objects.exists())
+
+    def test_rejected_replacement_keeps_image(self):
+        image_id = self.post(self.png()).data['id']
+        name = ProductImage.objects.get(pk=image_id).image.name
+        response = self.client.patch(f'{self.url}{image_id}/',
+                                     {'image': SimpleUploadedFile('big.png', self.png() + b'\0' * (500 * 1024))},
+                                     format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('500KB', response.data['image'][0])
+        self.assertEqual(ProductImage.objects.get(pk=image_id).image.name, name)
+
+
+class CatalogImportExportTests(APITestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = f'{directory}/catalog.csv'
+        Promotion.objects.create(description='Осень', discount=10)
+
+    def import_csv(self, content, **options):
+        with open(self.path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_catalog', self.path, chunk_size=2, stdout=stdout, stderr=stderr,
+                     **options)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_import_upserts_by_slug(self):
+        stdout, stderr = self.import_csv(
+            'slug,title,description,unit_price,inventory,collection,promotions\n'
+            'tea,Чай,,10,5,Напитки,Осень\n'
+            'coffee,Кофе,Зерно,20,3,Напитки,\n'
+            'cookie,Печенье,,5,0,Закуски,\n'
+            'broken,Сломан,,-1,1,Напитки,\n'
+        )
+        self.assertIn('Создано: 3, обновлено: 0, пропущено с ошибкой: 1', stdout)
+        self.assertIn('Запись 4: unit_price', stderr)
+        self.assertEqual(dict(Collection.objects.values_list('title', 'products_count')),
+                         {'Напитки': 2, 'Закуски': 1})
+        self.assertEqual(list(Product.objects.get(slug='tea').promotion.values_list(
+            'description', flat=True)), ['Осень'])
+
+        response = self.client.get('/products/', {'search': 'зерно'})
+        self.assertEqual([item['title'] for item in response.data['results']], ['Кофе'])
+
+        stdout, _ = self.import_csv(
+            'slug,title,unit_price,inventory,collection\n'
+            'tea,Чай зеленый,12,7,Закуски\n'
+        )
+        self.assertIn('Создано: 0, обновлено: 1', stdout)
+        tea = Product.objects.get(slug='tea')
+        self.assertEqual((tea.title, tea.inventory, tea.promotion.count()), ('Чай зеленый', 7, 1))
+        self.assertEqual(dict(Collection.objects.values_list('title', 'products_count')),
+                         {'Напитки': 1, 'Закуски': 2})
+
+    def test_export_round_trip(self):
+        self.import_csv(
+            'slug,title,description,unit_price,inventory,collection,promotions,images\n'
+            'tea,Чай,Лист,10,5,Напитки,Осень,store/images/tea.jpg\n'
+        )
+        self.assertTrue(OutboxMessage.objects.filter(topic='product_image.uploaded').exists())
+
+        stdout = StringIO()
+        call_command('export_catalog', format='ndjson', stdout=stdout)
+        records = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual(records, [{
+            'slug': 'tea', 'title': 'Чай', 'description': 'Лист', 'unit_price': '10.00',
+            'inventory': 5, 'collection': 'Напитки', 'promotions': ['Осень'],
+            'images': ['store/images/tea.jpg'],
+        }])
+
+
+class OrderExportTests(APITestCase):
+    def setUp(self):
+        self.staff = User.objects.create(username='finance', email='finance@example.com',
+                                         is_staff=True)
+        customer = Customer.objects.get(user=User.objects.create(username='buyer',
+                                                                 email='buyer@example.com'))
+        collection = Collection.objects.create(title='Напитки')
+        self.product = Product.objects.create(title='Чай', slug='tea', unit_price=10,
+                                              inventory=100, collection=collection)
+        for day in (1, 15, 31):
+            order = Order.objects.create(customer=customer)
+            Order.objects.filter(pk=order.pk).update(
+                placed_at=timezone.make_aware(timezone.datetime(2024, 1, day, 12))
+            )
+            OrderItem.objects.create(order=order, product=self.product, quantity=day,
+                                     unit_price=10)
+
+    def export(self, **params):
+        response = self.client.get('/orders/export/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response, StreamingHttpResponse)
+        return b''.join(response.streaming_content).decode()
+
+    def test_staff_only(self):
+        self.client.force_authenticate(User.objects.get(username='buyer'))
+        self.assertEqual(self.client.get('/orders/export/').status_code, 403)
+
+    def test_csv_export_with_date_range(self):
+        self.client.force_authenticate(self.staff)
+        content = self.export(placed_after='2024-01-10', placed_before='2024-01-31')
+        rows = list(csv.DictReader(StringIO(content)))
+        self.assertEqual([(row['quantity'], row['total_price'], row['email']) for row in rows],
+                         [('15', '150.00', 'buyer@example.com'), ('31', '310.00', 'buyer@example.com')])
+
+    def test_ndjson_export(self):
+        self.client.force_authenticate(self.staff)
+        content = self.export(file_format='ndjson', placed_before='2024-01-01T13:00:00')
+        records = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['product_title'], 'Чай')
+
+    def test_invalid_bound(self):
+        self.client.force_authenticate(self.staff)
+        response = self.client.get('/orders/export/', {'placed_after': 'вчера'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('placed_after', response.data)
+
+
+class PricingTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        collection = Collection.objects.create(title='Напитки')
+        self.tea = Product.objects.create(title='Чай', slug='tea', unit_price=100,
+                                          inventory=10, collection=collection)
+        self.coffee = Product.objects.create(title='Кофе', slug='coffee', unit_price=50,
+                                             inventory=10, collection=collection)
+        self.autumn = Promotion.objects.create(description='Осень', discount=10)
+        self.tea.promotion.add(self.autumn, Promotion.objects.create(description='Зима', discount=25))
+
+    def price(self, product):
+        return get_prices([product])[product.pk]
+
+    def test_best_discount_and_tax(self):
+        self.assertEqual(self.price(self.tea)[1:], (25, Decimal('75.00'), Decimal('82.50')))
+        self.assertEqual(self.price(self.coffee)[1:], (0, Decimal('50.00'), Decimal('55.00')))
+
+    def test_prices_are_cached_and_invalidated(self):
+        get_prices([self.tea, self.coffee])
+        with self.assertNumQueries(0):
+            get_prices([self.tea, self.coffee])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.coffee.promotion.add(self.autumn)
+        self.assertEqual(self.price(self.coffee).price, Decimal('45.00'))
+
+        self.autumn.discount = 50
+        with self.captureOnCommitCallbacks(execute=True):
+            self.autumn.save()
+        self.assertEqual(self.price(self.tea).price, Decimal('50.00'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.autumn.delete()
+        self.assertEqual(self.price(self.coffee).price, Decimal('50.00'))
+
+        self.tea.unit_price = 200
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tea.save()
+        self.assertEqual(self.price(self.tea).price, Decimal('150.00'))
+
+    def test_catalog_cart_and_checkout_use_discounted_price(self):
+        response = self.client.get(f'/products/{self.tea.pk}/')
+        self.assertEqual((response.data['discounted_price'], response.data['price_with_tax']),
+                         (Decimal('75.00'), Decimal('82.50')))
+
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product=self.tea, quantity=2)
+        response = self.client.get(f'/carts/{cart.pk}/')
+        self.assertEqual(response.data['total_price'], Decimal('150.00'))
+
+        user = User.objects.create(username='buyer')
+        self.client.force_authenticate(user)
+        response = self.client.post('/orders/', {'cart_id': str(cart.pk)})
+        self.assertEqual(response.data['items'][0]['unit_price'], Decimal('75.00'))
+
+
+class CartTotalsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        collection = Collection.objects.create(title='Напитки')
+        self.cart = Cart.objects.create()
+        for index, price in enumerate(['15.00', '9.99', '0.55']):
+            product = Product.objects.create(title=f'Товар {index}', slug=f'product-{index}',
+                                             unit_price=price, inventory=10, collection=collection)
+            CartItem.objects.create(cart=self.cart, product=product, quantity=3)
+        product.promotion.add(Promotion.objects.create(description='Осень', discount=10))
+
+    def test_totals_match_pricing_engine(self):
+        response = self.client.get(f'/carts/{self.cart.id}/')
+        prices = get_prices(CartItem.objects.filter(cart=self.cart).values_list('product_id', flat=True))
+
+        lines = {item['product']['id']: item for item in response.data['items']}
+        for product_id, price in prices.items():
+            self.assertEqual(lines[product_id]['price'], price.price)
+            self.assertEqual(lines[product_id]['total_price'], price.price * 3)
+        self.assertEqual(response.data['total_price'], sum(price.price * 3 for price in prices.values()))
+        self.assertEqual(response.data['total_price'], Decimal('76.47'))
+
+
+class PurgeExpiredCartsTests(APITestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Напитки')
+        product = Product.objects.create(title='Чай', slug='tea', unit_price=10,
+                                         inventory=10, collection=collection)
+        self.fresh = Cart.objects.create()
+        CartItem.objects.create(cart=self.fresh, product=product, quantity=1)
+        for _ in range(5):
+            cart = Cart.objects.create()
+            CartItem.objects.create(cart=cart, product=product, quantity=1)
+        Cart.objects.exclude(pk=self.fresh.pk) \
+            .update(created_at=timezone.now() - timezone.timedelta(days=31))
+
+    def test_purges_in_batches(self):
+        stdout = StringIO()
+        call_command('purge_expired_carts', batch_size=2, stdout=stdout)
+        self.assertIn('Удалено корзин: 5, позиций: 5, пачек: 3', stdout.getvalue())
+        self.assertEqual(list(Cart.objects.values_list('pk', flat=True)), [self.fresh.pk])
+        self.assertEqual(CartItem.objects.count(), 1)
+
+    def test_max_batches_and_dry_run(self):
+        call_command('purge_expired_carts', batch_size=2, max_batches=1, stdout=StringIO())
+        stdout = StringIO()
+        call_command('purge_expired_carts', dry_run=True, stdout=stdout)
+        self.assertIn(': 3', stdout.getvalue())
+
+    def test_purged_cart_with_stale_etag_is_not_found(self):
+        expired = Cart.objects.exclude(pk=self.fresh.pk).first()
+        url = f'/carts/{expired.pk}/'
+        etag = self.client.get(url)['ETag']
+        version = get_version(cart_scope(expired.pk))
+
+        call_command('purge_expired_carts', stdout=StringIO())
+        self.assertGreater(get_version(cart_scope(expired.pk)), version)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 404)
+
+
+@override_settings(CART_STORAGE='cache')
+class CacheCartStorageTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        caches['carts'].clear()
+        collection = Collection.objects.create(title='Напитки')
+        self.tea = Product.objects.create(title='Чай', slug='tea', unit_price=10,
+                                          inventory=5, collection=collection)
+        self.coffee = Product.objects.create(title='Кофе', slug='coffee', unit_price=20,
+                                             inventory=5, collection=collection)
+        self.cart_id = self.client.post('/carts/').data['id']
+        self.items_url = f'/carts/{self.cart_id}/items/'
+
+    def test_mutations_do_not_touch_database(self):
+        self.assertEqual(self.client.post(self.items_url, {'product_id': self.tea.pk, 'quantity': 1})
+                         .status_code, 201)
+        response = self.client.post(self.items_url, {'product_id': self.tea.pk, 'quantity': 2})
+        self.assertEqual(response.data['quantity'], 3)
+        self.client.post(self.items_url, {'product_id': self.coffee.pk, 'quantity': 1})
+        self.client.patch(f'{self.items_url}{self.coffee.pk}/', {'quantity': 4})
+        self.assertEqual(self.client.delete(f'{self.items_url}{self.tea.pk}/').status_code, 204)
+
+        response = self.client.get(f'/carts/{self.cart_id}/')
+        self.assertEqual([(item['id'], item['quantity']) for item in response.data['items']],
+                         [(self.coffee.pk, 4)])
+        self.assertEqual(response.data['total_price'], Decimal('80.00'))
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_bulk_is_all_or_nothing(self):
+        response = self.client.post(f'{self.items_url}bulk/', {
+            'add': [{'product_id': self.tea.pk, 'quantity': 1}, {'product_id': 999, 'quantity': 1}]
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(self.items_url).data, [])
+
+    def test_empty_cart_has_database_shape(self):
+        cached = json.loads(self.client.get(f'/carts/{self.cart_id}/').content)
+        with override_settings(CART_STORAGE='database'):
+            stored = json.loads(self.client.get(f'/carts/{self.client.post("/carts/").data["id"]}/').content)
+        self.assertEqual({**cached, 'id': None}, {**stored, 'id': None})
+        self.assertIsInstance(cached['total_price'], float)
+
+    def test_non_atomic_backend_is_rejected(self):
+        for backend in ('django.core.cache.backends.filebased.FileBasedCache',
+                        'django.core.cache.backends.dummy.DummyCache'):
+            with self.subTest(backend=backend), override_settings(CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'carts': {'BACKEND': backend, 'LOCATION': tempfile.gettempdir()},
+            }):
+                with self.assertRaises(ImproperlyConfigured):
+                    cart_store.create()
+
+    def test_bulk_remove_reports_unknown_ids(self):
+        self.client.post(self.items_url, {'product_id': self.tea.pk, 'quantity': 1})
+        response = self.client.post(f'{self.items_url}bulk/', {'remove': [self.tea.pk, self.coffee.pk]},
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['remove'], [f'Товара с id {self.coffee.pk} нет в корзине'])
+        self.assertEqual([item['id'] for item in self.client.get(self.items_url).data], [self.tea.pk])
+
+    def test_expired_lock_is_not_released_by_previous_holder(self):
+        cache = cart_store.get_cache()
+        with cart_store.locked(self.cart_id):
+            # Замок истек, и его взял другой запрос
+            cache.set(cart_store.lock_key(self.cart_id), 'other', cart_store.LOCK_TIMEOUT)
+        self.assertEqual(cache.get(cart_store.lock_key(self.cart_id)), 'other')
+
+    def test_checkout_materializes_cart(self):
+        self.client.post(self.items_url, {'product_id': self.tea.pk, 'quantity': 2})
+        self.client.force_authenticate(User.objects.create(username='buyer'))
+
+        response = self.client.post('/orders/', {'cart_id': self.cart_id})
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual([(item['product']['id'], item['quantity']) for item in response.data['items']],
+                         [(self.tea.pk, 2)])
+        self.assertFalse(Cart.objects.exists())
+        self.assertEqual(self.client.get(f'/carts/{self.cart_id}/').status_code, 404)
+
+    def test_checkout_holds_cart_lock(self):
+        self.client.post(self.items_url, {'product_id': self.tea.pk, 'quantity': 2})
+        self.client.force_authenticate(User.objects.create(username='buyer'))
+
+        with mock.patch.object(cart_store, 'LOCK_WAIT', 0), cart_store.locked(self.cart_id):
+            response = self.client.post('/orders/', {'cart_id': self.cart_id})
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.client.get(f'/carts/{self.cart_id}/').status_code, 200)
+
+    def test_shortage_keeps_cart_in_cache(self):
+        self.client.post(self.items_url, {'product_id': self.tea.pk, 'quantity': 9})
+        self.client.force_authenticate(User.objects.create(username='buyer'))
+
+        response = self.client.post('/orders/', {'cart_id': self.cart_id})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['items'][0]['available'], 5)
+        self.assertFalse(Cart.objects.exists())
+        self.assertEqual(self.client.get(f'/carts/{self.cart_id}/').status_code, 200)
+
+
+@override_settings(CART_STORAGE='cache')
+class ConcurrentCacheCartTests(TransactionTestCase):
+    """Замок cart_store держится на атомарности add() кеша корзин."""
+
+    def setUp(self):
+        caches['carts'].clear()
+
+    def run_parallel(self, function, count):
+        barrier = Barrier(count)
+
+        def run(index):
+            barrier.wait()
+            try:
+                return function(index)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=count) as pool:
+            return list(pool.map(run, range(count)))
+
+    def test_only_one_add_wins(self):
+        cache = cart_store.get_cache()
+        results = self.run_parallel(lambda index: cache.add('lock', index, 5), 16)
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(cache.get('lock'), results.index(True))
+
+    def test_parallel_changes_do_not_lose_updates(self):
+        collection = Collection.objects.create(title='Напитки')
+        tea = Product.objects.create(title='Чай', slug='tea', unit_price=10,
+                                     inventory=100, collection=collection)
+        cart_id = cart_store.create()
+
+        errors = self.run_parallel(lambda _: cart_store.change(cart_id, add={tea.pk: 1}), 8)
+        self.assertEqual(errors, [{}] * 8)
+        self.assertEqual(cart_store.get_quantities(cart_id), {tea.pk: 8})
+
+    def test_parallel_checkouts_create_one_order(self):
+        collection = Collection.objects.create(title='Напитки')
+        tea = Product.objects.create(title='Чай', slug='tea', unit_price=10,
+                                     inventory=100, collection=collection)
+        user = User.objects.create(username='buyer')
+        cart_id = cart_store.create()
+        cart_store.change(cart_id, add={tea.pk: 2})
+
+        def checkout(_):
+            client = APIClient()
+            client.force_authenticate(user)
+            return client.post('/orders/', {'cart_id': cart_id}).status_code
+
+        self.assertEqual(sorted(self.run_parallel(checkout, 2)), [200, 400])
+        self.assertEqual(Order.objects.count(), 1)
+        tea.refresh_from_db()
+        self.assertEqual(tea.inventory, 98)
+
+
+class ProductTagsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        collection = Collection.objects.create(title='Напитки')
+        self.tea = Product.objects.create(title='Чай', slug='tea', unit_price=100,
+                                          inventory=10, collection=collection)
+        self.coffee = Product.objects.create(title='Кофе', slug='coffee', unit_price=50,
+                                             inventory=10, collection=collection)
+        self.hot = Tag.objects.create(label='горячее')
+        TaggedItem.objects.create(tag=self.hot, content_object=self.tea)
+        TaggedItem.objects.create(tag=self.hot, content_object=self.coffee)
+        TaggedItem.objects.create(tag=Tag.objects.create(label='бодрит'), content_object=self.coffee)
+
+    def tags(self, url):
+        response = self.client.get(url)
+        results = response.data['results'] if 'results' in response.data else [response.data]
+        return {product['id']: product['tags'] for product in results}
+
+    def test_list_and_detail_show_tags(self):
+        self.assertEqual(self.tags('/products/'), {self.tea.pk: ['горячее'],
+                                                   self.coffee.pk: ['бодрит', 'горячее']})
+        self.assertEqual(self.tags(f'/products/{self.tea.pk}/'), {self.tea.pk: ['горячее']})
+
+    def test_tag_changes_invalidate_catalog(self):
+        self.tags('/products/')
+        with self.captureOnCommitCallbacks(execute=True):
+            TaggedItem.objects.create(tag=Tag.objects.create(label='зеленый'), content_object=self.tea)
+        self.assertEqual(self.tags('/products/')[self.tea.pk], ['горячее', 'зеленый'])
+
+        self.hot.label = 'теплое'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.hot.save()
+        self.assertEqual(self.tags('/products/')[self.tea.pk], ['зеленый', 'теплое'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            TaggedItem.objects.filter(tag__label='зеленый').delete()
+        self.assertEqual(self.tags('/products/')[self.tea.pk], ['теплое'])
+
+    def test_tag_changes_change_etag(self):
+        url = f'/products/{self.tea.pk}/'
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            TaggedItem.objects.create(tag=Tag.objects.create(label='зеленый'), content_object=self.tea)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['tags'], ['горячее', 'зеленый'])
+
+    def test_tag_cloud(self):
+        response = self.client.get('/products/tags/')
+        self.assertEqual([(tag['label'], tag['count']) for tag in response.data],
+                         [('горячее', 2), ('бодрит', 1)])
+
+
+class ProductSearchTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.collection = Collection.objects.create(title='Напитки')
+
+    def create_product(self, title, description='', unit_price=10):
+        return Product.objects.create(title=title, slug=f'product-{Product.objects.count()}',
+                                      description=description, unit_price=unit_price, inventory=10,
+                                      collection=self.collection)
+
+    def indexed(self, pk):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT title, description FROM {SQLITE_TABLE} WHERE rowid = %s', [pk])
+            return cursor.fetchone()
+
+    def search(self, text, **params):
+        response = self.client.get('/products/', {'search': text, **params})
+        return [item['title'] for item in response.data['results']]
+
+    def test_index_follows_save_and_delete(self):
+        product = self.create_product('Зеленый чай', 'Листовой')
+        self.assertEqual(self.indexed(product.pk), ('Зеленый чай', 'Листовой'))
+
+        product.title = 'Черный чай'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertEqual(self.indexed(product.pk), ('Черный чай', 'Листовой'))
+        self.assertEqual(self.search('зеленый'), [])
+        self.assertEqual(self.search('черный'), ['Черный чай'])
+
+        pk = product.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        self.assertIsNone(self.indexed(pk))
+        self.assertEqual(self.search('черный'), [])
+
+    def test_prefix_matching(self):
+        self.create_product('Зеленый чай')
+        self.create_product('Зерновой кофе')
+        self.create_product('Черный чай')
+        self.assertEqual(self.search('зе'), ['Зеленый чай', 'Зерновой кофе'])
+        # Все слова обязательны, регистр не важен
+        self.assertEqual(self.search('ЗЕЛ ча'), ['Зеленый чай'])
+        self.assertEqual(self.search('зелень'), [])
+
+    def test_relevance_ordering(self):
+        self.create_product('Кофе', 'Чай в составе нет', unit_price=5)
+        self.create_product('Чай черный', 'Крупный лист', unit_price=20)
+        # Совпадение в названии весит больше, чем в описании
+        self.assertEqual(self.search('чай'), ['Чай черный', 'Кофе'])
+        # ?ordering= заменяет сортировку по релевантности
+        self.assertEqual(self.search('чай', ordering='unit_price'), ['Кофе', 'Чай черный'])
+
+    def test_without_search(self):
+        self.create_product('Чай')
+        self.create_product('Кофе')
+        self.assertEqual(self.search(''), ['Кофе', 'Чай'])
+        self.assertEqual(self.search(' , '), ['Кофе', 'Чай'])
+
+
+def encode_cursor(payload):
+    return urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+class KeysetPaginationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        collection = Collection.objects.create(title='Напитки')
+        # Цены повторяются - страницы режутся посреди одинаковых значений
+        self.products = [Product.objects.create(title=f'Чай {index}', slug=f'tea-{index}',
+                                                unit_price=10 * (index % 3 + 1), inventory=10,
+                                                collection=collection)
+                         for index in range(25)]
+
+    def walk(self, url, link='next'):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([product['id'] for product in response.data['results']])
+            url = response.data[link]
+        return pages
+
+    def test_ties_on_sort_field(self):
+        pages = self.walk('/products/?cursor=&ordering=unit_price')
+        expected = [product.pk for product in sorted(self.products, key=lambda p: (p.unit_price, p.pk))]
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_reverse_ordering_and_previous_links(self):
+        pages = self.walk('/products/?cursor=&ordering=-unit_price')
+        expected = [product.pk for product in sorted(self.products, key=lambda p: (-p.unit_price, -p.pk))]
+        self.assertEqual(sum(pages, []), expected)
+
+        last = self.client.get('/products/?cursor=&ordering=-unit_price')
+        while last.data['next']:
+            last = self.client.get(last.data['next'])
+        backwards = self.walk(last.data['previous'], link='previous')
+        self.assertEqual(backwards, pages[-2::-1])
+
+    def test_count_can_be_disabled(self):
+        self.assertEqual(self.client.get('/products/?cursor=').data['count'], 25)
+        response = self.client.get('/products/?cursor=&count=false')
+        self.assertNotIn('count', response.data)
+        self.assertEqual(len(response.data['results']), 10)
+
+    def test_invalid_or_tampered_cursor(self):
+        review = Review.objects.create(product=self.products[0], name='Аня', description='Вкусно')
+        cases = [
+            ('/products/', 'garbage'),
+            ('/products/', encode_cursor({'o': ['unit_price', 'pk'], 'p': ['abc', 1], 'r': 0})),
+            ('/products/', encode_cursor({'o': ['unit_price', 'pk'], 'p': [None, 1], 'r': 0})),
+            ('/products/', encode_cursor({'o': ['unit_price', 'pk'], 'p': [{}, 1], 'r': 0})),
+            ('/products/', encode_cursor({'o': ['title', 'pk'], 'p': ['a', 1], 'r': 0})),
+            ('/products/', encode_cursor(['unit_price', 'pk'])),
+            (f'/products/{review.product_id}/reviews/',
+             encode_cursor({'o': ['-date', '-id'], 'p': ['notadate', 1], 'r': 0})),
+        ]
+        for url, cursor in cases:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(url, {'ordering': 'unit_price', 'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.data['detail'], 'Неверный курсор')
+
+
+class ReviewStatsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        collection = Collection.objects.create(title='Напитки')
+        self.tea = Product.objects.create(title='Чай', slug='tea', unit_price=100,
+                                          inventory=10, collection=collection)
+        self.url = f'/products/{self.tea.pk}/reviews/'
+
+    def stats(self):
+        return self.client.get(f'/products/{self.tea.pk}/').data['review_stats']
+
+    def test_stats_follow_reviews(self):
+        self.assertEqual(self.stats(), {'reviews_count': 0, 'ratings_count': 0, 'average_rating': None,
+                                        'histogram': {'1': 0, '2': 0, '3': 0, '4': 0, '5': 0}})
+        for rating in (5, 4, 4, None):
+            data = {'name': 'Анна', 'description': 'Вкусно'}
+            if rating is not None:
+                data['rating'] = rating
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(self.client.post(self.url, data).status_code, 201)
+        self.assertEqual(self.client.post(self.url, {'name': 'Анна', 'description': '?', 'rating': 6})
+                         .status_code, 400)
+        self.assertEqual(self.stats(), {'reviews_count': 4, 'ratings_count': 3, 'average_rating': 4.33,
+                                        'histogram': {'1': 0, '2': 0, '3': 0, '4': 2, '5': 1}})
+
+        review = Review.objects.filter(rating=5).first()
+        review.rating = 1
+        with self.captureOnCommitCallbacks(execute=True):
+            review.save()
+            Review.objects.filter(rating=None).delete()
+        self.assertEqual(self.stats(), {'reviews_count': 3, 'ratings_count': 3, 'average_rating': 3.0,
+                                        'histogram': {'1': 1, '2': 0, '3': 0, '4': 2, '5': 0}})
+
+    def test_product_deletion_removes_stats(self):
+        Review.objects.create(product=self.tea, name='Анна', description='Вкусно', rating=5)
+        self.tea.delete()
+        self.assertFalse(ReviewStats.objects.exists())
+
+    def test_rebuild(self):
+        Review.objects.bulk_create([Review(product=self.tea, name='Анна', description='Вкусно', rating=rating)
+                                    for rating in (2, 3, None)])
+        ReviewStats.objects.rebuild()
+        self.assertEqual(self.stats()['histogram'], {'1': 0, '2': 1, '3': 1, '4': 0, '5': 0})
+        self.assertEqual(self.stats()['reviews_count'], 3)
+
+    def test_review_invalidates_only_its_product(self):
+        other_collection = Collection.objects.create(title='Сладости')
+        cake = Product.objects.create(title='Торт', slug='cake', unit_price=300,
+                                      inventory=1, collection=other_collection)
+        urls = {
+            'tea': f'/products/{self.tea.pk}/',
+            'cake': f'/products/{cake.pk}/',
+            'list': '/products/',
+            'tea_collection': f'/products/?collection_id={self.tea.collection_id}',
+            'cake_collection': f'/products/?collection_id={other_collection.pk}',
+            'collections': '/collections/',
+        }
+        etags = {name: self.client.get(url)['ETag'] for name, url in urls.items()}
+        catalog_version = get_version(CATALOG_SCOPE)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, {'name': 'Анна', 'description': 'Вкусно', 'rating': 5})
+        changed = {name for name, url in urls.items() if self.client.get(url)['ETag'] != etags[name]}
+        self.assertEqual(changed, {'tea', 'list', 'tea_collection'})
+        self.assertEqual(get_version(CATALOG_SCOPE), catalog_version)
+        self.assertEqual(self.stats()['reviews_count'], 1)
+
+    def test_stats_do_not_go_negative(self):
+        review = Review.objects.create(product=self.tea, name='Анна', description='Вкусно', rating=5)
+        ReviewStats.objects.filter(product=self.tea).update(reviews_count=0, ratings_count=0,
+                                                            ratings_sum=0, rating_5=0)
+        review.delete()
+        stats = ReviewStats.objects.get(product=self.tea)
+        self.assertEqual((stats.reviews_count, stats.ratings_count, stats.ratings_sum, stats.rating_5),
+                         (0, 0, 0, 0))
+
+    def test_listing_has_no_extra_queries(self):
+        self.client.get('/products/')
+        with CaptureQueriesContext(connection) as before:
+            cache.clear()
+            self.client.get('/products/')
+        for index in range(5):
+            product = Product.objects.create(title=f'Кофе {index}', slug='coffee', unit_price=10,
+                                             inventory=1, collection=self.tea.collection)
+            Review.objects.create(product=product, name='Анна', description='Вкусно', rating=3)
+        with CaptureQueriesContext(connection) as after:
+            cache.clear()
+            response = self.client.get('/products/')
+        self.assertEqual(len(after), len(before))
+        self.assertEqual(response.data['results'][0]['review_stats']['average_rating'], 3.0)
+
+
+class ReviewPaginationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        collection = Collection.objects.create(title='Напитки')
+        self.tea = Product.objects.create(title='Чай', slug='tea', unit_price=100,
+                                          inventory=10, collection=collection)
+        self.url = f'/products/{self.tea.pk}/reviews/'
+        today = timezone.now().date()
+        for index in range(25):
+            review = Review.objects.create(product=self.tea, name=f'Гость {index}', description='...',
+                                           rating=None if index % 5 == 0 else index % 5)
+            Review.objects.filter(pk=review.pk).update(date=today - timedelta(days=index // 3))
+
+    def walk(self, params=None):
+        ids, url, pages = [], self.url, 0
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 10)
+            ids += [review['id'] for review in response.data['results']]
+            pages += 1
+            if not response.data['next']:
+                return ids, pages, response.data['count']
+            response = self.client.get(response.data['next'])
+
+    def test_newest_first_by_default(self):
+        ids, pages, count = self.walk()
+        expected = list(Review.objects.order_by('-date', '-id').values_list('id', flat=True))
+        self.assertEqual((ids, pages, count), (expected, 3, 25))
+
+    def test_highest_rated_skips_unrated(self):
+        ids, _, count = self.walk({'sort': 'highest_rated'})
+        expected = list(Review.objects.exclude(rating=None).order_by('-rating', '-id')
+                        .values_list('id', flat=True))
+        self.assertEqual((ids, count), (expected, 20))
+
+    def test_invalid_sort_and_foreign_cursor(self):
+        self.assertEqual(self.client.get(self.url, {'sort': 'oldest'}).status_code, 400)
+        next_link = self.client.get(self.url).data['next']
+        self.assertEqual(self.client.get(next_link + '&sort=highest_rated').status_code, 404)
+
+    def test_sorts_use_indexes(self):
+        for sort, index in ((Review.SORT_NEWEST, 'store_review_product_date_idx'),
+                            (Review.SORT_HIGHEST_RATED, 'store_review_rating_idx')):
+            plan = Review.objects.sorted_for(self.tea.pk, sort)[:11].explain()
+            self.assertIn(index, plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+
+class ProductLikesTests(APITestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title='Напитки')
+        self.products = [Product.objects.create(title=f'Чай {index}', slug=f'tea-{index}', unit_price=10,
+                                                inventory=10, collection=collection)
+                         for index in range(3)]
+        self.user = User.objects.create(username='buyer', email='buyer@example.com')
+        self.other = User.objects.create(username='other', email='other@example.com')
+
+    def test_like_and_unlike(self):
+        url = f'/products/{self.products[0].pk}/like/'
+        self.assertEqual(self.client.post(url).status_code, 401)
+
+        self.client.force_authenticate(self.other)
+        self.client.post(url)
+        self.client.force_authenticate(self.user)
+        self.client.post(url)
+        response = self.client.post(url)
+        self.assertEqual(response.data, {'id': self.products[0].pk, 'likes': 2, 'liked': True})
+
+        response = self.client.delete(url)
+        self.assertEqual(response.data, {'id': self.products[0].pk, 'likes': 1, 'liked': False})
+        self.assertEqual(self.client.post('/products/0/like/').status_code, 404)
+
+    def test_liked_by_me_for_page(self):
+        LikedItem.objects.like(self.user, self.products[0])
+        LikedItem.objects.like(self.other, self.products[0])
+        LikedItem.objects.like(self.other, self.products[2])
+        ids = ','.join(str(product.pk) for product in self.products)
+
+        self.client.force_authenticate(self.user)
+        with self.assertNumQueries(2):
+            response = self.client.get('/products/likes/', {'ids': ids})
+        self.assertEqual(response.data, [
+            {'id': self.products[0].pk, 'likes': 2, 'liked': True},
+            {'id': self.products[1].pk, 'likes': 0, 'liked': False},
+            {'id': self.products[2].pk, 'likes': 1, 'liked': False},
+        ])
+
+        self.client.force_authenticate(None)
+        response = self.client.get('/products/likes/', {'ids': ids})
+        self.assertEqual([item['liked'] for item in response.data], [False, False, False])
+        self.assertEqual(self.client.get('/products/likes/', {'ids': 'a,b'}).status_code, 400)
+
+
+class AsyncCatalogTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.collection = Collection.objects.create(title='Напитки')
+        self.products = [Product.objects.create(title=f'Чай {index:02}', slug=f'tea-{index}',
+                                                unit_price=100 + index, inventory=10,
+                                                collection=self.collection)
+                         for index in range(12)]
+        self.products[0].promotion.add(Promotion.objects.create(description='Осень', discount=10))
+        Review.objects.create(product=self.products[0], name='Анна', description='Вкусно', rating=4)
+        TaggedItem.objects.create(tag=Tag.objects.create(label='зеленый'), content_object=self.products[0])
+
+    def async_get(self, url):
+        async def get():
+            return await self.async_client.get(url)
+        return async_to_sync(get)()
+
+    def assertSameAsSync(self, sync_url, async_url):
+        expected = self.client.get(sync_url)
+        response = self.async_get(async_url)
+        self.assertEqual(response.status_code, expected.status_code)
+        # Ссылки пагинации ведут на свой же префикс
+        content = expected.content.decode().replace('http://testserver/', 'http://testserver/async/')
+        self.assertEqual(response.json(), json.loads(content))
+
+    def test_responses_match_drf(self):
+        self.assertSameAsSync('/products/', '/async/products/')
+        self.assertSameAsSync('/products/?page=2', '/async/products/?page=2')
+        self.assertSameAsSync(f'/products/?collection_id={self.collection.pk}',
+                              f'/async/products/?collection_id={self.collection.pk}')
+        self.assertSameAsSync(f'/products/{self.products[0].pk}/', f'/async/products/{self.products[0].pk}/')
+        self.assertSameAsSync('/products/0/', '/async/products/0/')
+        self.assertSameAsSync('/collections/', '/async/collections/')
+        self.assertSameAsSync(f'/products/{self.products[0].pk}/reviews/',
+                              f'/async/products/{self.products[0].pk}/reviews/')
+
+    def test_filters_search_and_ordering_match_drf(self):
+        for query in ('unit_price__gt=105&unit_price__lt=110', 'search=Чай 03', 'ordering=-unit_price',
+                      f'collection_id=0{self.collection.pk}', 'ordering=-unit_price&page=2',
+                      'unit_price__gt=abc'):
+            with self.subTest(query=query):
+                self.assertSameAsSync(f'/products/?{query}', f'/async/products/?{query}')
+
+    def test_cursor_is_rejected(self):
+        self.assertEqual(self.async_get('/async/products/?cursor=abc').status_code, 400)
+
+    def test_zero_padded_collection_id_is_refreshed(self):
+        url = f'/async/products/?collection_id=0{self.collection.pk}&ordering=unit_price'
+        self.assertEqual(self.async_get(url).json()['results'][0]['price'], 100)
+        self.products[0].unit_price = 1
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].save()
+        self.assertEqual(self.async_get(url).json()['results'][0]['price'], 1)
+
+    def test_invalid_collection_id_is_bad_request(self):
+        for collection_id in ('abc', '0'):
+            with self.subTest(collection_id=collection_id):
+                self.assertSameAsSync(f'/products/?collection_id={collection_id}',
+                                      f'/async/products/?collection_id={collection_id}')
+                self.assertEqual(self.async_get(f'/async/products/?collection_id={collection_id}')
+                                 .status_code, 400)
+
+    def test_cache_is_invalidated_with_catalog(self):
+        url = f'/async/products/{self.products[0].pk}/'
+        self.async_get(url)
+        self.products[0].unit_price = 500
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].save()
+        self.assertEqual(self.async_get(url).json()['price'], 500)
+
+    def test_concurrent_requests_are_coalesced(self):
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 42
+
+        async def run():
+            return await asyncio.gather(*[async_views.coalesce('key', fetch) for _ in range(10)])
+
+        self.assertEqual(async_to_sync(run)(), [42] * 10)
+        self.assertEqual(len(calls), 1)
+        self.assertFalse(async_views._inflight)
+
+
+class BenchmarkCommandsTests(TransactionTestCase):
+    def test_cart_totals_benchmark(self):
+        stdout = StringIO()
+        call_command('benchmark_cart_totals', sizes=[1, 5], repeat=1, stdout=stdout)
+        rows = stdout.getvalue().splitlines()[1:]
+        self.assertEqual([row.split()[0] for row in rows], ['1', '5'])
+        self.assertTrue(all(row.endswith('да') for row in rows), rows)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_generate_data_and_run_benchmarks(self):
+        call_command('generate_data', collections=3, products=40, customers=5, orders=10,
+                     reviews=20, stdout=StringIO())
+        self.assertEqual(Product.objects.count(), 40)
+        self.assertEqual(sum(Collection.objects.values_list('products_count', flat=True)), 40)
+
+        stdout = StringIO()
+        call_command('run_benchmarks', iterations=3, warmup=0, stdout=stdout)
+        report = json.loads(stdout.getvalue())
+        self.assertEqual(set(report['scenarios']), {'product_list', 'product_search', 'product_filter',
+                                                    'product_detail', 'cart_add', 'checkout', 'order_list'})
+        for name, result in report['scenarios'].items():
+            self.assertEqual(result['errors'], 0, name)
+            self.assertEqual(result['requests'], 3)
+        # Прогон откатывается
+        self.assertEqual(Order.objects.count(), 10)
+
+        stdout = StringIO()
+        call_command('benchmark_async', requests=10, concurrency=4, stdout=stdout)
+        report = json.loads(stdout.getvalue())
+        for name, modes in report['scenarios'].items():
+            self.assertEqual(set(modes), {'wsgi', 'asgi_async'})
+            for mode, result in modes.items():
+                self.assertEqual(result['errors'], 0, f'{name} {mode}')
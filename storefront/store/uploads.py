@@ -0,0 +1,70 @@
+"""
+Потоковая загрузка картинок товаров.
+
+Стандартные обработчики Django держат файлы до 2.5MB в памяти, а лимит
+размера проверяется только когда файл уже получен целиком. Этот обработчик
+пишет чанки сразу во временный файл, отбрасывает файл (SkipFile) на первом
+чанке сверх лимита и по первым байтам проверяет, что это картинка. Остаток
+такого файла парсер дочитывает, но никуда не пишет; ошибки обработчик
+собирает в errors, а 400 отдает представление. FileSystemStorage потом
+переносит временный файл в MEDIA_ROOT (rename, если это одна ФС), а не
+копирует его.
+"""
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+
+from .validators import MAX_IMAGE_SIZE_KB
+
+SIGNATURES = (
+    (0, b'\xff\xd8\xff'),  # JPEG
+    (0, b'\x89PNG\r\n\x1a\n'),  # PNG
+    (0, b'GIF87a'),
+    (0, b'GIF89a'),
+    (8, b'WEBP'),  # RIFF....WEBP
+)
+HEADER_SIZE = 12
+
+
+def is_image_header(header):
+    return any(header[offset:offset + len(signature)] == signature
+               for offset, signature in SIGNATURES)
+
+
+class ProductImageUploadHandler(TemporaryFileUploadHandler):
+    max_size = MAX_IMAGE_SIZE_KB * 1024
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.errors = {}
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        self.header = b''
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            self.reject(f'Размер файла не может быть больше {MAX_IMAGE_SIZE_KB}KB!')
+
+        if len(self.header) < HEADER_SIZE:
+            self.header += raw_data[:HEADER_SIZE - len(self.header)]
+            if len(self.header) >= HEADER_SIZE and not is_image_header(self.header):
+                self.reject('Загрузите изображение в формате JPEG, PNG, GIF или WebP')
+
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        if not is_image_header(self.header):
+            # file_complete вызывается вне обработки SkipFile - файл отбрасываем сами
+            self.add_error('Загрузите изображение в формате JPEG, PNG, GIF или WebP')
+            self.file.close()
+            return None
+        return super().file_complete(file_size)
+
+    def add_error(self, message):
+        self.errors[self.field_name] = [message]
+
+    def reject(self, message):
+        # Парсер закроет (и тем удалит) временный файл и пропустит остаток этого поля
+        self.add_error(message)
+        raise SkipFile()
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 from rest_framework.routers import DefaultRouter
 from rest_framework_nested import routers
 
@@ -35,3 +35,12 @@ carts_router.register('items', views.CartItemViewSet, basename='cart-items')
 
 urlpatterns = router.urls + products_router.urls + carts_router.urls
 
+# Async-версии каталога только для чтения (имеют смысл под ASGI)
+urlpatterns += [
+    path('async/products/', async_views.product_list, name='async-product-list'),
+    path('async/products/<int:pk>/', async_views.product_detail, name='async-product-detail'),
+    path('async/products/<int:product_pk>/reviews/', async_views.review_list,
+         name='async-product-reviews'),
+    path('async/collections/', async_views.collection_list, name='async-collection-list'),
+]
+
@@ -1,7 +1,9 @@
 from django.core.exceptions import ValidationError
 
+MAX_IMAGE_SIZE_KB = 500
+
 def validate_file_size(file):
-    max_size_kb = 500
+    max_size_kb = MAX_IMAGE_SIZE_KB
 
     if file.size > max_size_kb * 1024:
-        raise ValidationError(f'Размер файла не может быть больше {max_size_kb}KB!')
\ No newline at end of file
+        raise ValidationError(f'Размер файла не может быть больше {max_size_kb}KB!')
@@ -1,35 +1,57 @@
-from django.db.models import Count
+from django.db.models import Prefetch
 from .models import Product, Collection, CartItem, OrderItem, Cart, Order, Customer, Review
 from rest_framework.response import Response
 from .serializers import ProductSerializer, CollectionSerializer, ReviewSerializer
 from rest_framework import status
 from rest_framework.viewsets import ModelViewSet
-from rest_framework.filters import SearchFilter, OrderingFilter
-from .filters import ProductFilter
+from rest_framework.filters import OrderingFilter
+from .filters import ProductFilter, collection_pk
 from django_filters.rest_framework import DjangoFilterBackend
-from .pagination import DefaultPagination
+from .pagination import DefaultPagination, KeysetPagination, ReviewPagination
 from .permissions import IsAdminOrReadOnly
+from .search import ProductSearchFilter
+from .uploads import ProductImageUploadHandler
+from .cache import (CATALOG_SCOPE, REVIEW_STATS_SCOPE, catalog_key, cart_scope, get_version,
+                    product_scope, reviews_scope)
+from .mixins import CacheCartItemMixin, CacheCartMixin, CachedCatalogMixin, ConditionalGetMixin
+from . import cart_store
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from tags.models import TaggedItem
+from likes.views import LikesMixin
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(ConditionalGetMixin, CachedCatalogMixin, LikesMixin, ModelViewSet):
     serializer_class = ProductSerializer
-    queryset = Product.objects.prefetch_related('images').all()
+    queryset = Product.objects.select_related('review_stats').prefetch_related('images').all()
     permission_classes = [IsAdminOrReadOnly]
     pagination_class = DefaultPagination
     filterset_class = ProductFilter
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, OrderingFilter]
     search_fields = ['title', 'description']
     ordering_fields = ['unit_price', 'last_update']
 
-    def get_queryset(self):
-        queryset = Product.objects.all()
-        collection_id = self.request.query_params.get('collection_id')
-        if collection_id is not None:
-            queryset = queryset.filter(collection_id=collection_id)
-        return queryset
-
     def get_serializer_context(self):
         return {'request': self.request}
 
+    def get_cache_key(self, request):
+        if 'pk' in self.kwargs:
+            return catalog_key(request, 'detail', scopes=[product_scope(self.kwargs['pk'])],
+                               pk=self.kwargs['pk'])
+        collection_id = collection_pk(request.query_params.get('collection_id'))
+        if collection_id is not None:
+            return catalog_key(request, 'list', collection_id)
+        return catalog_key(request, 'list', scopes=[REVIEW_STATS_SCOPE])
+
+    def get_validators(self, request):
+        # Ключ кеша уже содержит параметры запроса и версии каталога (категории, товара),
+        # которые сбрасывает любое изменение товаров, цен, меток и отзывов
+        return [self.get_cache_key(request)], None
+
+    @action(detail=False)
+    def tags(self, request):
+        """Облако меток товаров: [{'id', 'label', 'count'}], самые частые - первыми."""
+        return Response(TaggedItem.objects.get_tag_cloud(Product))
+
     def destroy(self, request, *args, **kwargs):
         if OrderItem.objects.filter(product_id=self.kwargs['pk']).count() > 0:
             return Response({'error': 'Товар не может быть удален.'
@@ -38,14 +60,16 @@ class ProductViewSet(ModelViewSet):
         return super().destroy(self, request, *args, **kwargs)
 
 
-class CollectionViewSet(ModelViewSet):
+class CollectionViewSet(ConditionalGetMixin, ModelViewSet):
     serializer_class = CollectionSerializer
-    queryset = Collection.objects.annotate(products_count=Count('products')).all()
+    queryset = Collection.objects.all()
     permission_classes = [IsAdminOrReadOnly]
 
     def get_serializer_context(self):
         return {'request': self.request}
 
+    def get_validators(self, request):
+        return [get_version(CATALOG_SCOPE)], None
 
     def destroy(self, request, *args, **kwargs):
         if Product.objects.filter(collection_id=self.kwargs['pk']).count() > 0:
@@ -56,27 +80,58 @@ class CollectionViewSet(ModelViewSet):
 
 
 
-class ReviewViewSet(ModelViewSet):
+class ReviewViewSet(ConditionalGetMixin, ModelViewSet):
     serializer_class = ReviewSerializer
+    pagination_class = ReviewPagination
 
     def get_queryset(self):
-        return Review.objects.filter(product_id=self.kwargs['product_pk'])
+        if self.action != 'list':
+            return Review.objects.filter(product_id=self.kwargs['product_pk'])
+        sort = self.request.query_params.get('sort', Review.SORT_NEWEST)
+        if sort not in Review.SORTS:
+            raise ValidationError({'sort': [f'Допустимые значения: {", ".join(Review.SORTS)}']})
+        return Review.objects.sorted_for(self.kwargs['product_pk'], sort)
 
     def get_serializer_context(self):
         return {'product_id': self.kwargs['product_pk']}
 
+    def get_validators(self, request):
+        return [get_version(reviews_scope(self.kwargs['product_pk']))], None
+
 
 from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin, DestroyModelMixin
+from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
 from rest_framework.viewsets import GenericViewSet
-from .serializers import CartSerializer, CartItemSerializer, AddCartItemSerializer, UpdateCartItemSerializer
-
-class CartViewSet(CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet):
-    queryset = Cart.objects.prefetch_related('items__product').all()
+from .serializers import CartSerializer, CartItemSerializer, AddCartItemSerializer, UpdateCartItemSerializer, \
+    BulkCartItemsSerializer
+
+CART_ITEM_FIELDS = ['cart_id', 'quantity', 'product__id', 'product__title', 'product__unit_price']
+
+class CartViewSet(ConditionalGetMixin, CacheCartMixin, CreateModelMixin, RetrieveModelMixin, DestroyModelMixin,
+                  GenericViewSet):
+    # От товара берутся только поля, нужные корзине; цены - из store.pricing
+    # (сравнение с суммой в БД - manage.py benchmark_cart_totals)
+    queryset = Cart.objects.prefetch_related(
+        Prefetch('items', queryset=CartItem.objects.select_related('product').only(*CART_ITEM_FIELDS))
+    )
     serializer_class = CartSerializer
 
+    def get_validators(self, request):
+        return [get_version(cart_scope(self.kwargs['pk']))], None
 
+    def object_exists(self, request):
+        if cart_store.is_enabled():
+            try:
+                cart_store.load(self.kwargs['pk'])
+            except NotFound:
+                return False
+            return True
+        return super().object_exists(request)
 
-class CartItemViewSet(ModelViewSet):
+
+
+class CartItemViewSet(CacheCartItemMixin, ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete']
 
     def get_serializer_class(self):
@@ -90,7 +145,24 @@ class CartItemViewSet(ModelViewSet):
         return {'cart_id': self.kwargs['cart_pk']}
 
     def get_queryset(self):
-        return CartItem.objects.filter(cart_id=self.kwargs['cart_pk']).select_related('product')
+        return CartItem.objects.filter(cart_id=self.kwargs['cart_pk']) \
+            .select_related('product').only(*CART_ITEM_FIELDS)
+
+    @action(detail=False, methods=['POST'])
+    def bulk(self, request, cart_pk=None):
+        if cart_store.is_enabled():
+            serializer = BulkCartItemsSerializer(data=request.data, context={'cart_id': cart_pk})
+            serializer.is_valid(raise_exception=True)
+            serializer.save_to_store()
+            return Response(cart_store.representation(cart_pk))
+
+        cart = get_object_or_404(Cart, pk=cart_pk)
+        serializer = BulkCartItemsSerializer(data=request.data, context={'cart_id': cart.pk})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        cart = CartViewSet.queryset.get(pk=cart.pk)
+        return Response(CartSerializer(cart).data)
 
 # fb9da9a8-8879-4697-b976-1acd6edaf355
 
@@ -123,22 +195,50 @@ class CustomerViewSet(ModelViewSet):
             return Response(serializer.data)
 
 
+from django.http import StreamingHttpResponse
+from .exports import EXPORT_FORMATS, order_export_rows, parse_bound, stream_rows
 from .serializers import OrderSerializer, OrderItemSerializer, \
-    CreateOrderSerializer, UpdateOrderSerializer
+    CreateOrderSerializer, UpdateOrderSerializer, OutOfStock
 
 class OrderViewSet(ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete', 'head', 'options']
+    pagination_class = KeysetPagination
+    filter_backends = [OrderingFilter]
+    ordering_fields = ['placed_at']
+    keyset_ordering = ['-placed_at']
 
     def get_permissions(self):
-        if self.request.method in ['PATCH', 'DELETE']:
+        if self.request.method in ['PATCH', 'DELETE'] or self.action == 'export':
             return [IsAdminUser()]
         return [IsAuthenticated()]
 
+    @action(detail=False, methods=['GET'])
+    def export(self, request):
+        # ?format зарезервирован DRF под выбор рендерера, поэтому file_format
+        fmt = request.query_params.get('file_format', 'csv')
+        if fmt not in EXPORT_FORMATS:
+            raise ValidationError({'file_format': [f'Допустимые значения: {", ".join(EXPORT_FORMATS)}']})
+
+        placed_after = request.query_params.get('placed_after')
+        placed_before = request.query_params.get('placed_before')
+        rows = order_export_rows(
+            parse_bound('placed_after', placed_after) if placed_after else None,
+            parse_bound('placed_before', placed_before, end_of_day=True) if placed_before else None,
+        )
+        response = StreamingHttpResponse(stream_rows(rows, fmt), content_type=EXPORT_FORMATS[fmt])
+        response['Content-Disposition'] = f'attachment; filename="orders.{fmt}"'
+        return response
+
     def create(self, request, *args, **kwargs):
         serializer = CreateOrderSerializer(data=request.data,
                                            context={'user_id': self.request.user.id})
         serializer.is_valid(raise_exception=True)
-        order = serializer.save()
+        try:
+            order = serializer.save()
+        except OutOfStock as error:
+            return Response({'error': 'Недостаточно товара на складе',
+                             'items': error.items},
+                            status=status.HTTP_409_CONFLICT)
         serializer = OrderSerializer(order)
         return Response(serializer.data)
 
@@ -151,12 +251,13 @@ class OrderViewSet(ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
+        queryset = Order.objects.prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.select_related('product'))
+        )
 
         if user.is_staff:
-            return Order.objects.all()
-
-        customer_id = Customer.objects.only('id').get(user_id=user.id)
-        return Order.objects.filter(customer_id=customer_id)
+            return queryset
+        return queryset.filter(customer__user_id=user.id)
 
 
 
@@ -167,8 +268,27 @@ from .models import ProductImage
 class ProductImageViewSet(ModelViewSet):
     serializer_class = ProductImageSerializer
 
+    def initialize_request(self, request, *args, **kwargs):
+        # Обработчик нужно поставить до того, как тело запроса начнут читать
+        self.upload_handler = ProductImageUploadHandler(request)
+        request.upload_handlers = [self.upload_handler]
+        return super().initialize_request(request, *args, **kwargs)
+
+    def check_upload(self, request):
+        request.data  # тело разбирается здесь, ошибки файлов обработчик собирает по ходу
+        if self.upload_handler.errors:
+            raise ValidationError(self.upload_handler.errors)
+
+    def create(self, request, *args, **kwargs):
+        self.check_upload(request)
+        return super().create(request, *args, **kwargs)
+
+    def update(self, request, *args, **kwargs):
+        self.check_upload(request)
+        return super().update(request, *args, **kwargs)
+
     def get_serializer_context(self):
-        return {'product_id': self.kwargs['product_pk']}
+        return {'product_id': self.kwargs['product_pk'], 'request': self.request}
 
     def get_queryset(self):
         return ProductImage.objects.filter(product_id=self.kwargs['product_pk'])
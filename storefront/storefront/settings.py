@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/4.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
+import os
 from datetime import timedelta
 from pathlib import Path
 
@@ -48,6 +49,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.profiling.ProfilingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -91,10 +93,55 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Файловая тестовая БД: в in-memory режиме SQLite параллельные записи
+        # из потоков (тесты конкурентности) падают с "database table is locked"
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# LocMemCache живет внутри одного процесса. При нескольких воркерах нужен общий
+# кеш (Redis/Memcached), иначе версии каталога не будут сбрасываться у соседей.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Корзины при CART_STORAGE = 'cache'. В проде - общий Redis:
+    # 'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://...'
+    'carts': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'carts',
+    },
+}
+
+CATALOG_CACHE_TIMEOUT = 60 * 15
+
+# Корзины старше этого срока удаляет manage.py purge_expired_carts
+CART_TTL = timedelta(days=30)
+
+# 'database' - корзины в таблицах Cart/CartItem, 'cache' - в кеше CART_CACHE_ALIAS
+# до оформления заказа (store.cart_store)
+CART_STORAGE = 'database'
+CART_CACHE_ALIAS = 'carts'
+
+# Профилирование запросов (core.profiling): Server-Timing, гистограммы
+# по маршрутам (/profiling/, manage.py dump_profiling), медленные SQL.
+# Включается переменной окружения PROFILING_ENABLED=1
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '').lower() in ('1', 'true', 'yes')
+# Server-Timing всем клиентам, а не только staff
+PROFILING_SERVER_TIMING = False
+# Файлы метрик процессов - общие для всех воркеров на машине
+PROFILING_DIR = BASE_DIR / '.profiling'
+PROFILING_FLUSH_INTERVAL = 10
+PROFILING_SLOW_QUERY_MS = 100
+PROFILING_SLOW_QUERY_SAMPLES = 50
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class TagsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tags'
+
+    def ready(self):
+        import tags.signals
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.6 on 2026-10-18 02:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tags', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='taggeditem',
+            index=models.Index(fields=['content_type', 'object_id'], name='tags_item_object_idx'),
+        ),
+    ]
@@ -1,9 +1,19 @@
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
 from django.db import models
+from django.db.models import Count
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 
 # Create your models here.
 
+TAG_CLOUD_TIMEOUT = 60 * 60
+
+
+def tag_cloud_key(content_type_id):
+    return f'tags:cloud:{content_type_id}'
+
+
 class TaggedItemManager(models.Manager):
     def get_tags_for(self, obj_type, obj_id):
         content_type = ContentType.objects.get_for_model(obj_type)
@@ -13,6 +23,53 @@ class TaggedItemManager(models.Manager):
             object_id=obj_id
         )
 
+    def tags_for_many(self, content_type, obj_ids):
+        return self.filter(content_type=content_type, object_id__in=set(obj_ids)) \
+            .order_by('tag__label', 'tag_id').values_list('object_id', 'tag__label')
+
+    def get_tags_for_many(self, obj_type, obj_ids):
+        """
+        Метки многих объектов одного типа одним запросом: {object_id: [метка, ...]}.
+        ContentType берется из кеша ContentTypeManager.
+        """
+        obj_ids = list(obj_ids)
+        tags = {obj_id: [] for obj_id in obj_ids}
+        if obj_ids:
+            content_type = ContentType.objects.get_for_model(obj_type)
+            for object_id, label in self.tags_for_many(content_type, obj_ids):
+                tags[object_id].append(label)
+        return tags
+
+    async def aget_tags_for_many(self, obj_type, obj_ids):
+        obj_ids = list(obj_ids)
+        tags = {obj_id: [] for obj_id in obj_ids}
+        if obj_ids:
+            content_type = await sync_to_async(ContentType.objects.get_for_model)(obj_type)
+            async for object_id, label in self.tags_for_many(content_type, obj_ids):
+                tags[object_id].append(label)
+        return tags
+
+    def get_tag_cloud(self, obj_type):
+        """
+        Метки типа с числом объектов, самые частые - первыми. Хранится в кеше,
+        сбрасывается сигналами при изменении TaggedItem и Tag (tags.signals).
+        """
+        content_type = ContentType.objects.get_for_model(obj_type)
+        key = tag_cloud_key(content_type.pk)
+        cloud = cache.get(key)
+        if cloud is None:
+            cloud = list(
+                Tag.objects.filter(taggeditem__content_type=content_type)
+                .annotate(count=Count('taggeditem'))
+                .order_by('-count', 'label')
+                .values('id', 'label', 'count')
+            )
+            cache.set(key, cloud, TAG_CLOUD_TIMEOUT)
+        return cloud
+
+    def invalidate_tag_cloud(self, *content_type_ids):
+        cache.delete_many([tag_cloud_key(pk) for pk in set(content_type_ids)])
+
 
 class Tag(models.Model):
     label = models.CharField(max_length=255)
@@ -26,4 +83,9 @@ class TaggedItem(models.Model):
     tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
-    content_object = GenericForeignKey()
\ No newline at end of file
+    content_object = GenericForeignKey()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['content_type', 'object_id'], name='tags_item_object_idx'),
+        ]
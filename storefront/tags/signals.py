@@ -0,0 +1,20 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Tag, TaggedItem
+
+
+@receiver(post_save, sender=TaggedItem)
+@receiver(post_delete, sender=TaggedItem)
+def invalidate_tag_cloud_for_item(sender, instance, **kwargs):
+    TaggedItem.objects.invalidate_tag_cloud(instance.content_type_id)
+
+
+@receiver(post_save, sender=Tag)
+def invalidate_tag_cloud_for_tag(sender, instance, created, **kwargs):
+    # Новая метка еще ни к чему не привязана; удаление сбросит облака
+    # через каскадное удаление TaggedItem
+    if not created:
+        TaggedItem.objects.invalidate_tag_cloud(
+            *TaggedItem.objects.filter(tag=instance).values_list('content_type_id', flat=True).distinct()
+        )
@@ -1,3 +1,41 @@
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from core.models import User
+from .models import Tag, TaggedItem
+
+
+class TaggedItemManagerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create(username=f'user{index}', email=f'user{index}@example.com')
+                      for index in range(3)]
+        self.red, self.blue = Tag.objects.create(label='red'), Tag.objects.create(label='blue')
+        TaggedItem.objects.create(tag=self.red, content_object=self.users[0])
+        TaggedItem.objects.create(tag=self.blue, content_object=self.users[0])
+        TaggedItem.objects.create(tag=self.red, content_object=self.users[1])
+
+    def test_get_tags_for_many_is_one_query(self):
+        TaggedItem.objects.get_tags_for_many(User, [])
+        with self.assertNumQueries(1):
+            tags = TaggedItem.objects.get_tags_for_many(User, [user.pk for user in self.users])
+        self.assertEqual(tags, {self.users[0].pk: ['blue', 'red'], self.users[1].pk: ['red'],
+                                self.users[2].pk: []})
+
+    def test_tag_cloud_is_cached_and_invalidated(self):
+        self.assertEqual(TaggedItem.objects.get_tag_cloud(User),
+                         [{'id': self.red.pk, 'label': 'red', 'count': 2},
+                          {'id': self.blue.pk, 'label': 'blue', 'count': 1}])
+        with self.assertNumQueries(0):
+            TaggedItem.objects.get_tag_cloud(User)
+
+        TaggedItem.objects.create(tag=self.blue, content_object=self.users[2])
+        TaggedItem.objects.create(tag=self.blue, content_object=self.users[1])
+        self.assertEqual(TaggedItem.objects.get_tag_cloud(User)[0]['label'], 'blue')
+
+        self.blue.label = 'navy'
+        self.blue.save()
+        self.assertEqual(TaggedItem.objects.get_tag_cloud(User)[0]['label'], 'navy')
+
+        self.blue.delete()
+        self.assertEqual([tag['label'] for tag in TaggedItem.objects.get_tag_cloud(User)], ['red'])